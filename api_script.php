@@ -46,6 +46,8 @@ if ($action === 'help') {
             "update_apk_original" => "POST ?action=update_apk_original&key=API_KEY - Обновить apk-original в dle_post",
             "add_tracking" => "POST ?action=add_tracking&key=API_KEY - Добавить в таблицу отслеживания",
             "check_duplicate" => "GET ?action=check_duplicate&key=API_KEY - Проверить дубли файлов",
+            "get_tracking_history" => "GET ?action=get_tracking_history&key=API_KEY - История версий пакетов из file_tracking",
+            "get_download_validators" => "GET ?action=get_download_validators&news_id=ID&package_name=PACKAGE&key=API_KEY - ETag/размер/имя файла последнего скачивания",
             "get_storage_info" => "GET ?action=get_storage_info&id=ID&key=API_KEY - Получить информацию о хранилище",
             "check_mod_at" => "GET ?action=check_mod_at&id=ID&version=VERSION&key=API_KEY - Проверить версию в mod-at для parser2",
             "check_duplicate_mod" => "GET ?action=check_duplicate_mod&key=API_KEY - Проверить дубли для модифицированных приложений",
@@ -600,6 +602,9 @@ if ($action === 'add_tracking' && $_SERVER['REQUEST_METHOD'] === 'POST') {
     $package_name = $_POST['package_name'] ?? null;
     $source_priority = intval($_POST['source_priority'] ?? 0);
     $source_url = $_POST['source_url'] ?? '';
+    $remote_etag = $_POST['remote_etag'] ?? null;
+    $remote_size = isset($_POST['remote_size']) ? intval($_POST['remote_size']) : null;
+    $remote_filename = $_POST['remote_filename'] ?? null;
     
     if ($news_id <= 0 || !$app_name || !$version || !$file_path || !$checksum) {
         echo json_encode(["error" => "Недостаточно данных"]);
@@ -622,6 +627,9 @@ if ($action === 'add_tracking' && $_SERVER['REQUEST_METHOD'] === 'POST') {
             download_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
             source_url VARCHAR(500) NOT NULL,
+            remote_etag VARCHAR(255) NULL,
+            remote_size BIGINT NULL,
+            remote_filename VARCHAR(255) NULL,
             INDEX idx_news_id (news_id),
             INDEX idx_app_name (app_name),
             INDEX idx_sha256 (sha256_hash),
@@ -630,12 +638,15 @@ if ($action === 'add_tracking' && $_SERVER['REQUEST_METHOD'] === 'POST') {
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
     ";
     $mysqli->query($create_table);
+    ensure_tracking_validator_columns($mysqli);
     
     $stmt = $mysqli->prepare("
-        INSERT INTO file_tracking (news_id, app_name, version, file_size, file_path, checksum, sha256_hash, package_name, source_priority, source_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO file_tracking (news_id, app_name, version, file_size, file_path, checksum, sha256_hash, package_name, source_priority, source_url,
+                                   remote_etag, remote_size, remote_filename)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ");
-    $stmt->bind_param("ississssis", $news_id, $app_name, $version, $file_size, $file_path, $checksum, $sha256_hash, $package_name, $source_priority, $source_url);
+    $stmt->bind_param("ississssissis", $news_id, $app_name, $version, $file_size, $file_path, $checksum, $sha256_hash, $package_name, $source_priority, $source_url,
+                      $remote_etag, $remote_size, $remote_filename);
     
     if ($stmt->execute()) {
         echo json_encode([
@@ -649,6 +660,95 @@ if ($action === 'add_tracking' && $_SERVER['REQUEST_METHOD'] === 'POST') {
     exit;
 }
 
+// Колонки валидаторов файла для таблиц file_tracking, созданных до их появления
+function ensure_tracking_validator_columns($mysqli) {
+    $columns = [
+        'remote_etag' => "VARCHAR(255) NULL",
+        'remote_size' => "BIGINT NULL",
+        'remote_filename' => "VARCHAR(255) NULL"
+    ];
+    
+    $existing = [];
+    $result = $mysqli->query("SHOW COLUMNS FROM file_tracking");
+    if (!$result) {
+        return;
+    }
+    while ($row = $result->fetch_assoc()) {
+        $existing[] = $row['Field'];
+    }
+    
+    foreach ($columns as $column => $definition) {
+        if (!in_array($column, $existing)) {
+            $mysqli->query("ALTER TABLE file_tracking ADD COLUMN $column $definition");
+        }
+    }
+}
+
+// 📌 Валидаторы файла последнего скачивания для проверки перед повторным
+if ($action === 'get_download_validators') {
+    $news_id = intval($_GET['news_id'] ?? 0);
+    $package_name = $_GET['package_name'] ?? null;
+    
+    if ($news_id <= 0) {
+        echo json_encode(["error" => "Недостаточно данных"]);
+        exit;
+    }
+    
+    ensure_tracking_validator_columns($mysqli);
+    
+    $query = "
+        SELECT version, file_size, checksum, remote_etag, remote_size, remote_filename
+        FROM file_tracking
+        WHERE news_id = ?
+    ";
+    if ($package_name) {
+        $stmt = $mysqli->prepare($query . " AND package_name = ? ORDER BY id DESC LIMIT 1");
+        $stmt->bind_param("is", $news_id, $package_name);
+    } else {
+        $stmt = $mysqli->prepare($query . " ORDER BY id DESC LIMIT 1");
+        $stmt->bind_param("i", $news_id);
+    }
+    $stmt->execute();
+    $row = $stmt->get_result()->fetch_assoc();
+    
+    // Запись без валидаторов (скачана браузером или до их появления) не годится для сравнения
+    $validators = ($row && ($row['remote_etag'] || $row['remote_size'])) ? $row : null;
+    
+    echo json_encode([
+        "success" => true,
+        "validators" => $validators
+    ], JSON_UNESCAPED_UNICODE);
+    exit;
+}
+
+// 📌 История версий пакетов для расписания перепроверки
+if ($action === 'get_tracking_history') {
+    $result = $mysqli->query("
+        SELECT package_name, version, MIN(download_date) AS download_date
+        FROM file_tracking
+        WHERE package_name IS NOT NULL AND package_name != ''
+        GROUP BY package_name, version
+        ORDER BY package_name, download_date
+    ");
+    
+    if (!$result) {
+        echo json_encode(["error" => "Ошибка получения истории: " . $mysqli->error]);
+        exit;
+    }
+    
+    $history = [];
+    while ($row = $result->fetch_assoc()) {
+        $history[] = $row;
+    }
+    
+    echo json_encode([
+        "success" => true,
+        "history" => $history,
+        "count" => count($history)
+    ], JSON_UNESCAPED_UNICODE);
+    exit;
+}
+
 // 📌 Проверка дублей файлов
 if ($action === 'check_duplicate') {
     $news_id = intval($_GET['news_id'] ?? 0);
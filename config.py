@@ -18,11 +18,13 @@ BASE_DOWNLOAD_DIR = "/www/n2.anplus1.com/files"
 STORAGE_PATHS = {
     1: {
         'base_path': "/home2/n1/files",
-        'name': "Driver #1 (Store #1)"
+        'name': "Driver #1 (Store #1)",
+        'max_concurrent_writes': 2  # Одновременных загрузок в хранилище (0 - без лимита)
     },
     2: {
         'base_path': "/www/n2.anplus1.com/files", 
-        'name': "Driver #2 (Store #2)"
+        'name': "Driver #2 (Store #2)",
+        'max_concurrent_writes': 2  # Сюда пишет BASE_DOWNLOAD_DIR, этот же сервер отдает сайт
     }
 }
 
@@ -58,6 +60,9 @@ CREATE TABLE IF NOT EXISTS file_tracking (
     download_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     source_url VARCHAR(500) NOT NULL,
+    remote_etag VARCHAR(255) NULL,
+    remote_size BIGINT NULL,
+    remote_filename VARCHAR(255) NULL,
     INDEX idx_news_id (news_id),
     INDEX idx_app_name (app_name),
     INDEX idx_sha256 (sha256_hash),
@@ -66,6 +71,16 @@ CREATE TABLE IF NOT EXISTS file_tracking (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 """
 
+# Колонки валидаторов файла (добавляются в существующую таблицу file_tracking)
+TRACKING_VALIDATOR_COLUMNS = {
+    'remote_etag': "VARCHAR(255) NULL",
+    'remote_size': "BIGINT NULL",
+    'remote_filename': "VARCHAR(255) NULL"
+}
+
+# Проверка заголовков файла (HEAD) перед скачиванием: тот же файл не качается повторно
+DOWNLOAD_PRECHECK_ENABLED = True
+
 # Настройки браузера
 BROWSER_ARGS = [
     "--no-sandbox",
@@ -73,12 +88,87 @@ BROWSER_ARGS = [
     "--disable-dev-shm-usage"
 ]
 
+# Дополнительные аргументы запуска для общего пула браузеров
+BROWSER_EXTRA_ARGS = [
+    '--disable-extensions',
+    '--no-first-run',
+    '--disable-default-apps',
+    '--disable-features=TranslateUI',
+    '--disable-ipc-flooding-protection',
+    '--disable-web-security',
+    '--allow-running-insecure-content',
+    '--disable-features=VizDisplayCompositor'
+]
+
+# Пул браузеров
+BROWSER_POOL_SIZE = 2  # Сколько процессов Chromium держать одновременно
+BROWSER_MAX_PAGES = 8  # Максимум одновременно открытых страниц во всем пуле
+BROWSER_RECYCLE_AFTER_PAGES = 200  # Перезапуск браузера после стольких выданных страниц (0 - не ограничено)
+BROWSER_RSS_LIMIT_MB = 1500  # Перезапуск браузера при превышении RSS дерева процессов (нужен psutil, 0 - выкл.)
+
+# Постоянные профили браузера по доменам источников (HTTP-кэш, service worker, cookies между запусками)
+# В постоянных профилях RESOURCE_BLOCKING не действует: перехват запросов отключает HTTP-кэш
+PERSISTENT_PROFILES_ENABLED = False  # Включается явно
+PERSISTENT_PROFILE_DIR = "cache/browser_profiles"
+PERSISTENT_PROFILE_DOMAINS = ['apkcombo.com', 'apkpure.com']
+PERSISTENT_PROFILE_MAX_MB = 500  # При превышении кэши профиля очищаются перед запуском
+
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 
 # Таймауты
 CLOUDFLARE_TIMEOUT = 120
 PAGE_LOAD_TIMEOUT = 60000
 DOWNLOAD_TIMEOUT = 30
+# Потоковое скачивание файлов по HTTP
+STREAM_CHUNK_SIZE = 1024 * 1024  # Размер блока записи (байт)
+STREAM_READ_TIMEOUT = 60  # Таймаут чтения ответа (сек)
+STREAM_PROGRESS_INTERVAL = 10  # Как часто печатать прогресс (сек)
+STREAM_MAX_RETRIES = 3  # Попыток скачивания с продолжением с места обрыва (Range)
+STREAM_SIZE_TOLERANCE = 0.1  # Допустимое отличие Content-Length от размера на странице (доля, MB/MiB округления)
+# Скачивание больших файлов несколькими соединениями (нужен Accept-Ranges: bytes)
+SEGMENTED_DOWNLOAD_ENABLED = True
+SEGMENTED_MIN_SIZE = 64 * 1024 * 1024  # Файлы меньше качаются одним потоком (байт)
+SEGMENTED_BYTES_PER_CONNECTION = 32 * 1024 * 1024  # Одно соединение на каждые N байт файла
+SEGMENTED_MAX_CONNECTIONS = 8
+# Хосты, у которых ETag файла, загруженного одним куском, равен его MD5 (r2/S3)
+SEGMENTED_MD5_ETAG_HOSTS = ['r2.cloudflarestorage.com', 'r2.dev', 'amazonaws.com']
+APKPURE_DIRECT_DOWNLOAD = True  # Качать d.apkpure.com напрямую, браузер - только запасной путь
+# Общий лимит полосы для всех загрузок (МБ/с, 0 - без ограничения)
+BANDWIDTH_DAY_LIMIT_MBPS = 0
+BANDWIDTH_NIGHT_LIMIT_MBPS = 0
+BANDWIDTH_NIGHT_HOURS = (1, 7)  # Ночной лимит действует с 1:00 до 7:00 (локальное время)
+BANDWIDTH_BURST_SECONDS = 1  # Допустимый всплеск - столько секунд лимита
+BANDWIDTH_WINDOW_SECONDS = 5  # Окно расчета текущей скорости (сек)
+# Пул HTTP-сессий cloudscraper по хостам (keep-alive, TLS, решенные проверки)
+SESSION_POOL_MAX_PER_HOST = 4  # Свободных сессий на хост
+SESSION_POOL_MAX_SESSIONS = 16  # Свободных сессий всего
+SESSION_POOL_IDLE_TIMEOUT = 300  # Простаивающая сессия закрывается (сек)
+# Хранилище Cloudflare cookies (cf_clearance) между запусками
+CLEARANCE_STORE_FILE = "cache/cf_clearance.json"
+CLEARANCE_DEFAULT_TTL = 1800  # Срок жизни записи, если у cookie нет своего expires (сек)
+
+PROBE_DEADLINE = 180  # Дедлайн одной пробы версии со страницы (сек), включая Cloudflare
+# Результаты проб версий между запусками (SQLite)
+PROBE_STORE_FILE = "cache/probe_results.sqlite3"
+PROBE_FRESHNESS_WINDOW = 12 * 3600  # Успешная проба моложе этого окна переиспользуется без запроса (сек)
+
+# Адаптивное расписание перепроверки по истории обновлений приложения
+RECHECK_SCHEDULING_ENABLED = True
+RECHECK_FORCE = False  # True - проверять все строки, игнорируя расписание (или флаг --force-recheck)
+RECHECK_INTERVAL_FACTOR = 0.5  # Перепроверка с периодом = доля типичного интервала между обновлениями
+RECHECK_MIN_INTERVAL = 0  # Нижняя граница периода перепроверки (сек), 0 - каждый запуск
+RECHECK_MAX_INTERVAL = 14 * 24 * 3600  # Верхняя граница периода перепроверки (сек)
+RECHECK_MIN_HISTORY = 2  # Сколько смен версии нужно для оценки интервала
+
+# Быстрая проба версии по HTTP (cloudscraper + парсинг HTML) до запуска браузера
+HTTP_PROBE_ENABLED = True
+HTTP_PROBE_TIMEOUT = 20  # Таймаут HTTP-запроса страницы (сек)
+
+# Кэш страниц приложений на диске (HTML + найденная версия)
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_DIR = "cache/pages"
+PAGE_CACHE_TTL = 6 * 3600  # Сколько страница считается свежей без запроса (сек)
+PAGE_CACHE_MAX_BYTES = 200 * 1024 * 1024  # Предельный размер кэша, старые записи вытесняются (LRU)
 
 # Настройки производительности
 ENABLE_SHA256_CHECK = True  # Включить проверку SHA-256
@@ -86,3 +176,44 @@ ENABLE_FUZZY_MATCHING = True  # Включить fuzzy matching
 ENABLE_SIZE_CHECK = True  # Включить проверку по размеру
 ENABLE_DETAILED_LOGGING = True  # Включить детальное логирование
 
+
+# Параллельная обработка ссылок
+MAX_CONCURRENT_ITEMS = 8  # Сколько строк step4_links.txt находится в работе одновременно
+HOST_CONCURRENCY_LIMITS = {  # Максимум одновременных операций на один хост
+    'apkcombo.com': 2,
+    'apkpure.com': 2,
+    'd.apkpure.com': 2
+}
+
+# Конвейер обработки: число воркеров на каждом этапе
+PIPELINE_STAGE_WORKERS = {
+    'probe': 4,     # Получение версий со страниц
+    'check': 2,     # Проверка apk-original
+    'download': 2,  # Скачивание файлов
+    'hash': 1,      # Вычисление чексумм
+    'store': 1      # Обновление БД
+}
+PIPELINE_QUEUE_SIZE = 2  # Размер очереди между этапами (ограничивает память и диск)
+
+# Блокировка тяжелых ресурсов в контекстах браузера (кроме постоянных профилей)
+RESOURCE_BLOCKING = {
+    'enabled': True,
+    # Типы ресурсов Playwright, которые не нужны для чтения HTML и ссылок
+    'block_types': ['image', 'media', 'font', 'stylesheet'],
+    # Хосты аналитики и рекламы (блокируются для любых типов ресурсов)
+    'block_hosts': [
+        'google-analytics.com', 'googletagmanager.com', 'googlesyndication.com',
+        'doubleclick.net', 'adservice.google.com', 'amazon-adsystem.com',
+        'facebook.net', 'connect.facebook.net', 'mc.yandex.ru',
+        'hotjar.com', 'clarity.ms', 'criteo.com', 'taboola.com', 'outbrain.com',
+        'adnxs.com', 'scorecardresearch.com', 'quantserve.com', 'pubmatic.com'
+    ],
+    # Разрешенные запросы по доменам: '*' - все запросы хоста, иначе части URL
+    # (нужно для прохождения проверки Cloudflare)
+    'allowlist': {
+        'challenges.cloudflare.com': ['*'],
+        'apkcombo.com': ['/cdn-cgi/'],
+        'apkpure.com': ['/cdn-cgi/'],
+        'd.apkpure.com': ['*']
+    }
+}
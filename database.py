@@ -6,7 +6,7 @@ import time
 import re
 import mysql.connector
 from mysql.connector import Error
-from .config import DB_CONFIG, CREATE_TRACKING_TABLE, ENABLE_FUZZY_MATCHING, ENABLE_DETAILED_LOGGING
+from .config import DB_CONFIG, CREATE_TRACKING_TABLE, TRACKING_VALIDATOR_COLUMNS, ENABLE_FUZZY_MATCHING, ENABLE_DETAILED_LOGGING
 from .lib.version_utils import VersionUtils
 
 
@@ -26,6 +26,7 @@ class DatabaseManager:
                 # Создаем таблицу отслеживания если не существует
                 cursor = self.connection.cursor()
                 cursor.execute(CREATE_TRACKING_TABLE)
+                self.ensure_validator_columns(cursor)
                 self.connection.commit()
                 cursor.close()
 
@@ -34,6 +35,15 @@ class DatabaseManager:
             print(f"❌ Ошибка подключения к базе данных: {e}")
             return False
 
+    def ensure_validator_columns(self, cursor):
+        """Добавляем колонки валидаторов файла в таблицу, созданную до их появления"""
+        cursor.execute("SHOW COLUMNS FROM file_tracking")
+        existing = {row[0] for row in cursor.fetchall()}
+        for column, definition in TRACKING_VALIDATOR_COLUMNS.items():
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE file_tracking ADD COLUMN {column} {definition}")
+                print(f"🔧 В file_tracking добавлена колонка {column}")
+
     def disconnect(self):
         """Отключение от базы данных"""
         if self.connection and self.connection.is_connected():
@@ -311,18 +321,24 @@ class DatabaseManager:
         
         return result
 
-    def add_to_tracking(self, news_id, app_name, version, file_size, file_path, checksum, source_url, sha256_hash=None, package_name=None, source_priority=0):
-        """Добавляем запись в таблицу отслеживания с улучшенными полями"""
+    def add_to_tracking(self, news_id, app_name, version, file_size, file_path, checksum, source_url, sha256_hash=None, package_name=None, source_priority=0,
+                        remote_etag=None, remote_size=None, remote_filename=None):
+        """Добавляем запись в таблицу отслеживания с улучшенными полями
+
+        remote_* - ETag, размер и имя файла на сервере для проверки перед следующим скачиванием
+        """
         try:
             cursor = self.connection.cursor()
 
             insert_query = """
-            INSERT INTO file_tracking (news_id, app_name, version, file_size, file_path, checksum, sha256_hash, package_name, source_priority, source_url)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            INSERT INTO file_tracking (news_id, app_name, version, file_size, file_path, checksum, sha256_hash, package_name, source_priority, source_url,
+                                       remote_etag, remote_size, remote_filename)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
             """
 
             # В version записываем ТОЛЬКО версию, без названия приложения
-            values = (news_id, app_name, version, file_size, str(file_path), checksum, sha256_hash, package_name, source_priority, source_url)
+            values = (news_id, app_name, version, file_size, str(file_path), checksum, sha256_hash, package_name, source_priority, source_url,
+                      remote_etag, remote_size, remote_filename)
 
             cursor.execute(insert_query, values)
             self.connection.commit()
@@ -340,6 +356,47 @@ class DatabaseManager:
             print(f"❌ Ошибка добавления в tracking: {e}")
             return False
     
+    def get_download_validators(self, news_id, package_name=None):
+        """Валидаторы файла из последней записи file_tracking для news_id/package"""
+        try:
+            cursor = self.connection.cursor(dictionary=True)
+            query = """
+                SELECT version, file_size, checksum, remote_etag, remote_size, remote_filename
+                FROM file_tracking
+                WHERE news_id = %s
+            """
+            params = [news_id]
+            if package_name:
+                query += " AND package_name = %s"
+                params.append(package_name)
+            cursor.execute(query + " ORDER BY id DESC LIMIT 1", params)
+            row = cursor.fetchone()
+            cursor.close()
+            if row and (row.get('remote_etag') or row.get('remote_size')):
+                return row
+            return None
+        except Error as e:
+            print(f"❌ Ошибка получения валидаторов файла: {e}")
+            return None
+
+    def get_tracking_history(self):
+        """Получаем историю версий пакетов из file_tracking"""
+        try:
+            cursor = self.connection.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT package_name, version, MIN(download_date) AS download_date
+                FROM file_tracking
+                WHERE package_name IS NOT NULL AND package_name != ''
+                GROUP BY package_name, version
+                ORDER BY package_name, download_date
+            """)
+            history = cursor.fetchall()
+            cursor.close()
+            return history
+        except Error as e:
+            print(f"❌ Ошибка получения истории версий: {e}")
+            return []
+    
     def find_similar_apps(self, app_name, threshold=0.8):
         """Находим похожие приложения с помощью fuzzy matching с кэшированием"""
         # Проверяем кэш
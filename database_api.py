@@ -254,8 +254,12 @@ class DatabaseManagerAPI:
         
         return result
 
-    def add_to_tracking(self, news_id, app_name, version, file_size, file_path, checksum, source_url, sha256_hash=None, package_name=None, source_priority=0):
-        """Добавляем запись в таблицу отслеживания через API"""
+    def add_to_tracking(self, news_id, app_name, version, file_size, file_path, checksum, source_url, sha256_hash=None, package_name=None, source_priority=0,
+                        remote_etag=None, remote_size=None, remote_filename=None):
+        """Добавляем запись в таблицу отслеживания через API
+
+        remote_* - ETag, размер и имя файла на сервере для проверки перед следующим скачиванием
+        """
         try:
             data = {
                 "news_id": news_id,
@@ -272,6 +276,12 @@ class DatabaseManagerAPI:
                 data["sha256_hash"] = sha256_hash
             if package_name:
                 data["package_name"] = package_name
+            if remote_etag:
+                data["remote_etag"] = remote_etag
+            if remote_size:
+                data["remote_size"] = remote_size
+            if remote_filename:
+                data["remote_filename"] = remote_filename
             
             response = self.api_request("add_tracking", data=data)
             
@@ -292,6 +302,37 @@ class DatabaseManagerAPI:
             print(f"❌ Ошибка добавления в tracking: {e}")
             return False
     
+    def get_download_validators(self, news_id, package_name=None):
+        """Валидаторы файла из последней записи file_tracking для news_id/package через API"""
+        try:
+            params = {"news_id": news_id}
+            if package_name:
+                params["package_name"] = package_name
+            response = self.api_request("get_download_validators", params)
+            
+            if response.get("success"):
+                return response.get("validators")
+            
+            print(f"❌ Ошибка получения валидаторов файла: {response.get('error', 'Неизвестная ошибка')}")
+            return None
+        except Exception as e:
+            print(f"❌ Ошибка получения валидаторов файла: {e}")
+            return None
+    
+    def get_tracking_history(self):
+        """Получаем историю версий пакетов из file_tracking через API"""
+        try:
+            response = self.api_request("get_tracking_history")
+            
+            if response.get("success"):
+                return response.get("history", [])
+            
+            print(f"❌ Ошибка получения истории версий: {response.get('error', 'Неизвестная ошибка')}")
+            return []
+        except Exception as e:
+            print(f"❌ Ошибка получения истории версий: {e}")
+            return []
+    
     def find_similar_apps(self, app_name, threshold=0.8):
         """Находим похожие приложения с помощью fuzzy matching с кэшированием"""
         # Проверяем кэш
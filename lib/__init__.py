@@ -11,7 +11,9 @@ from .file_deleter import FileDeleter
 try:
     from .file_downloader import FileDownloader
     from .apkpure_downloader import APKPureDownloader
-    __all__ = ['FileNormalizer', 'FileDeleter', 'FileDownloader', 'APKPureDownloader']
+    from .browser_pool import BrowserPool, get_browser_pool
+    __all__ = ['FileNormalizer', 'FileDeleter', 'FileDownloader', 'APKPureDownloader',
+               'BrowserPool', 'get_browser_pool']
 except ImportError:
     # Если зависимости не установлены, доступны только FileNormalizer и FileDeleter
     __all__ = ['FileNormalizer', 'FileDeleter']
@@ -4,19 +4,27 @@
 Интегрирован в систему обработки файлов
 """
 import asyncio
-import os
+import contextlib
 import re
 import hashlib
 from pathlib import Path
 from datetime import datetime
-from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
-from ..config import BROWSER_ARGS, USER_AGENT, CLOUDFLARE_TIMEOUT, PAGE_LOAD_TIMEOUT, DOWNLOAD_TIMEOUT
+from ..config import USER_AGENT, PAGE_LOAD_TIMEOUT, APKPURE_DIRECT_DOWNLOAD
 from .file_normalizer import FileNormalizer
+from .browser_pool import get_browser_pool, STEALTH_INIT_SCRIPT
+from .cloudflare import get_clearance_store
+from .stream_downloader import StreamDownloader
+from .session_pool import get_session_pool
 
 
 class APKPureDownloader:
-    def __init__(self, download_dir):
+    def __init__(self, download_dir, host_limiter=None, browser_pool=None):
         self.download_dir = download_dir
+        self.host_limiter = host_limiter  # Общий лимит запросов к d.apkpure.com
+        self.browser_pool = browser_pool or get_browser_pool()
+        self.clearance_store = get_clearance_store()
+        self.stream_downloader = StreamDownloader()
+        self.session_pool = get_session_pool()
 
     def extract_package_name(self, url):
         """Извлекает package name из URL APKPure"""
@@ -45,30 +53,17 @@ class APKPureDownloader:
         """Нормализуем имя файла согласно требованиям"""
         return FileNormalizer.normalize_filename(filename)
 
-    async def setup_browser(self):
-        """Настройка браузера с настройками для скачивания"""
-        self.playwright = await async_playwright().start()
-        self.browser = await self.playwright.chromium.launch(
-            headless=True,
-            args=BROWSER_ARGS + [
-                '--disable-extensions',
-                '--no-first-run',
-                '--disable-default-apps',
-                '--disable-features=TranslateUI',
-                '--disable-ipc-flooding-protection',
-                '--disable-web-security',
-                '--allow-running-insecure-content',
-                '--disable-features=VizDisplayCompositor'
-            ]
-        )
-
-        # Создаем контекст с настройками для скачивания
-        self.context = await self.browser.new_context(
+    async def setup_browser(self, app_url=None):
+        """Получаем страницу из общего пула браузеров с настройками для скачивания"""
+        # Контекст с настройками для скачивания и скрытием автоматизации
+        self.page = await self.browser_pool.acquire_page(
+            accept_downloads=True,
+            init_script=STEALTH_INIT_SCRIPT,
+            profile_url=app_url,
             viewport={'width': 1920, 'height': 1080},
             user_agent=USER_AGENT,
             locale='ru-RU',
             timezone_id='Europe/Moscow',
-            accept_downloads=True,
             extra_http_headers={
                 'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
                 'Accept-Language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7',
@@ -81,87 +76,109 @@ class APKPureDownloader:
                 'Upgrade-Insecure-Requests': '1'
             }
         )
+        self.context = self.page.context
 
-        self.page = await self.context.new_page()
-
-        # Скрываем автоматизацию
-        await self.page.add_init_script("""
-            Object.defineProperty(navigator, 'webdriver', {
-                get: () => undefined,
-            });
+    async def wait_for_any_selector(self, selectors, timeout):
+        """Ждем появления любого из селекторов; по таймауту просто продолжаем"""
+        try:
+            await self.page.wait_for_selector(", ".join(selectors), state='attached', timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    # Селекторы версии на странице приложения/скачивания APKPure
+    VERSION_SELECTORS = [
+        "meta[itemprop='softwareVersion']",
+        '.version-number',
+        '.version-name',
+        '.version',
+        '[data-dt-version]',
+        '.apk-version',
+        '.app-version'
+    ]
+
+    # Одна проверка в странице: версия, форматы и их размеры
+    DOWNLOAD_PAGE_SNAPSHOT_JS = """
+        (versionSelectors) => {
+            const result = {version_text: null, title: document.title || '', formats: [], sizes: {}};
+
+            for (const selector of versionSelectors) {
+                const element = document.querySelector(selector);
+                if (!element) continue;
+                const text = element.getAttribute('content') || element.getAttribute('data-dt-version')
+                    || element.textContent || '';
+                if (/\\d+\\.\\d+/.test(text)) {
+                    result.version_text = text.trim();
+                    break;
+                }
+            }
 
-            window.chrome = {
-                runtime: {},
+            const isVisible = (element) => {
+                if (!element) return false;
+                const style = window.getComputedStyle(element);
+                const rect = element.getBoundingClientRect();
+                return style.visibility !== 'hidden' && rect.width > 0 && rect.height > 0;
             };
-
-            Object.defineProperty(navigator, 'plugins', {
-                get: () => [1, 2, 3, 4, 5],
+            // Блоки форматов учитываем, только если они видны (скрытые варианты не предлагаются)
+            const formatBlocks = [document.querySelector('#version-list'), document.querySelector('.show-more')]
+                .filter(isVisible);
+
+            const knownFormats = ['APK', 'XAPK', 'APKS'];
+            document.querySelectorAll('span.tag[data-tag]').forEach(tag => {
+                const format = (tag.getAttribute('data-tag') || '').toUpperCase();
+                if (!format) return;
+                // В видимых блоках version-list и show-more берем все теги, в остальных местах - только форматы файлов
+                const inFormatBlock = formatBlocks.some(block => block.contains(tag));
+                if (!inFormatBlock && !knownFormats.includes(format)) return;
+                if (!result.formats.includes(format)) result.formats.push(format);
+
+                const container = tag.closest('a, li') || tag.parentElement;
+                const sizeMatch = container && (container.textContent || '').match(/(\\d+(?:[.,]\\d+)?)\\s*(KB|MB|GB)/i);
+                if (sizeMatch && !(format in result.sizes)) {
+                    result.sizes[format] = sizeMatch[1].replace(',', '.') + ' ' + sizeMatch[2].toUpperCase();
+                }
             });
 
-            Object.defineProperty(navigator, 'languages', {
-                get: () => ['ru-RU', 'ru', 'en-US', 'en'],
-            });
-        """)
+            return result;
+        }
+    """
 
-    async def check_available_formats(self, app_url):
-        """Проверяет доступные форматы на странице скачивания"""
+    async def read_download_page(self, app_url):
+        """Одна навигация на страницу скачивания: версия, форматы и размеры файлов"""
+        snapshot = {'version': None, 'formats': set(), 'sizes': {}}
         try:
             # Переходим на страницу скачивания
             download_url = app_url
             if not download_url.endswith('/download'):
                 download_url = download_url.rstrip('/') + '/download'
 
-            print(f"🔍 Проверяем доступные форматы: {download_url}")
+            print(f"🔍 Читаем страницу скачивания: {download_url}")
             await self.page.goto(download_url, wait_until='domcontentloaded', timeout=PAGE_LOAD_TIMEOUT)
 
-            # Ждем загрузки страницы
-            await self.page.wait_for_timeout(3000)
+            # Ждем появления тегов форматов (не дольше прежних 3 сек)
+            await self.wait_for_any_selector(['#version-list', 'span.tag[data-tag]'], timeout=3000)
 
-            available_formats = set()
+            data = await self.page.evaluate(self.DOWNLOAD_PAGE_SNAPSHOT_JS, self.VERSION_SELECTORS)
 
-            # Ищем в блоке version-list
-            try:
-                version_list = await self.page.locator('#version-list').first
-                if await version_list.is_visible():
-                    tags = await version_list.locator('span.tag[data-tag]').all()
-                    for tag in tags:
-                        tag_value = await tag.get_attribute('data-tag')
-                        if tag_value:
-                            available_formats.add(tag_value.upper())
-                            print(f"📦 Найден формат в version-list: {tag_value}")
-            except:
-                pass
-
-            # Ищем в блоке show-more
-            try:
-                show_more = await self.page.locator('.show-more').first
-                if await show_more.is_visible():
-                    tags = await show_more.locator('span.tag[data-tag]').all()
-                    for tag in tags:
-                        tag_value = await tag.get_attribute('data-tag')
-                        if tag_value:
-                            available_formats.add(tag_value.upper())
-                            print(f"📦 Найден формат в show-more: {tag_value}")
-            except:
-                pass
+            # Версия: из блока версии, иначе из заголовка страницы
+            for text in (data.get('version_text'), data.get('title')):
+                version_match = re.search(r'(\d+\.\d+\.\d+)', text or '')
+                if version_match:
+                    snapshot['version'] = version_match.group(1)
+                    break
 
-            # Ищем в любых других местах
-            try:
-                all_tags = await self.page.locator('span.tag[data-tag]').all()
-                for tag in all_tags:
-                    tag_value = await tag.get_attribute('data-tag')
-                    if tag_value and tag_value.upper() in ['APK', 'XAPK', 'APKS']:
-                        available_formats.add(tag_value.upper())
-                        print(f"📦 Найден формат: {tag_value}")
-            except:
-                pass
+            snapshot['formats'] = set(data.get('formats', []))
+            snapshot['sizes'] = data.get('sizes', {})
 
-            print(f"🎯 Доступные форматы: {', '.join(sorted(available_formats))}")
-            return available_formats
+            print(f"🏷️ Версия на странице: {snapshot['version'] or 'не найдена'}")
+            for file_format in sorted(snapshot['formats']):
+                print(f"📦 Найден формат: {file_format} ({snapshot['sizes'].get(file_format, 'размер неизвестен')})")
+            print(f"🎯 Доступные форматы: {', '.join(sorted(snapshot['formats']))}")
 
         except Exception as e:
-            print(f"⚠️ Ошибка при проверке форматов: {e}")
-            return set()
+            print(f"⚠️ Ошибка при чтении страницы скачивания: {e}")
+
+        return snapshot
 
     def determine_download_priority(self, available_formats):
         """Определяет приоритет скачивания на основе доступных форматов"""
@@ -188,81 +205,99 @@ class APKPureDownloader:
             print("⚠️ Priority: APK (fallback)")
             return 'APK'
 
-    async def extract_version_from_page(self, app_url):
-        """Extract version from APKPure app page"""
+    def default_filename(self, file_type):
+        """Имя файла, если сервер его не передал"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        ext = '.xapk' if file_type == 'XAPK' else '.apk'
+        return f"App_{timestamp}{ext}"
+
+    def build_filename(self, filename, file_type):
+        """Имя сохраняемого файла с правильным расширением"""
+        if not filename:
+            filename = self.default_filename(file_type)
+
+        # Убеждаемся, что расширение правильное
+        if not filename.lower().endswith(('.apk', '.xapk')):
+            filename += '.xapk' if file_type == 'XAPK' else '.apk'
+
+        return self.normalize_filename(filename)
+
+    async def _copy_browser_session(self, session):
+        """Переносим cookies и User-Agent браузера в HTTP-сессию"""
+        if not getattr(self, 'page', None):
+            return False
         try:
-            # Remove /download from URL if present
-            page_url = app_url.replace('/download', '')
-            
-            print(f"🔍 Getting version from page: {page_url}")
-            await self.page.goto(page_url, wait_until='domcontentloaded', timeout=PAGE_LOAD_TIMEOUT)
-            
-            # Wait for page load
-            await self.page.wait_for_timeout(2000)
-            
-            # Search for version in various places
-            version_selectors = [
-                '.version-number',
-                '.version',
-                '[data-dt-version]',
-                '.apk-version',
-                '.app-version'
-            ]
-            
-            for selector in version_selectors:
-                try:
-                    element = await self.page.query_selector(selector)
-                    if element:
-                        version_text = await element.inner_text()
-                        # Extract only version number
-                        version_match = re.search(r'(\d+\.\d+\.\d+)', version_text)
-                        if version_match:
-                            version = version_match.group(1)
-                            print(f"✅ Found version on APKPure page: {version}")
-                            return version
-                except:
-                    continue
-            
-            print("⚠️ Version not found on APKPure page")
-            return None
-            
+            for cookie in await self.page.context.cookies():
+                session.cookies.set(cookie['name'], cookie['value'],
+                                    domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+            session.headers['User-Agent'] = await self.page.evaluate("navigator.userAgent")
+            return True
         except Exception as e:
-            print(f"❌ Error getting version from APKPure page: {e}")
+            print(f"⚠️ Не удалось получить cookies браузера: {e}")
+            return False
+
+    def is_unchanged(self, download_url, known_validators):
+        """HEAD-проверка ссылки d.apkpure.com: тот же файл, что скачан в прошлый раз"""
+        session = self.session_pool.acquire(download_url)
+        try:
+            self.clearance_store.apply_to_session(session, download_url)
+            return self.stream_downloader.is_unchanged(session, download_url, known_validators)
+        finally:
+            self.session_pool.release(download_url, session)
+
+    async def download_direct(self, download_url, file_type, file_info=None, expected_size=None):
+        """Прямое потоковое скачивание с d.apkpure.com без события download браузера"""
+        session = self.session_pool.acquire(download_url)
+        self.clearance_store.apply_to_session(session, download_url)
+
+        def run_download():
+            return self.stream_downloader.download(
+                session, download_url, self.download_dir,
+                default_name=self.default_filename(file_type),
+                filename_normalizer=lambda name: self.build_filename(name, file_type),
+                file_info=file_info, expected_size=expected_size
+            )
+
+        print(f"⚡ Прямое скачивание {file_type}: {download_url}")
+        result = StreamDownloader.ERROR
+        try:
+            filepath, result = await asyncio.to_thread(run_download)
+
+            # Запрос заблокирован - повторяем с cookies и User-Agent браузера
+            if result == StreamDownloader.BLOCKED and await self._copy_browser_session(session):
+                print("🍪 Повторяем прямое скачивание с cookies браузера")
+                filepath, result = await asyncio.to_thread(run_download)
+
+            if result == StreamDownloader.OK:
+                self.clearance_store.save_from_session(session, download_url)
+                return filepath
             return None
+        finally:
+            self.session_pool.release(download_url, session, discard=result == StreamDownloader.BLOCKED)
 
-    async def download_file(self, file_type, package_name):
+    async def download_file(self, file_type, package_name, file_info=None, expected_size=None,
+                            known_validators=None):
         """Скачивание файла указанного типа"""
         try:
             print(f"🚀 Начинаем скачивание {file_type} с APKPure...")
 
             # Настраиваем обработчик скачивания
-            download_info = {'downloads': [], 'completed_files': []}
+            download_info = {
+                'downloads': [],
+                'completed_files': [],
+                'started': asyncio.Event(),   # Событие download получено
+                'finished': asyncio.Event()   # save_as завершен (успешно или нет)
+            }
 
             async def handle_download(download):
                 try:
                     filename = download.suggested_filename
                     print(f"📥 Начато скачивание: {filename}")
                     download_info['downloads'].append(download)
+                    download_info['started'].set()
 
-                    # Определяем путь для сохранения
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-                    if filename:
-                        suggested_name = filename
-                    else:
-                        ext = '.xapk' if file_type == 'XAPK' else '.apk'
-                        suggested_name = f"App_{timestamp}{ext}"
-
-                    # Убеждаемся, что расширение правильное
-                    if not suggested_name.lower().endswith(('.apk', '.xapk')):
-                        if file_type == 'XAPK':
-                            suggested_name += '.xapk'
-                        else:
-                            suggested_name += '.apk'
-
-                    # Нормализуем имя файла
-                    normalized_name = self.normalize_filename(suggested_name)
-                    filepath = self.download_dir / normalized_name
+                    # Определяем путь для сохранения (с нормализацией имени)
+                    filepath = self.download_dir / self.build_filename(filename, file_type)
                     
                     print(f"💾 Сохраняем как: {filepath}")
 
@@ -294,6 +329,8 @@ class APKPureDownloader:
 
                 except Exception as e:
                     print(f"⚠️ Ошибка в обработчике скачивания: {e}")
+                finally:
+                    download_info['finished'].set()
 
             # Подключаем обработчик скачивания
             self.page.on("download", handle_download)
@@ -301,6 +338,36 @@ class APKPureDownloader:
             # Формируем URL для скачивания
             download_url = f"https://d.apkpure.com/b/{file_type}/{package_name}?version=latest"
 
+            if self.host_limiter:
+                async with self.host_limiter.limit(download_url):
+                    return await self._download_direct_or_browser(download_url, file_type, download_info,
+                                                                  file_info, expected_size, known_validators)
+            return await self._download_direct_or_browser(download_url, file_type, download_info,
+                                                          file_info, expected_size, known_validators)
+
+        except Exception as e:
+            print(f"❌ Ошибка при скачивании {file_type}: {e}")
+            return None, None
+
+    async def _download_direct_or_browser(self, download_url, file_type, download_info, file_info=None,
+                                          expected_size=None, known_validators=None):
+        """Сначала прямое HTTP-скачивание, браузер - только если запрос заблокирован"""
+        # Файл не изменился с прошлого скачивания - не качаем ни напрямую, ни браузером
+        if known_validators and await asyncio.to_thread(self.is_unchanged, download_url, known_validators):
+            if file_info is not None:
+                file_info['unchanged'] = True
+            return None, None
+
+        if APKPURE_DIRECT_DOWNLOAD:
+            downloaded_path = await self.download_direct(download_url, file_type, file_info, expected_size)
+            if downloaded_path:
+                return downloaded_path, "Unknown"
+            print(f"🌐 Прямое скачивание {file_type} не удалось, используем браузер")
+        return await self._download_from_url(download_url, file_type, download_info)
+
+    async def _download_from_url(self, download_url, file_type, download_info):
+        """Переход по ссылке d.apkpure.com и ожидание завершения скачивания"""
+        try:
             print(f"🔗 Скачиваем {file_type}: {download_url}")
 
             # Переходим по ссылке скачивания
@@ -313,26 +380,25 @@ class APKPureDownloader:
                     print(f"⚠️ Ошибка перехода: {goto_error}")
                     return None, None
 
-            # Ждем начала скачивания
-            wait_time = 0
-            while wait_time < 15 and not download_info['downloads']:
-                await self.page.wait_for_timeout(1000)
-                wait_time += 1
+            # Ждем события download (до 15 сек)
+            try:
+                await asyncio.wait_for(download_info['started'].wait(), timeout=15)
+            except asyncio.TimeoutError:
+                pass
 
             if download_info['downloads']:
                 print(f"📥 {file_type} скачивание обнаружено, ожидаем завершения...")
 
-                # Ждем завершения скачивания
+                # Ждем завершения save_as (до 300 сек), прогресс раз в 30 сек
                 wait_time = 0
-                while wait_time < 300 and not download_info['completed_files']:
-                    await self.page.wait_for_timeout(1000)
-                    wait_time += 1
-
-                    if wait_time % 30 == 0:
+                while wait_time < 300 and not download_info['finished'].is_set():
+                    try:
+                        await asyncio.wait_for(download_info['finished'].wait(), timeout=30)
+                    except asyncio.TimeoutError:
+                        wait_time += 30
                         print(f"⏳ Ожидание: {wait_time}с")
 
                 if download_info['completed_files']:
-                    await self.page.wait_for_timeout(3000)  # Дополнительное ожидание
                     downloaded_path = download_info['completed_files'][0]
                     return Path(downloaded_path), "Unknown"  # Возвращаем Path и версию
 
@@ -344,38 +410,27 @@ class APKPureDownloader:
             return None, None
 
     async def cleanup(self):
-        """Безопасная очистка ресурсов"""
+        """Безопасная очистка ресурсов: возвращаем страницу в пул"""
+        page = getattr(self, 'page', None)
+        if page is None:
+            return
+        # Ссылки сбрасываем в любом случае, чтобы не держать страницу упавшего элемента
+        del self.page
+        self.context = None
         try:
-            await asyncio.sleep(2)
-
-            if hasattr(self, 'page'):
-                try:
-                    await self.page.close()
-                except:
-                    pass
-
-            if hasattr(self, 'context'):
-                try:
-                    await self.context.close()
-                except:
-                    pass
-
-            if hasattr(self, 'browser'):
-                try:
-                    await self.browser.close()
-                except:
-                    pass
-
-            if hasattr(self, 'playwright'):
-                try:
-                    await self.playwright.stop()
-                except:
-                    pass
+            await self.browser_pool.release_page(page)
         except Exception as e:
-            print(f"⚠️ Ошибка при очистке APKPure: {e}")
+            # Страница не вернулась в пул: пул перезапустит браузер и завершит его процессы
+            print(f"❌ Ошибка при очистке APKPure: {type(e).__name__}: {e}")
+            await self.browser_pool.reap_orphans()
 
-    async def download_from_apkpure(self, app_url):
-        """Основной метод скачивания с APKPure"""
+    async def download_from_apkpure(self, app_url, page_version=None, file_info=None, known_validators=None):
+        """Основной метод скачивания с APKPure
+
+        page_version - версия, уже полученная пробой страницы (повторно страница не открывается)
+        file_info - словарь, куда прямое скачивание кладет checksum, sha256_hash и file_size
+        known_validators - валидаторы файла из file_tracking для проверки перед скачиванием
+        """
         try:
             print("🎭 Запуск APKPure загрузчика")
             print(f"📱 Приложение: {app_url}")
@@ -384,18 +439,20 @@ class APKPureDownloader:
             package_name = self.extract_package_name(app_url)
             print(f"📦 Package: {package_name}")
 
-            # Настройка браузера
-            await self.setup_browser()
+            # Слот apkpure.com - только на страницы сайта; скачивание с d.apkpure.com
+            # ограничивается своим лимитом в download_file
+            async with self.host_limiter.limit(app_url) if self.host_limiter else contextlib.nullcontext():
+                # Настройка браузера
+                await self.setup_browser(app_url)
 
-            # Получаем версию со страницы
-            try:
-                page_version = await self.extract_version_from_page(app_url)
-            except Exception as e:
-                print(f"⚠️ Ошибка получения версии: {e}")
-                page_version = None
+                # Одна навигация: версия, доступные форматы и размеры
+                snapshot = await self.read_download_page(app_url)
+            if page_version:
+                print(f"⏩ Версия {page_version} уже известна по пробе страницы")
+            else:
+                page_version = snapshot['version']
 
-            # Проверяем доступные форматы
-            available_formats = await self.check_available_formats(app_url)
+            available_formats = snapshot['formats']
 
             if not available_formats:
                 print("⚠️ Не удалось определить доступные форматы, пробуем APK")
@@ -405,7 +462,10 @@ class APKPureDownloader:
                 file_type = self.determine_download_priority(available_formats)
 
             # Скачиваем выбранный формат
-            downloaded_file, download_version = await self.download_file(file_type, package_name)
+            # Размер формата со страницы - для ранней проверки ответа d.apkpure.com
+            expected_size = StreamDownloader.parse_size(snapshot['sizes'].get(file_type))
+            downloaded_file, download_version = await self.download_file(file_type, package_name, file_info,
+                                                                         expected_size, known_validators)
 
             if downloaded_file and downloaded_file.exists():
                 print("=" * 60)
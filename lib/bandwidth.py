@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Общий бюджет полосы и записи на диск для всех загрузок
+Токен-бакет с дневным и ночным лимитом делится между всеми потоками
+скачивания, число одновременных записей ограничивается по хранилищам
+STORAGE_PATHS, текущая скорость попадает в метрики прогона
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
+from ..config import BANDWIDTH_DAY_LIMIT_MBPS, BANDWIDTH_NIGHT_LIMIT_MBPS, BANDWIDTH_NIGHT_HOURS
+from ..config import BANDWIDTH_BURST_SECONDS, BANDWIDTH_WINDOW_SECONDS, STORAGE_PATHS
+
+
+class BandwidthLimiter:
+    """Токен-бакет на все загрузки процесса и лимиты записи по хранилищам
+
+    consume() вызывается потоками скачивания после каждого блока: при превышении
+    лимита поток спит ровно столько, сколько нужно для возврата к заданной скорости.
+    """
+
+    def __init__(self, day_limit_mbps=BANDWIDTH_DAY_LIMIT_MBPS, night_limit_mbps=BANDWIDTH_NIGHT_LIMIT_MBPS,
+                 night_hours=BANDWIDTH_NIGHT_HOURS, burst_seconds=BANDWIDTH_BURST_SECONDS,
+                 window_seconds=BANDWIDTH_WINDOW_SECONDS, storage_paths=STORAGE_PATHS):
+        self.day_limit_mbps = day_limit_mbps
+        self.night_limit_mbps = night_limit_mbps
+        self.night_hours = night_hours
+        self.burst_seconds = burst_seconds
+        self.window_seconds = window_seconds
+        self.storage_paths = storage_paths
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._updated = time.monotonic()
+        self._window = deque()  # (время, байт) за последние window_seconds
+        self._started = None
+        self._storage_semaphores = {}
+        self.stats = {
+            'bytes': 0, 'throttled_seconds': 0.0, 'throttle_waits': 0,
+            'peak_mbps': 0.0, 'storage_waits': 0, 'storage_wait_seconds': 0.0
+        }
+
+    def is_night(self, hour=None) -> bool:
+        """Ночные часы [начало, конец), диапазон может переходить через полночь"""
+        start, end = self.night_hours
+        hour = time.localtime().tm_hour if hour is None else hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    def get_rate(self) -> float:
+        """Текущий лимит в байтах в секунду (0 - без ограничения)"""
+        limit_mbps = self.night_limit_mbps if self.is_night() else self.day_limit_mbps
+        return max(0, limit_mbps) * 1024 * 1024
+
+    def _record_locked(self, size, now):
+        """Учитываем байты в скользящем окне для текущей скорости"""
+        if self._started is None:
+            self._started = now
+        self.stats['bytes'] += size
+        self._window.append((now, size))
+        while self._window and now - self._window[0][0] > self.window_seconds:
+            self._window.popleft()
+        current = self._current_mbps_locked(now)
+        if current > self.stats['peak_mbps']:
+            self.stats['peak_mbps'] = current
+
+    def _current_mbps_locked(self, now):
+        """Скорость за окно (МБ/с)"""
+        if not self._window:
+            return 0.0
+        span = max(now - self._window[0][0], 1.0)
+        return sum(size for _, size in self._window) / span / 1024 / 1024
+
+    def consume(self, size: int):
+        """Списываем size байт из бакета, при нехватке токенов ждем (вызывается из потоков)"""
+        with self._lock:
+            now = time.monotonic()
+            self._record_locked(size, now)
+            rate = self.get_rate()
+            if not rate:
+                self._tokens = None
+                return
+
+            capacity = rate * self.burst_seconds
+            if self._tokens is None:
+                self._tokens = capacity
+            else:
+                self._tokens = min(capacity, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            # Токены уходят в минус: каждый поток отрабатывает свой долг сном
+            self._tokens -= size
+            wait = -self._tokens / rate if self._tokens < 0 else 0
+            if wait:
+                self.stats['throttle_waits'] += 1
+                self.stats['throttled_seconds'] += wait
+
+        if wait:
+            time.sleep(wait)
+
+    def get_current_mbps(self) -> float:
+        """Текущая суммарная скорость всех загрузок (МБ/с)"""
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0][0] > self.window_seconds:
+                self._window.popleft()
+            return self._current_mbps_locked(now)
+
+    def get_stats(self) -> dict:
+        """Снимок метрик для run_stats: объем, средняя, текущая и пиковая скорость"""
+        current_mbps = self.get_current_mbps()
+        with self._lock:
+            elapsed = time.monotonic() - self._started if self._started is not None else 0
+            stats = dict(self.stats)
+        stats['mb'] = round(stats.pop('bytes') / 1024 / 1024, 1)
+        stats['average_mbps'] = round(stats['mb'] / elapsed, 2) if elapsed else 0.0
+        stats['current_mbps'] = round(current_mbps, 2)
+        stats['peak_mbps'] = round(stats['peak_mbps'], 2)
+        stats['throttled_seconds'] = round(stats['throttled_seconds'], 1)
+        stats['storage_wait_seconds'] = round(stats['storage_wait_seconds'], 1)
+        stats['limit_mbps'] = round(self.get_rate() / 1024 / 1024, 1)
+        return stats
+
+    def get_storage_driver(self, path) -> Optional[int]:
+        """Находим хранилище STORAGE_PATHS, в которое пишется путь (самый длинный base_path)"""
+        path = Path(path).resolve()
+        matches = [
+            (len(Path(config['base_path']).parts), driver)
+            for driver, config in self.storage_paths.items()
+            if path == Path(config['base_path']).resolve() or Path(config['base_path']).resolve() in path.parents
+        ]
+        return max(matches)[1] if matches else None
+
+    @asynccontextmanager
+    async def storage_slot(self, path):
+        """Занимаем слот записи хранилища на время скачивания"""
+        driver = self.get_storage_driver(path)
+        limit = self.storage_paths[driver].get('max_concurrent_writes', 0) if driver is not None else 0
+        if not limit:
+            yield
+            return
+
+        semaphore = self._storage_semaphores.get(driver)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(limit)
+            self._storage_semaphores[driver] = semaphore
+
+        if semaphore.locked():
+            print(f"⏳ Ждем слот записи в {self.storage_paths[driver]['name']} (максимум {limit})")
+            started = time.monotonic()
+            async with semaphore:
+                self.stats['storage_waits'] += 1
+                self.stats['storage_wait_seconds'] += time.monotonic() - started
+                yield
+            return
+
+        async with semaphore:
+            yield
+
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+
+def get_bandwidth_limiter() -> BandwidthLimiter:
+    """Получаем общий для процесса ограничитель полосы"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = BandwidthLimiter()
+    return _shared_limiter
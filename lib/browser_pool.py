@@ -0,0 +1,517 @@
+#!/usr/bin/env python3
+"""
+Общий пул браузеров Chromium для VersionExtractor, FileDownloader и APKPureDownloader
+Браузеры запускаются один раз за прогон, каждому потребителю выдается
+отдельная страница в изолированном контексте. Браузеры перезапускаются после
+заданного числа страниц или при превышении лимита памяти, оставшиеся
+процессы Chromium завершаются принудительно
+"""
+import asyncio
+import os
+import shutil
+from contextlib import asynccontextmanager
+from pathlib import Path
+from playwright.async_api import async_playwright
+from ..config import BROWSER_ARGS, BROWSER_EXTRA_ARGS, USER_AGENT, BROWSER_POOL_SIZE, BROWSER_MAX_PAGES
+from ..config import BROWSER_RECYCLE_AFTER_PAGES, BROWSER_RSS_LIMIT_MB
+from ..config import (PERSISTENT_PROFILES_ENABLED, PERSISTENT_PROFILE_DIR, PERSISTENT_PROFILE_DOMAINS,
+                      PERSISTENT_PROFILE_MAX_MB)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+from .cloudflare import get_clearance_store, get_cookie_domain
+from .resource_blocker import ResourceBlocker
+
+
+# Скрипт маскировки автоматизации для контекстов
+STEALTH_INIT_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined,
+    });
+
+    window.chrome = {
+        runtime: {},
+    };
+
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => [1, 2, 3, 4, 5],
+    });
+
+    Object.defineProperty(navigator, 'languages', {
+        get: () => ['ru-RU', 'ru', 'en-US', 'en'],
+    });
+"""
+
+
+class BrowserPool:
+    """Пул браузеров Chromium, общий для всего процесса"""
+
+    # Имена процессов Chromium (включая headless_shell Playwright)
+    CHROMIUM_PROCESS_NAMES = ('chrome', 'chromium', 'headless_shell')
+
+    # Каталоги кэшей внутри профиля Chromium, которые можно удалять без потери cookies
+    PROFILE_CACHE_DIRS = [
+        'Default/Cache', 'Default/Code Cache', 'Default/GPUCache',
+        'Default/Service Worker/CacheStorage', 'Default/Service Worker/ScriptCache',
+        'GrShaderCache', 'ShaderCache', 'GraphiteDawnCache'
+    ]
+
+    def __init__(self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES, launch_args=None,
+                 clearance_store=None, resource_blocker=None,
+                 recycle_after_pages=BROWSER_RECYCLE_AFTER_PAGES, rss_limit_mb=BROWSER_RSS_LIMIT_MB,
+                 persistent_profiles=PERSISTENT_PROFILES_ENABLED, profile_dir=PERSISTENT_PROFILE_DIR,
+                 profile_domains=PERSISTENT_PROFILE_DOMAINS, profile_max_mb=PERSISTENT_PROFILE_MAX_MB):
+        self.size = size
+        self.recycle_after_pages = recycle_after_pages
+        self.rss_limit_mb = rss_limit_mb if psutil else 0
+        self.launch_args = launch_args or (BROWSER_ARGS + BROWSER_EXTRA_ARGS)
+        self.clearance_store = clearance_store or get_clearance_store()
+        self.resource_blocker = resource_blocker or ResourceBlocker()
+        self._playwright = None
+        self._browsers = []  # Слоты: {'browser', 'active', 'pages_served', 'pid', 'retiring'}
+        self._pages = {}  # Страница -> слот браузера
+        # Постоянные контексты по доменам: слоты с 'context' и 'domain' вместо 'browser'
+        self.persistent_profiles = persistent_profiles
+        self.profile_dir = Path(profile_dir)
+        self.profile_domains = profile_domains
+        self.profile_max_mb = profile_max_mb
+        self._persistent = {}
+        self._lock = asyncio.Lock()
+        self._page_slots = asyncio.Semaphore(max_pages)
+        self.stats = {'launched': 0, 'recycled_pages': 0, 'recycled_rss': 0, 'crashed': 0,
+                      'reaped': 0, 'peak_rss_mb': 0.0, 'profile_pages': 0, 'profiles_pruned': 0}
+
+    async def start(self):
+        """Запускаем Playwright (браузеры поднимаются по мере необходимости)"""
+        async with self._lock:
+            if self._playwright is None:
+                print(f"🌐 Запуск пула браузеров (до {self.size} шт.)")
+                self._playwright = await async_playwright().start()
+
+    async def stop(self):
+        """Закрываем все страницы, браузеры и Playwright"""
+        async with self._lock:
+            for page, slot in list(self._pages.items()):
+                if 'context' in slot:
+                    continue  # Постоянные контексты закрываются ниже
+                try:
+                    await page.context.close()
+                except Exception as e:
+                    print(f"⚠️ Ошибка закрытия контекста: {e}")
+            self._pages.clear()
+
+            for slot in self._persistent.values():
+                try:
+                    await slot['context'].close()
+                except Exception as e:
+                    print(f"⚠️ Ошибка закрытия постоянного профиля {slot['domain']}: {e}")
+                slot['closed'].set()
+            self._persistent.clear()
+
+            for slot in self._browsers:
+                try:
+                    await slot['browser'].close()
+                except Exception as e:
+                    print(f"⚠️ Ошибка закрытия браузера: {e}")
+            self._browsers.clear()
+
+            # Процессы, пережившие закрытие браузеров, завершаем принудительно
+            await asyncio.to_thread(self._reap_processes, self._chromium_processes())
+
+            if self._playwright is not None:
+                try:
+                    await self._playwright.stop()
+                except Exception as e:
+                    print(f"⚠️ Ошибка остановки Playwright: {e}")
+                self._playwright = None
+                print("🔒 Пул браузеров остановлен")
+
+    def _chromium_processes(self):
+        """Процессы Chromium в дереве текущего процесса"""
+        if psutil is None:
+            return []
+        try:
+            children = psutil.Process(os.getpid()).children(recursive=True)
+        except psutil.Error:
+            return []
+        result = []
+        for process in children:
+            try:
+                name = process.name().lower()
+            except psutil.Error:
+                continue
+            if any(marker in name for marker in self.CHROMIUM_PROCESS_NAMES):
+                result.append(process)
+        return result
+
+    def _find_browser_pid(self, known_pids):
+        """PID корневого процесса только что запущенного браузера"""
+        for process in self._chromium_processes():
+            if process.pid in known_pids:
+                continue
+            try:
+                parent_name = process.parent().name().lower() if process.parent() else ''
+            except psutil.Error:
+                parent_name = ''
+            # Корневой процесс браузера запущен драйвером Playwright, а не Chromium
+            if not any(marker in parent_name for marker in self.CHROMIUM_PROCESS_NAMES):
+                return process.pid
+        return None
+
+    def _get_slot_rss_mb(self, slot):
+        """RSS браузера вместе с рендерерами и GPU-процессом (МБ)"""
+        if psutil is None or not slot.get('pid'):
+            return 0.0
+        try:
+            root = psutil.Process(slot['pid'])
+            processes = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return 0.0
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                continue
+        return total / 1024 / 1024
+
+    def _reap_processes(self, processes):
+        """Завершаем процессы Chromium: terminate, затем kill"""
+        alive = []
+        for process in processes:
+            try:
+                process.terminate()
+                alive.append(process)
+            except psutil.Error:
+                continue
+        if not alive:
+            return 0
+        _, still_alive = psutil.wait_procs(alive, timeout=3)
+        for process in still_alive:
+            try:
+                process.kill()
+            except psutil.Error:
+                continue
+        self.stats['reaped'] += len(alive)
+        print(f"🧹 Завершено зависших процессов Chromium: {len(alive)}")
+        return len(alive)
+
+    def _owned_pids(self):
+        """PID процессов, принадлежащих живым браузерам пула"""
+        pids = set()
+        for slot in self._browsers:
+            if not slot.get('pid'):
+                continue
+            try:
+                root = psutil.Process(slot['pid'])
+                pids.add(root.pid)
+                pids.update(child.pid for child in root.children(recursive=True))
+            except psutil.Error:
+                continue
+        return pids
+
+    async def reap_orphans(self):
+        """Завершаем процессы Chromium, не принадлежащие ни одному браузеру пула"""
+        if psutil is None:
+            return 0
+        async with self._lock:
+            if self._persistent or any(not slot.get('pid') for slot in self._browsers):
+                # Процессы браузера без известного PID (в т.ч. постоянных профилей)
+                # нельзя отличить от зависших
+                return 0
+            owned = self._owned_pids()
+            orphans = [process for process in self._chromium_processes() if process.pid not in owned]
+            return await asyncio.to_thread(self._reap_processes, orphans)
+
+    async def _launch_browser(self):
+        """Запускаем новый браузер в пуле"""
+        known_pids = {process.pid for process in self._chromium_processes()}
+        browser = await self._playwright.chromium.launch(
+            headless=True,
+            args=self.launch_args
+        )
+        slot = {
+            'browser': browser,
+            'active': 0,
+            'pages_served': 0,
+            'pid': self._find_browser_pid(known_pids) if psutil else None,
+            'retiring': False
+        }
+        self._browsers.append(slot)
+        self.stats['launched'] += 1
+        print(f"🚀 Запущен браузер #{len(self._browsers)} в пуле")
+        return slot
+
+    async def _close_slot(self, slot, reason):
+        """Закрываем браузер слота и завершаем его оставшиеся процессы"""
+        if slot in self._browsers:
+            self._browsers.remove(slot)
+        processes = []
+        if psutil and slot.get('pid'):
+            try:
+                root = psutil.Process(slot['pid'])
+                processes = [root] + root.children(recursive=True)
+            except psutil.Error:
+                processes = []
+        try:
+            await slot['browser'].close()
+        except Exception as e:
+            print(f"⚠️ Ошибка закрытия браузера: {e}")
+        print(f"♻️ Браузер перезапускается ({reason}), страниц обслужено: {slot['pages_served']}")
+        leftovers = [process for process in processes if process.is_running()]
+        if leftovers:
+            await asyncio.to_thread(self._reap_processes, leftovers)
+
+    def _check_recycle(self, slot):
+        """Помечаем браузер к перезапуску по числу страниц или памяти"""
+        if slot['retiring']:
+            return
+        if self.recycle_after_pages and slot['pages_served'] >= self.recycle_after_pages:
+            slot['retiring'] = 'pages'
+            self.stats['recycled_pages'] += 1
+            return
+        if self.rss_limit_mb:
+            rss_mb = self._get_slot_rss_mb(slot)
+            self.stats['peak_rss_mb'] = max(self.stats['peak_rss_mb'], rss_mb)
+            if rss_mb > self.rss_limit_mb:
+                print(f"⚠️ RSS браузера {rss_mb:.0f} MB превышает лимит {self.rss_limit_mb} MB")
+                slot['retiring'] = 'rss'
+                self.stats['recycled_rss'] += 1
+
+    async def _get_browser_slot(self):
+        """Выбираем наименее загруженный браузер или запускаем новый"""
+        if self._playwright is None:
+            await self.start()
+
+        async with self._lock:
+            # Убираем упавшие браузеры и завершаем их процессы
+            for slot in [slot for slot in self._browsers if not slot['browser'].is_connected()]:
+                self.stats['crashed'] += 1
+                await self._close_slot(slot, 'браузер упал')
+
+            # Браузеры, помеченные к перезапуску, новых страниц не получают
+            available = [slot for slot in self._browsers if not slot['retiring']]
+            idle = [slot for slot in available if slot['active'] == 0]
+            if not available or (not idle and len(self._browsers) < self.size):
+                return await self._launch_browser()
+
+            return min(available, key=lambda slot: slot['active'])
+
+    def get_profile_domain(self, url):
+        """Домен постоянного профиля для URL или None, если профиль не используется"""
+        if not self.persistent_profiles or not url:
+            return None
+        domain = get_cookie_domain(url)
+        return domain if domain in self.profile_domains else None
+
+    def _get_dir_size_mb(self, path):
+        """Размер каталога (МБ)"""
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+        return total / 1024 / 1024
+
+    def _prune_profile(self, path):
+        """Держим профиль в пределах лимита: сначала кэши, затем весь профиль"""
+        size_mb = self._get_dir_size_mb(path)
+        if size_mb <= self.profile_max_mb:
+            return
+        print(f"🧹 Профиль {path.name}: {size_mb:.0f} MB > {self.profile_max_mb} MB, очищаем кэши")
+        for cache_dir in self.PROFILE_CACHE_DIRS:
+            shutil.rmtree(path / cache_dir, ignore_errors=True)
+        self.stats['profiles_pruned'] += 1
+        if self._get_dir_size_mb(path) > self.profile_max_mb:
+            print(f"🧹 Профиль {path.name} все еще больше лимита, создаем заново")
+            shutil.rmtree(path, ignore_errors=True)
+
+    async def _get_persistent_slot(self, domain, init_script, context_options):
+        """Постоянный контекст домена (запускается при первом обращении)"""
+        while True:
+            async with self._lock:
+                slot = self._persistent.get(domain)
+                if slot is None:
+                    return await self._launch_persistent_slot(domain, init_script, context_options)
+                if not slot['retiring']:
+                    return slot
+                closed = slot['closed']
+            # Профиль занят перезапускаемым контекстом: ждем его закрытия
+            await closed.wait()
+
+    async def _launch_persistent_slot(self, domain, init_script, context_options):
+        """Запускаем постоянный контекст домена (вызывается под блокировкой)"""
+        if self._playwright is None:
+            print("🌐 Запуск Playwright для постоянных профилей")
+            self._playwright = await async_playwright().start()
+
+        profile_path = self.profile_dir / domain
+        await asyncio.to_thread(self._prune_profile, profile_path)
+        profile_path.mkdir(parents=True, exist_ok=True)
+
+        # Параметры контекста фиксируются при запуске профиля;
+        # скачивания разрешены всегда, т.к. профиль общий для проб и загрузок
+        context = await self._playwright.chromium.launch_persistent_context(
+            str(profile_path),
+            headless=True,
+            args=self.launch_args,
+            **{**context_options, 'accept_downloads': True}
+        )
+        if init_script:
+            await context.add_init_script(init_script)
+        await self.clearance_store.apply_to_context(context, context_options['user_agent'])
+        # Блокировку ресурсов не ставим: перехват route отключает HTTP-кэш контекста,
+        # а ради кэша постоянные профили и нужны
+
+        slot = {
+            'context': context,
+            'domain': domain,
+            'active': 0,
+            'pages_served': 0,
+            'init_scripts': {init_script} if init_script else set(),
+            'retiring': False,
+            'closed': asyncio.Event()
+        }
+        self._persistent[domain] = slot
+        self.stats['launched'] += 1
+        print(f"🚀 Запущен постоянный профиль {domain}: {profile_path}")
+        return slot
+
+    async def _acquire_persistent_page(self, domain, init_script, context_options):
+        """Страница в постоянном контексте домена"""
+        slot = await self._get_persistent_slot(domain, init_script, context_options)
+        if init_script and init_script not in slot['init_scripts']:
+            await slot['context'].add_init_script(init_script)
+            slot['init_scripts'].add(init_script)
+        page = await slot['context'].new_page()
+        if context_options.get('extra_http_headers'):
+            await page.set_extra_http_headers(context_options['extra_http_headers'])
+        self.stats['profile_pages'] += 1
+        return slot, page
+
+    async def _close_persistent_slot(self, slot, reason):
+        """Закрываем постоянный контекст (профиль на диске сохраняется)"""
+        try:
+            await slot['context'].close()
+        except Exception as e:
+            print(f"⚠️ Ошибка закрытия постоянного профиля {slot['domain']}: {e}")
+        if self._persistent.get(slot['domain']) is slot:
+            del self._persistent[slot['domain']]
+        slot['closed'].set()
+        print(f"♻️ Постоянный профиль {slot['domain']} перезапускается ({reason})")
+
+    async def acquire_page(self, accept_downloads=False, init_script=None, profile_url=None, **context_options):
+        """Выдаем страницу в новом изолированном контексте
+
+        profile_url - адрес, который будет открыт на странице: при включенных
+        постоянных профилях страница выдается в профиле его домена
+        """
+        await self._page_slots.acquire()
+        context_options.setdefault('user_agent', USER_AGENT)
+        domain = self.get_profile_domain(profile_url)
+        if domain:
+            try:
+                slot, page = await self._acquire_persistent_page(domain, init_script, context_options)
+            except Exception:
+                self._page_slots.release()
+                raise
+            slot['active'] += 1
+            slot['pages_served'] += 1
+            self._pages[page] = slot
+            return page
+
+        try:
+            slot = await self._get_browser_slot()
+            context = await slot['browser'].new_context(
+                accept_downloads=accept_downloads,
+                **context_options
+            )
+            if init_script:
+                await context.add_init_script(init_script)
+            # Подставляем сохраненные Cloudflare cookies, чтобы пропустить проверку
+            await self.clearance_store.apply_to_context(context, context_options['user_agent'])
+            # Блокируем картинки, шрифты, стили, аналитику и рекламу
+            await self.resource_blocker.install(context)
+            page = await context.new_page()
+        except Exception:
+            self._page_slots.release()
+            raise
+
+        slot['active'] += 1
+        slot['pages_served'] += 1
+        self._pages[page] = slot
+        return page
+
+    async def release_page(self, page):
+        """Возвращаем страницу в пул (контекст закрывается)"""
+        slot = self._pages.pop(page, None)
+        if slot is None:
+            return
+
+        if 'context' in slot:
+            await self._release_persistent_page(page, slot)
+            return
+
+        try:
+            await page.context.close()
+        except Exception as e:
+            print(f"⚠️ Ошибка закрытия контекста: {e}")
+            # Контекст не закрылся - браузер в неизвестном состоянии, перезапускаем
+            if not slot['retiring']:
+                slot['retiring'] = 'error'
+                self.stats['crashed'] += 1
+        finally:
+            slot['active'] -= 1
+            self._page_slots.release()
+
+        async with self._lock:
+            self._check_recycle(slot)
+            # Последняя страница браузера, помеченного к перезапуску, закрыта
+            if slot['retiring'] and slot['active'] == 0 and slot in self._browsers:
+                await self._close_slot(slot, slot['retiring'])
+
+    async def _release_persistent_page(self, page, slot):
+        """Закрываем страницу постоянного профиля (контекст остается)"""
+        try:
+            await page.close()
+        except Exception as e:
+            print(f"⚠️ Ошибка закрытия страницы профиля {slot['domain']}: {e}")
+            if not slot['retiring']:
+                slot['retiring'] = 'error'
+                self.stats['crashed'] += 1
+        finally:
+            slot['active'] -= 1
+            self._page_slots.release()
+
+        async with self._lock:
+            if not slot['retiring'] and self.recycle_after_pages and slot['pages_served'] >= self.recycle_after_pages:
+                slot['retiring'] = 'pages'
+                self.stats['recycled_pages'] += 1
+            # Профиль нельзя открыть дважды: новые страницы ждут закрытия старого контекста
+            if slot['retiring'] and slot['active'] == 0:
+                await self._close_persistent_slot(slot, slot['retiring'])
+
+    @asynccontextmanager
+    async def page(self, accept_downloads=False, init_script=None, profile_url=None, **context_options):
+        """Контекстный менеджер для страницы из пула"""
+        page = await self.acquire_page(accept_downloads=accept_downloads, init_script=init_script,
+                                       profile_url=profile_url, **context_options)
+        try:
+            yield page
+        finally:
+            await self.release_page(page)
+
+
+_shared_pool = None
+
+
+def get_browser_pool():
+    """Получаем общий для процесса пул браузеров"""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = BrowserPool()
+    return _shared_pool
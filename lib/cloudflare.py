@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Модуль для работы с Cloudflare
+Ожидание прохождения проверки и хранилище clearance cookies по доменам
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from ..config import CLOUDFLARE_TIMEOUT, CLEARANCE_STORE_FILE, CLEARANCE_DEFAULT_TTL, USER_AGENT
+
+
+def get_cookie_domain(url: str) -> str:
+    """Получаем базовый домен для хранения cookies (d.apkpure.com -> apkpure.com)"""
+    host = (urlparse(url).hostname or url).lower().lstrip('.')
+    parts = host.split('.')
+    return '.'.join(parts[-2:]) if len(parts) >= 2 else host
+
+
+class ClearanceStore:
+    """Хранилище cookies Cloudflare на диске с отслеживанием срока действия
+
+    Формат: {домен: {'cookies': [...], 'user_agent': ..., 'saved_at': ..., 'expires': ...}}
+    Cookies хранятся в формате Playwright и подходят как для контекстов браузера,
+    так и для сессий cloudscraper (cf_clearance привязан к User-Agent).
+    """
+
+    def __init__(self, path: str = CLEARANCE_STORE_FILE, default_ttl: int = CLEARANCE_DEFAULT_TTL):
+        self.path = Path(path)
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self) -> Dict:
+        """Загружаем хранилище с диска"""
+        try:
+            if self.path.exists():
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать хранилище Cloudflare cookies: {e}")
+        return {}
+
+    def _save(self):
+        """Атомарно сохраняем хранилище на диск"""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить хранилище Cloudflare cookies: {e}")
+
+    def _valid_cookies(self, entry: Dict) -> List[Dict]:
+        """Возвращаем не истекшие cookies записи"""
+        now = time.time()
+        if entry.get('expires', 0) < now:
+            return []
+        return [
+            cookie for cookie in entry.get('cookies', [])
+            if cookie.get('expires', -1) in (-1, None) or cookie['expires'] > now
+        ]
+
+    def get_entry(self, url: str) -> Optional[Dict]:
+        """Получаем действующую запись для домена URL"""
+        with self._lock:
+            entry = self._data.get(get_cookie_domain(url))
+            if not entry:
+                return None
+            cookies = self._valid_cookies(entry)
+            if not cookies:
+                return None
+            return {**entry, 'cookies': cookies}
+
+    def update(self, url: str, cookies: List[Dict], user_agent: str):
+        """Сохраняем свежие cookies домена после прохождения проверки"""
+        domain = get_cookie_domain(url)
+        domain_cookies = [
+            cookie for cookie in cookies
+            if cookie.get('domain', '').lstrip('.').endswith(domain)
+        ]
+        if not domain_cookies:
+            return
+
+        now = time.time()
+        expires = now + self.default_ttl
+        for cookie in domain_cookies:
+            if cookie.get('name') == 'cf_clearance' and cookie.get('expires', -1) not in (-1, None):
+                expires = cookie['expires']
+
+        with self._lock:
+            self._data[domain] = {
+                'cookies': domain_cookies,
+                'user_agent': user_agent,
+                'saved_at': now,
+                'expires': expires
+            }
+            self._save()
+        print(f"🍪 Сохранены Cloudflare cookies для {domain} ({len(domain_cookies)} шт.)")
+
+    async def apply_to_context(self, context, user_agent: str = USER_AGENT):
+        """Добавляем сохраненные cookies в новый контекст браузера"""
+        with self._lock:
+            cookies = []
+            for entry in self._data.values():
+                # cf_clearance действителен только с тем же User-Agent
+                if entry.get('user_agent') == user_agent:
+                    cookies.extend(self._valid_cookies(entry))
+        if cookies:
+            await context.add_cookies(cookies)
+
+    async def save_from_context(self, context, url: str, user_agent: str = USER_AGENT):
+        """Сохраняем cookies контекста после решенной проверки"""
+        try:
+            cookies = await context.cookies()
+            self.update(url, cookies, user_agent)
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить cookies контекста: {e}")
+
+    def apply_to_session(self, session, url: str) -> bool:
+        """Добавляем сохраненные cookies и User-Agent в сессию requests/cloudscraper"""
+        entry = self.get_entry(url)
+        if not entry:
+            return False
+
+        for cookie in entry['cookies']:
+            session.cookies.set(
+                cookie['name'], cookie['value'],
+                domain=cookie.get('domain', ''), path=cookie.get('path', '/')
+            )
+        if entry.get('user_agent'):
+            session.headers['User-Agent'] = entry['user_agent']
+        return True
+
+    def save_from_session(self, session, url: str):
+        """Сохраняем cookies сессии cloudscraper после решенной проверки"""
+        cookies = [
+            {
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path or '/',
+                'expires': cookie.expires if cookie.expires else -1
+            }
+            for cookie in session.cookies
+        ]
+        if any(cookie['name'] == 'cf_clearance' for cookie in cookies):
+            self.update(url, cookies, session.headers.get('User-Agent', USER_AGENT))
+
+
+_shared_store = None
+
+
+def get_clearance_store() -> ClearanceStore:
+    """Получаем общее для процесса хранилище Cloudflare cookies"""
+    global _shared_store
+    if _shared_store is None:
+        _shared_store = ClearanceStore()
+    return _shared_store
+
+
+class CloudflareGuard:
+    """Ожидание прохождения проверки Cloudflare на странице
+
+    Вместо опроса раз в секунду используется один предикат внутри страницы
+    (page.wait_for_function): он срабатывает сразу, как только проверка пройдена.
+    Перезагрузки страницы челленджем обрабатываются ожиданием события загрузки.
+    """
+
+    # Индикаторы активной проверки (те же, что раньше проверялись через query_selector)
+    CF_INDICATORS = [
+        "div.cf-browser-verification",
+        "div.cf-checking-browser",
+        "[data-ray]"
+    ]
+    CF_HEADINGS = ['checking your browser', 'just a moment']
+
+    # Ошибки Playwright при перезагрузке страницы челленджем (после загрузки можно проверять снова)
+    NAVIGATION_ERRORS = ('execution context was destroyed', 'most likely because of a navigation',
+                         'cannot find context with specified id')
+
+    # Предикат: true, когда на странице нет признаков проверки Cloudflare
+    CHALLENGE_CLEARED_JS = """
+        ([indicators, headings]) => {
+            if (indicators.some(selector => document.querySelector(selector))) {
+                return false;
+            }
+            const h1Texts = Array.from(document.querySelectorAll('h1'))
+                .map(h1 => (h1.textContent || '').toLowerCase());
+            if (h1Texts.some(text => headings.some(heading => text.includes(heading)))) {
+                return false;
+            }
+            const title = (document.title || '').toLowerCase();
+            if (title.includes('just a moment') || title.includes('checking')) {
+                return false;
+            }
+            return !location.href.toLowerCase().includes('cloudflare');
+        }
+    """
+
+    def __init__(self, clearance_store: ClearanceStore = None):
+        self.clearance_store = clearance_store or get_clearance_store()
+        self.stats = {'waits': 0, 'challenges': 0, 'timeouts': 0, 'errors': 0, 'total_wait_seconds': 0.0}
+
+    async def is_challenge_active(self, page) -> bool:
+        """Проверяем, показывает ли страница проверку Cloudflare (одна проверка в странице)"""
+        cleared = await page.evaluate(self.CHALLENGE_CLEARED_JS, [self.CF_INDICATORS, self.CF_HEADINGS])
+        return not cleared
+
+    @staticmethod
+    def is_challenge_html(soup, status_code=200) -> bool:
+        """Проверяем, является ли HTML из HTTP-ответа страницей проверки Cloudflare"""
+        if soup.select_one(", ".join(CloudflareGuard.CF_INDICATORS)):
+            return True
+        if soup.select_one("#challenge-form, script[src*='/cdn-cgi/challenge-platform/']"):
+            return True
+        for h1 in soup.find_all('h1'):
+            text = h1.get_text(" ", strip=True).lower()
+            if any(heading in text for heading in CloudflareGuard.CF_HEADINGS):
+                return True
+        title = (soup.title.get_text() if soup.title else '').lower()
+        if 'just a moment' in title or 'checking' in title:
+            return True
+        # 403/503 от Cloudflare без контента приложения - тоже проверка
+        return status_code in (403, 503)
+
+    async def wait_timed(self, page, max_wait=CLOUDFLARE_TIMEOUT):
+        """Ждем прохождения проверки Cloudflare, возвращаем (пройдена, секунд ожидания)"""
+        start = time.monotonic()
+        deadline = start + max_wait
+        challenge_seen = False
+        passed = False
+        error = None
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                if not await self.is_challenge_active(page):
+                    passed = True
+                    break
+
+                if not challenge_seen:
+                    challenge_seen = True
+                    print(f"⏳ Обнаружена проверка Cloudflare, ждем до {max_wait} сек...")
+
+                await page.wait_for_function(
+                    self.CHALLENGE_CLEARED_JS,
+                    arg=[self.CF_INDICATORS, self.CF_HEADINGS],
+                    timeout=remaining * 1000,
+                    polling='raf'
+                )
+                passed = True
+                break
+            except PlaywrightTimeoutError:
+                break
+            except Exception as e:
+                # Страница или контекст закрыты и прочие ошибки - ждать дальше бессмысленно
+                if page.is_closed() or not any(marker in str(e).lower() for marker in self.NAVIGATION_ERRORS):
+                    error = e
+                    break
+
+                # Челлендж перезагрузил страницу и уничтожил контекст выполнения:
+                # ждем загрузки нового документа и проверяем снова
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await page.wait_for_load_state('domcontentloaded', timeout=remaining * 1000)
+                except PlaywrightTimeoutError:
+                    break
+                except Exception as load_error:
+                    error = load_error
+                    break
+
+        elapsed = time.monotonic() - start
+        self.stats['waits'] += 1
+        self.stats['total_wait_seconds'] += elapsed
+        if challenge_seen:
+            self.stats['challenges'] += 1
+
+        if passed:
+            if challenge_seen:
+                print(f"✅ Cloudflare проверка пройдена за {elapsed:.2f} сек")
+                # Сохраняем clearance, чтобы следующие запросы обходились без проверки
+                await self.clearance_store.save_from_context(page.context, page.url)
+            else:
+                print(f"✅ Cloudflare проверка отсутствует ({elapsed:.2f} сек)")
+        elif error is not None:
+            self.stats['errors'] += 1
+            print(f"❌ Ошибка при проверке Cloudflare ({elapsed:.2f} сек): {error}")
+        else:
+            self.stats['timeouts'] += 1
+            print(f"⚠️ Превышено время ожидания Cloudflare ({elapsed:.2f} сек)")
+
+        return passed, elapsed
+
+    async def wait(self, page, max_wait=CLOUDFLARE_TIMEOUT) -> bool:
+        """Ждем прохождения проверки Cloudflare"""
+        passed, _ = await self.wait_timed(page, max_wait)
+        return passed
@@ -25,7 +25,8 @@ class DuplicateAnalyzer:
             'files_replaced_by_priority': 0,
             'processing_errors': 0,
             'start_time': None,
-            'end_time': None
+            'end_time': None,
+            'run_stats': {}
         }
         self.duplicate_log = []
     
@@ -97,6 +98,10 @@ class DuplicateAnalyzer:
         status = "новый" if is_new else "дубль"
         self.log(f"📁 Обработан {status} файл: {app_name} v{version} ({file_size} байт) из {source}")
     
+    def record_run_stats(self, name: str, stats: Dict):
+        """Сохраняем статистику компонента за прогон (Cloudflare, пробы, загрузки)"""
+        self.metrics['run_stats'][name] = dict(stats)
+    
     def log(self, message: str):
         """Общий метод логирования"""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -142,6 +147,7 @@ class DuplicateAnalyzer:
                     'similar_apps_found': self.metrics['similar_apps_found'],
                     'files_replaced_by_priority': self.metrics['files_replaced_by_priority'],
                     'processing_errors': self.metrics['processing_errors'],
+                    'run_stats': self.metrics['run_stats'],
                     'start_time': self.metrics['start_time'].isoformat() if self.metrics['start_time'] else None,
                     'end_time': self.metrics['end_time'].isoformat() if self.metrics['end_time'] else None
                 }
@@ -181,6 +187,15 @@ class DuplicateAnalyzer:
         print(f"   Похожих приложений найдено: {self.metrics['similar_apps_found']}")
         print(f"   Файлов заменено по приоритету: {self.metrics['files_replaced_by_priority']}")
         
+        if self.metrics['run_stats']:
+            print(f"\n⚙️ СТАТИСТИКА КОМПОНЕНТОВ:")
+            for name, stats in self.metrics['run_stats'].items():
+                values = ', '.join(
+                    f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in stats.items()
+                )
+                print(f"   {name}: {values}")
+        
         if self.metrics['start_time'] and self.metrics['end_time']:
             duration = (self.metrics['end_time'] - self.metrics['start_time']).total_seconds()
             print(f"\n⏱️ Время обработки: {duration:.2f} секунд")
@@ -4,22 +4,50 @@
 Интегрирован в систему обработки файлов
 """
 import asyncio
+import contextlib
 import os
 import re
 import hashlib
 from pathlib import Path
 from datetime import datetime
-from playwright.async_api import async_playwright
-import cloudscraper
-import requests
-from urllib.parse import urlparse, unquote
-from ..config import BROWSER_ARGS, USER_AGENT, BASE_DOWNLOAD_DIR, CLOUDFLARE_TIMEOUT, PAGE_LOAD_TIMEOUT, DOWNLOAD_TIMEOUT
+from ..config import BASE_DOWNLOAD_DIR
 from .file_normalizer import FileNormalizer
+from .browser_pool import get_browser_pool
+from .page_version import PageVersionParser
+from .cloudflare import CloudflareGuard, get_clearance_store
+from .stream_downloader import StreamDownloader
+from .session_pool import get_session_pool
+from .host_limiter import HostLimiter
 
 
 class FileDownloader:
-    def __init__(self, download_dir):
+    # Ссылка "Скачать APK" на странице приложения
+    DOWNLOAD_LINK_SELECTORS = [
+        "a.button.is-success.is-fullwidth",
+        "a.button.is-success",
+        "a[href*='/download/apk']",
+        "a[href*='/download/']",
+        "div.download a.button"
+    ]
+
+    # Варианты файла на странице загрузки
+    FILE_VARIANT_SELECTORS = [
+        "ul.file-list li a",
+        "ul.file-list a",
+        ".file-list li a",
+        ".file-list a"
+    ]
+
+    def __init__(self, download_dir, browser_pool=None, host_limiter=None):
         self.download_dir = download_dir
+        self.browser_pool = browser_pool or get_browser_pool()
+        # Слот apkcombo.com занимается только на время навигации по страницам сайта
+        self.host_limiter = host_limiter or HostLimiter({})
+        self.clearance_store = get_clearance_store()
+        self.cloudflare = CloudflareGuard(self.clearance_store)
+        self.stream_downloader = StreamDownloader()
+        # Сессии cloudscraper по хостам вместо новой сессии на каждый файл
+        self.session_pool = get_session_pool()
         
         # Добавляем нормализатор файлов
         try:
@@ -30,94 +58,51 @@ class FileDownloader:
 
     def extract_filename_from_response(self, response, original_url="", default_name="downloaded_file.apk"):
         """Извлекает правильное имя файла из HTTP ответа"""
-        filename = default_name
-        
-        # Пробуем получить из Content-Disposition заголовка
-        content_disposition = response.headers.get('Content-Disposition', '')
-        if 'filename=' in content_disposition:
-            # Ищем filename="..." либо filename*=UTF-8''name
-            patterns = [
-                r'filename\*?=["\']?([^"\';\s]+)["\']?',
-                r'filename\*?=([^;]+)'
-            ]
-            for pattern in patterns:
-                matches = re.findall(pattern, content_disposition, re.IGNORECASE)
-                if matches:
-                    filename = matches[0].strip()
-                    break
-        
-        # Пробуем извлечь из URL
-        if default_name == filename:
-            try:
-                parsed = urlparse(original_url or response.url)
-                url_filename = parsed.path.split('/')[-1]
-                decoded_filename = unquote(url_filename)
-                
-                if decoded_filename and ('.apk' in decoded_filename or '.xapk' in decoded_filename):
-                    filename = decoded_filename
-            except:
-                pass
-        
-        # Проверяем что у файла есть расширение
-        if not any(ext in filename.lower() for ext in ['.apk', '.xapk']):
-            if 'content-type' in str(response.headers).lower():
-                if 'xapk' in str(response.headers):
-                    filename = filename.rstrip('.') + '.xapk'
-                else:
-                    filename = filename.rstrip('.') + '.apk'
-        
-        # Очищаем имя файла от недопустимых символов
-        filename = re.sub(r'[<>:"/\\|?*]', '', filename)
-        filename = filename.strip()
-        
-        return filename if filename else default_name
+        return StreamDownloader.extract_filename(response, original_url, default_name)
 
-    def download_with_cloudscraper(self, url, directory):
-        """Скачивает файл используя cloudscraper с правильным именем"""
+    def download_with_cloudscraper(self, url, directory, file_info=None, expected_size=None):
+        """Скачивает файл используя cloudscraper с правильным именем
+
+        file_info - словарь для чексумм и размера, посчитанных во время записи
+        expected_size - размер со страницы загрузки: ответ другого размера отклоняется сразу
+        """
+        scraper = self.session_pool.acquire(url)
+        result = StreamDownloader.ERROR
         try:
-            scraper = cloudscraper.create_scraper()
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            scraper.headers.update(headers)
+            # Подставляем сохраненный clearance (вместе с его User-Agent)
+            if self.clearance_store.apply_to_session(scraper, url):
+                print("🍪 Используем сохраненные Cloudflare cookies")
             
             print(f"📥 Скачиваем через cloudscraper: {url}")
-            response = scraper.get(url, stream=True, allow_redirects=True, timeout=60)
+            filepath, result = self.stream_downloader.download(scraper, url, directory, file_info=file_info,
+                                                               expected_size=expected_size)
             
-            if response.status_code == 200:
-                # Извлекаем правильное имя файла
-                filename = self.extract_filename_from_response(response, url)
-                
-                filepath = directory / filename
-                print(f"📁 Имя файла: {filename}")
-                
-                with open(filepath, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                
-                if filepath.exists() and self.is_valid_apk(filepath):
-                    size_mb = filepath.stat().st_size / 1024 / 1024
-                    print(f"✅ Файл скачан cloudscraper: {filepath.name} ({size_mb:.2f} MB)")
-                    return filepath
+            if result == StreamDownloader.OK:
+                # Сохраняем clearance, если cloudscraper решил проверку
+                self.clearance_store.save_from_session(scraper, url)
+                print(f"✅ Файл скачан cloudscraper: {filepath.name}")
+                return filepath
             
             return None
         except Exception as e:
             print(f"❌ Ошибка cloudscraper: {e}")
             return None
+        finally:
+            # После блокировки состояние сессии не годится для следующих запросов
+            self.session_pool.release(url, scraper, discard=result == StreamDownloader.BLOCKED)
+
+    def is_unchanged(self, url, known_validators):
+        """HEAD-проверка r2 ссылки: тот же файл, что скачан в прошлый раз"""
+        session = self.session_pool.acquire(url)
+        try:
+            self.clearance_store.apply_to_session(session, url)
+            return self.stream_downloader.is_unchanged(session, url, known_validators)
+        finally:
+            self.session_pool.release(url, session)
 
     def is_valid_apk(self, file_path):
         """Проверяет корректность APK файла"""
-        if not file_path.exists():
-            return False
-        
-        file_size = file_path.stat().st_size
-        if file_size < 1024:
-            return False
-            
-        with open(file_path, 'rb') as f:
-            header = f.read(4)
-            return header.startswith(b'PK')
+        return StreamDownloader.is_valid_apk(file_path)
 
     def calculate_checksum(self, file_path):
         """Вычисляем MD5 чексумму файла"""
@@ -203,52 +188,26 @@ class FileDownloader:
 
     async def wait_for_cloudflare(self, page, max_wait=120):
         """Ждем прохождения проверки Cloudflare"""
-        print("🔄 Проверяем наличие Cloudflare...")
-        for i in range(max_wait):
-            await asyncio.sleep(1)
-            try:
-                current_url = page.url
-                page_title = await page.title()
-                # Проверяем индикаторы Cloudflare
-                cf_indicators = [
-                    "div.cf-browser-verification",
-                    "div.cf-checking-browser",
-                    "[data-ray]",
-                    "h1:has-text('Checking your browser')",
-                    "h1:has-text('Just a moment')"
-                ]
-                is_cf_active = False
-                for indicator in cf_indicators:
-                    try:
-                        element = await page.query_selector(indicator)
-                        if element:
-                            is_cf_active = True
-                            break
-                    except:
-                        continue
-                # Проверяем по заголовку и URL
-                if ("just a moment" in page_title.lower() or
-                    "checking" in page_title.lower() or
-                    "cloudflare" in current_url.lower()):
-                    is_cf_active = True
-                if not is_cf_active:
-                    print("✅ Cloudflare проверка пройдена или отсутствует")
-                    return True
-                if i % 10 == 0:
-                    print(f"⏳ Ждем Cloudflare... ({i+1}/{max_wait})")
-            except Exception as e:
-                print(f"   Ошибка при проверке Cloudflare: {e}")
-                continue
-        print("⚠️ Превышено время ожидания Cloudflare")
-        return False
+        return await self.cloudflare.wait(page, max_wait)
+
+    async def download_file_from_r2_url(self, page, r2_url, expected_filename=None, file_info=None,
+                                        expected_size=None, known_validators=None):
+        """Скачиваем файл по r2 ссылке - сначала пробуем cloudscraper, потом Playwright
+
+        known_validators - ETag/размер/имя файла прошлого скачивания: если файл на сервере
+        тот же, скачивание пропускается (file_info['unchanged'] = True)
+        """
+        if known_validators and await asyncio.to_thread(self.is_unchanged, r2_url, known_validators):
+            if file_info is not None:
+                file_info['unchanged'] = True
+            return None
 
-    async def download_file_from_r2_url(self, page, r2_url, expected_filename=None):
-        """Скачиваем файл по r2 ссылке - сначала пробуем cloudscraper, потом Playwright"""
         print(f"🔗 Переходим по r2 ссылке для скачивания...")
         
         # Метод 1: Пробуем cloudscraper для прямого скачивания  
         print("🔧 Пробуем cloudscraper для обхода Cloudflare...")
-        downloaded_file = self.download_with_cloudscraper(r2_url, self.download_dir)
+        downloaded_file = await asyncio.to_thread(self.download_with_cloudscraper, r2_url, self.download_dir,
+                                                  file_info, expected_size)
         
         if downloaded_file and self.is_valid_apk(downloaded_file):
             # Если есть ожидаемое имя файла и файл был получен с другим именем - переименовываем
@@ -287,33 +246,39 @@ class FileDownloader:
         # Метод 2: Fallback через Playwright
         print("🔄 Переключаемся на Playwright как резервный метод...")
         
-        download_started = False
+        download_event = asyncio.Event()
         download_obj = None
 
         async def handle_download(download):
-            nonlocal download_started, download_obj
+            nonlocal download_obj
             download_obj = download
-            download_started = True
+            download_event.set()
             print("🎯 Загрузка началась через Playwright!")
 
         page.on("download", handle_download)
 
         try:
             print("🌐 Переходим по ссылке через Playwright...")
-            await page.goto(r2_url, wait_until="domcontentloaded", timeout=60000)
+            try:
+                await page.goto(r2_url, wait_until="domcontentloaded", timeout=60000)
+            except Exception as goto_error:
+                # Переход сразу превратился в скачивание - это нормально
+                if "Download is starting" not in str(goto_error):
+                    raise
             
-            # Ждем Cloudflare
-            await self.wait_for_cloudflare(page, max_wait=120)
+            # Ждем Cloudflare, если скачивание еще не началось
+            if not download_event.is_set():
+                await self.wait_for_cloudflare(page, max_wait=120)
             
-            # Ждем начала загрузки
-            for i in range(30):
-                if download_started:
-                    break
-                await asyncio.sleep(1)
-                if i % 5 == 0:
-                    print(f"⏳ Ожидание начала загрузки Playwright... ({i+1}/30)")
+            # Ждем события download (до 30 сек), без опроса раз в секунду
+            if not download_event.is_set():
+                print("⏳ Ожидание начала загрузки Playwright (до 30 сек)...")
+                try:
+                    await asyncio.wait_for(download_event.wait(), timeout=30)
+                except asyncio.TimeoutError:
+                    pass
             
-            if download_started:
+            if download_event.is_set():
                 # Определяем имя файла для Playwright
                 suggested_filename = download_obj.suggested_filename if download_obj else None
                 if expected_filename and expected_filename.endswith(('.apk', '.xapk')):
@@ -373,150 +338,126 @@ class FileDownloader:
 
         return None
 
-    async def extract_version_from_page(self, app_url):
-        """Извлекаем версию со страницы приложения"""
+    async def extract_version_from_loaded_page(self, page, app_url):
+        """Извлекаем версию из уже открытой страницы приложения (без новой навигации)"""
+        version = await PageVersionParser.extract_from_page(page, app_url, use_page_text=False)
+        if version:
+            print(f"✅ Найдена версия на странице: {version}")
+        else:
+            print("⚠️ Версия не найдена на странице")
+        return version
+
+    async def wait_for_any_selector(self, page, selectors, timeout):
+        """Ждем появления любого из селекторов; по таймауту просто продолжаем"""
         try:
-            print(f"🔍 Получаем версию со страницы: {app_url}")
-            
-            # Создаем браузер для получения версии
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(
-                    headless=True,
-                    args=BROWSER_ARGS
-                )
-                context = await browser.new_context(
-                    user_agent=USER_AGENT
-                )
-                page = await context.new_page()
-                
-                try:
-                    await page.goto(app_url, wait_until="domcontentloaded", timeout=PAGE_LOAD_TIMEOUT)
-                    await self.wait_for_cloudflare(page, max_wait=60)
-                    await asyncio.sleep(3)
-
-                    # Ищем версию в div.version
-                    version_selectors = [
-                        'div.version',
-                        '.version',
-                        '[class*="version"]',
-                        '.app-version'
-                    ]
-                    
-                    for selector in version_selectors:
-                        try:
-                            element = await page.query_selector(selector)
-                            if element:
-                                version_text = await element.inner_text()
-                                # Извлекаем только номер версии
-                                version_match = re.search(r'(\d+\.\d+\.\d+)', version_text)
-                                if version_match:
-                                    version = version_match.group(1)
-                                    print(f"✅ Найдена версия на странице: {version}")
-                                    return version
-                        except:
-                            continue
-                    
-                    print("⚠️ Версия не найдена на странице")
-                    return None
-                    
-                finally:
-                    await context.close()
-                    await browser.close()
-                    
-        except Exception as e:
-            print(f"❌ Ошибка получения версии со страницы: {e}")
+            await page.wait_for_selector(", ".join(selectors), state='attached', timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    def build_download_page_url(self, app_url):
+        """Формируем URL страницы загрузки APKCombo по URL приложения"""
+        return app_url.split('?')[0].rstrip('/') + '/download/apk'
+
+    async def find_download_page_url(self, page):
+        """Ищем на странице приложения ссылку 'Скачать APK'"""
+        print("🔍 Ищем ссылку 'Скачать APK'...")
+        download_link = None
+        selectors_to_try = self.DOWNLOAD_LINK_SELECTORS
+        for selector in selectors_to_try:
+            try:
+                print(f"   Пробуем селектор: {selector}")
+                elements = await page.query_selector_all(selector)
+                for element in elements:
+                    href = await element.get_attribute("href")
+                    text = await element.inner_text()
+                    print(f"     Найден элемент: href={href}, text={text.strip()[:30]}")
+                    if href and ('/download/' in href or 'apk' in href.lower()):
+                        download_link = element
+                        print(f"   ✅ Выбран элемент с href: {href}")
+                        break
+                if download_link:
+                    break
+            except Exception as e:
+                print(f"     Ошибка с селектором {selector}: {e}")
+                continue
+        if not download_link:
+            raise Exception("Не удалось найти ссылку 'Скачать APK'")
+
+        href = await download_link.get_attribute("href")
+        if not href:
+            raise Exception("Не удалось получить href ссылки")
+        # Приводим ссылку к полному виду
+        if href.startswith('/'):
+            return f"https://apkcombo.com{href}"
+        return href
+
+    async def find_file_variant(self, page):
+        """Ищем первый вариант файла в ul.file-list на странице загрузки"""
+        print("🔍 Ищем первый вариант файла в ul.file-list...")
+        variant_selectors = self.FILE_VARIANT_SELECTORS
+
+        # Ждем появления списка файлов (прежние 5 сек паузы + 15 сек ожидания)
+        if not await self.wait_for_any_selector(page, variant_selectors, timeout=20000):
             return None
 
-    async def download_from_apkcombo(self, app_url):
-        """Скачиваем файл с apkcombo.com"""
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=[
-                    "--no-sandbox",
-                    "--disable-blink-features=AutomationControlled",
-                    "--disable-dev-shm-usage"
-                ]
-            )
-            context = await browser.new_context(
-                accept_downloads=True,
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            )
-            page = await context.new_page()
+        for selector in variant_selectors:
+            try:
+                print(f"   Ищем варианты с селектором: {selector}")
+                variant = await page.query_selector(selector)
+                if variant:
+                    print(f"   ✅ Найден вариант с селектором: {selector}")
+                    return variant
+            except:
+                continue
+        return None
 
+    async def open_download_page(self, page, download_page_url):
+        """Переходим на страницу загрузки и ищем вариант файла"""
+        await page.goto(download_page_url, wait_until="domcontentloaded", timeout=120000)
+        await self.wait_for_cloudflare(page, max_wait=60)
+        return await self.find_file_variant(page)
+
+    async def download_from_apkcombo(self, app_url, page_version=None, file_info=None, known_validators=None):
+        """Скачиваем файл с apkcombo.com
+
+        page_version - версия, уже полученная пробой страницы. Если она передана,
+        страница приложения повторно не открывается: сразу идем на страницу загрузки.
+        file_info - словарь, куда прямое скачивание кладет checksum, sha256_hash и file_size.
+        known_validators - валидаторы файла из file_tracking для проверки перед скачиванием.
+        """
+        async with self.browser_pool.page(accept_downloads=True, profile_url=app_url) as page, \
+                contextlib.AsyncExitStack() as host_slot:
             try:
-                print(f"📱 Открываем страницу приложения: {app_url}")
-                await page.goto(app_url, wait_until="domcontentloaded", timeout=60000)
-                # Ждем прохождения Cloudflare если есть
-                await self.wait_for_cloudflare(page, max_wait=60)
-                await asyncio.sleep(3)
-
-                # Получаем версию со страницы
-                page_version = await self.extract_version_from_page(app_url)
-
-                # Шаг 1: Ищем ссылку "Скачать APK"
-                print("🔍 Ищем ссылку 'Скачать APK'...")
-                download_link = None
-                selectors_to_try = [
-                    "a.button.is-success.is-fullwidth",
-                    "a.button.is-success",
-                    "a[href*='/download/apk']",
-                    "a[href*='/download/']",
-                    "div.download a.button"
-                ]
-                for selector in selectors_to_try:
-                    try:
-                        print(f"   Пробуем селектор: {selector}")
-                        elements = await page.query_selector_all(selector)
-                        for element in elements:
-                            href = await element.get_attribute("href")
-                            text = await element.inner_text()
-                            print(f"     Найден элемент: href={href}, text={text.strip()[:30]}")
-                            if href and ('/download/' in href or 'apk' in href.lower()):
-                                download_link = element
-                                print(f"   ✅ Выбран элемент с href: {href}")
-                                break
-                        if download_link:
-                            break
-                    except Exception as e:
-                        print(f"     Ошибка с селектором {selector}: {e}")
-                        continue
-                if not download_link:
-                    raise Exception("Не удалось найти ссылку 'Скачать APK'")
-
-                href = await download_link.get_attribute("href")
-                if not href:
-                    raise Exception("Не удалось получить href ссылки")
-                # Приводим ссылку к полному виду
-                if href.startswith('/'):
-                    download_page_url = f"https://apkcombo.com{href}"
-                else:
-                    download_page_url = href
-                print(f"➡️ Ссылка на страницу загрузки: {download_page_url}")
-
-                # Шаг 2: Переходим на страницу загрузки
-                await page.goto(download_page_url, wait_until="domcontentloaded", timeout=120000)
-                await self.wait_for_cloudflare(page, max_wait=60)
-                await asyncio.sleep(5)
-
-                # Шаг 3: Ищем первый вариант файла в ul.file-list
-                print("🔍 Ищем первый вариант файла в ul.file-list...")
-                variant_selectors = [
-                    "ul.file-list li a",
-                    "ul.file-list a",
-                    ".file-list li a",
-                    ".file-list a"
-                ]
+                await host_slot.enter_async_context(self.host_limiter.limit(app_url))
                 variant = None
-                for selector in variant_selectors:
-                    try:
-                        print(f"   Ищем варианты с селектором: {selector}")
-                        variant = await page.wait_for_selector(selector, timeout=15000)
-                        if variant:
-                            print(f"   ✅ Найден вариант с селектором: {selector}")
-                            break
-                    except:
-                        continue
+                if page_version:
+                    # Шаг 1-2: Страница приложения уже была прочитана пробой версии
+                    download_page_url = self.build_download_page_url(app_url)
+                    print(f"⏩ Версия {page_version} уже известна, переходим сразу на страницу загрузки: {download_page_url}")
+                    variant = await self.open_download_page(page, download_page_url)
+                    if not variant:
+                        print("⚠️ Прямая страница загрузки не сработала, открываем страницу приложения")
+
+                if not variant:
+                    print(f"📱 Открываем страницу приложения: {app_url}")
+                    await page.goto(app_url, wait_until="domcontentloaded", timeout=60000)
+                    # Ждем прохождения Cloudflare если есть
+                    await self.wait_for_cloudflare(page, max_wait=60)
+                    # Ждем появления ссылки скачивания (не дольше прежних 3 сек)
+                    await self.wait_for_any_selector(page, self.DOWNLOAD_LINK_SELECTORS, timeout=3000)
+
+                    # Получаем версию из уже загруженной страницы
+                    if not page_version:
+                        page_version = await self.extract_version_from_loaded_page(page, app_url)
+
+                    # Шаг 1: Ищем ссылку "Скачать APK"
+                    download_page_url = await self.find_download_page_url(page)
+                    print(f"➡️ Ссылка на страницу загрузки: {download_page_url}")
+
+                    # Шаг 2-3: Переходим на страницу загрузки и ищем вариант файла
+                    variant = await self.open_download_page(page, download_page_url)
+
                 if not variant:
                     raise Exception("Не удалось найти варианты загрузки в ul.file-list")
 
@@ -530,12 +471,17 @@ class FileDownloader:
                 except:
                     file_type = "APK"
                     version = "Unknown"
+
+                # Размер варианта для ранней проверки ответа r2
+                try:
+                    expected_size = StreamDownloader.parse_size(await variant.inner_text())
+                except Exception:
+                    expected_size = None
                 
                 # Формируем ожидаемое имя файла из данных сайта
                 expected_filename = None
                 if version != "Unknown" and file_type:
                     # Создаем правильное имя файла из версии и типа
-                    import re
                     clean_version = re.sub(r'[<>:"/\\|?*]', '', version.strip())
                     clean_type = file_type.strip().upper()
                     
@@ -558,8 +504,13 @@ class FileDownloader:
                     r2_url = r2_href
                 print(f"🔗 Найдена r2 ссылка: {r2_url}")
 
+                # Ссылка получена: слот apkcombo.com не держим на время передачи файла с r2,
+                # иначе скачивания занимают все слоты и останавливают пробы версий
+                await host_slot.aclose()
+
                 # Шаг 4: Скачиваем файл по r2 ссылке
-                downloaded_file = await self.download_file_from_r2_url(page, r2_url, expected_filename)
+                downloaded_file = await self.download_file_from_r2_url(page, r2_url, expected_filename, file_info,
+                                                                       expected_size, known_validators)
                 
                 # Возвращаем версию со страницы если есть, иначе версию из файла
                 final_version = page_version if page_version else version
@@ -576,6 +527,4 @@ class FileDownloader:
                     pass
                 return None, None
             finally:
-                await context.close()
-                await browser.close()
-                print("🔒 Браузер закрыт")
+                print("🔒 Страница возвращена в пул браузеров")
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Модуль для ограничения одновременных запросов к одному хосту
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+
+class HostLimiter:
+    """Класс для ограничения числа одновременных операций на хост"""
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self._semaphores = {}
+
+    def resolve_host(self, url: str) -> Optional[str]:
+        """Находим ключ лимита для URL (самое специфичное совпадение по домену)"""
+        host = (urlparse(url).hostname or '').lower()
+        if not host:
+            return None
+
+        # Сначала проверяем более длинные ключи: d.apkpure.com раньше apkpure.com
+        for key in sorted(self.limits, key=len, reverse=True):
+            if host == key or host.endswith('.' + key):
+                return key
+
+        return None
+
+    @asynccontextmanager
+    async def limit(self, url: str):
+        """Занимаем слот хоста на время операции"""
+        key = self.resolve_host(url)
+        if key is None:
+            yield
+            return
+
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limits[key])
+            self._semaphores[key] = semaphore
+
+        async with semaphore:
+            yield
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Быстрая проба версии без браузера
+Страница загружается через cloudscraper и разбирается BeautifulSoup теми же
+селекторами, что и в Playwright. Браузер нужен только при проверке Cloudflare
+или если версия в HTML не найдена.
+"""
+import asyncio
+import threading
+from ..config import HTTP_PROBE_TIMEOUT
+from .cloudflare import CloudflareGuard, get_clearance_store
+from .session_pool import get_session_pool
+from .page_version import PageVersionParser, BeautifulSoup
+
+
+class HttpVersionProbe:
+    """Получение версии со страницы приложения по HTTP"""
+
+    # Результаты пробы
+    HIT = 'hit'
+    CHALLENGE = 'challenge'
+    NO_MATCH = 'no_match'
+    ERROR = 'error'
+
+    def __init__(self, clearance_store=None, timeout=HTTP_PROBE_TIMEOUT, page_cache=None, session_pool=None):
+        self.clearance_store = clearance_store or get_clearance_store()
+        self.page_cache = page_cache
+        self.timeout = timeout
+        # Сессии cloudscraper по хостам: keep-alive и решенные проверки переиспользуются
+        self.session_pool = session_pool or get_session_pool()
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'hits': 0, 'not_modified': 0, 'challenges': 0, 'no_match': 0, 'errors': 0}
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _conditional_headers(self, cached):
+        """Заголовки условного запроса по валидаторам из кэша"""
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def _version_from_cache(self, url, cached):
+        """Страница не изменилась: берем версию из кэша (или разбираем сохраненный HTML)"""
+        version = cached.get('version')
+        if not version:
+            html = self.page_cache.read_html(cached)
+            if html:
+                version = PageVersionParser.extract_from_soup(PageVersionParser.parse_html(html), url,
+                                                              use_page_text=False)
+        self.page_cache.touch(url, version)
+        return version
+
+    def fetch_version(self, url):
+        """Загружаем страницу и ищем версию в HTML, возвращаем (результат, версия)"""
+        self._count('requests')
+        if BeautifulSoup is None:
+            # Без bs4 разбирать HTML нечем - сразу идем в браузер
+            self._count('errors')
+            return self.ERROR, None
+
+        cached = self.page_cache.get(url) if self.page_cache else None
+
+        session = self.session_pool.acquire(url)
+        try:
+            return self._fetch_with_session(session, url, cached)
+        finally:
+            self.session_pool.release(url, session)
+
+    def _fetch_with_session(self, session, url, cached):
+        """Запрос страницы выданной пулом сессией и разбор ответа"""
+        try:
+            self.clearance_store.apply_to_session(session, url)
+            response = session.get(url, allow_redirects=True, timeout=self.timeout,
+                                   headers=self._conditional_headers(cached))
+        except Exception as e:
+            print(f"⚠️ HTTP-проба не удалась ({url}): {e}")
+            self._count('errors')
+            return self.ERROR, None
+
+        if response.status_code == 304 and cached:
+            print(f"♻️ Страница не изменилась (304), используем кэш: {url}")
+            self._count('not_modified')
+            version = self._version_from_cache(url, cached)
+            if version:
+                self._count('hits')
+                return self.HIT, version
+            self._count('no_match')
+            return self.NO_MATCH, None
+
+        soup = PageVersionParser.parse_html(response.text)
+        if CloudflareGuard.is_challenge_html(soup, response.status_code):
+            print(f"🛡️ HTTP-проба получила проверку Cloudflare (HTTP {response.status_code}), нужен браузер")
+            self._count('challenges')
+            return self.CHALLENGE, None
+
+        if response.status_code != 200:
+            print(f"⚠️ HTTP-проба: статус {response.status_code} для {url}")
+            self._count('errors')
+            return self.ERROR, None
+
+        # cloudscraper мог решить проверку сам - сохраняем clearance
+        self.clearance_store.save_from_session(session, response.url)
+
+        html = response.text
+        # Без поиска по тексту страницы: любое число вида "Rating 4.3" сошло бы за версию,
+        # такие страницы отдаем браузеру
+        version = PageVersionParser.extract_from_soup(soup, url, use_page_text=False)
+        if self.page_cache:
+            self.page_cache.put(url, html, version,
+                                etag=response.headers.get('ETag'),
+                                last_modified=response.headers.get('Last-Modified'))
+        if not version:
+            self._count('no_match')
+            return self.NO_MATCH, None
+
+        self._count('hits')
+        return self.HIT, version
+
+    async def probe(self, url):
+        """Асинхронная проба: запрос и разбор HTML выполняются в отдельном потоке"""
+        return await asyncio.to_thread(self.fetch_version, url)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Кэш страниц приложений на диске
+HTML хранится сжатым, в индексе - URL, найденная версия, время загрузки
+и валидаторы (ETag/Last-Modified) для условных запросов
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+from ..config import PAGE_CACHE_DIR, PAGE_CACHE_TTL, PAGE_CACHE_MAX_BYTES
+
+
+class PageCache:
+    """Кэш страниц с TTL, ревалидацией и вытеснением по LRU"""
+
+    INDEX_FILE = 'index.json'
+    INDEX_SAVE_INTERVAL = 30  # Как часто сохранять индекс после одних только чтений (сек)
+
+    def __init__(self, cache_dir: str = PAGE_CACHE_DIR, ttl: int = PAGE_CACHE_TTL,
+                 max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+        self._dirty = False  # В индексе есть несохраненные изменения (last_access)
+        self._saved_at = time.monotonic()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'revalidated': 0, 'stored': 0, 'evicted': 0}
+
+    def _load_index(self) -> Dict:
+        """Загружаем индекс кэша с диска"""
+        try:
+            index_path = self.cache_dir / self.INDEX_FILE
+            if index_path.exists():
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать индекс кэша страниц: {e}")
+        return {}
+
+    def _save_index(self):
+        """Атомарно сохраняем индекс (вызывается под блокировкой)"""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            index_path = self.cache_dir / self.INDEX_FILE
+            tmp_path = index_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._index, f, ensure_ascii=False)
+            os.replace(tmp_path, index_path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить индекс кэша страниц: {e}")
+
+    def flush(self):
+        """Сохраняем индекс, если в нем есть несохраненные изменения"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    @staticmethod
+    def _file_name(url: str) -> str:
+        return hashlib.sha1(url.encode('utf-8')).hexdigest() + '.html.gz'
+
+    def is_fresh(self, entry: Dict) -> bool:
+        """Запись моложе TTL"""
+        return time.time() - entry.get('fetched_at', 0) < self.ttl
+
+    def get(self, url: str) -> Optional[Dict]:
+        """Запись кэша для URL (в том числе устаревшая - для ревалидации)"""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return None
+            if not (self.cache_dir / entry['file']).exists():
+                del self._index[url]
+                self._dirty = True
+                return None
+            # Время обращения нужно LRU в следующих запусках: индекс сохраняется не чаще INDEX_SAVE_INTERVAL
+            entry['last_access'] = time.time()
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= self.INDEX_SAVE_INTERVAL:
+                self._save_index()
+            return dict(entry)
+
+    def get_fresh_version(self, url: str) -> Optional[str]:
+        """Версия из свежей записи кэша без запроса к сайту"""
+        entry = self.get(url)
+        if entry and self.is_fresh(entry) and entry.get('version'):
+            self.stats['hits'] += 1
+            return entry['version']
+        self.stats['stale' if entry else 'misses'] += 1
+        return None
+
+    def read_html(self, entry: Dict) -> Optional[str]:
+        """HTML страницы из записи кэша"""
+        try:
+            with gzip.open(self.cache_dir / entry['file'], 'rt', encoding='utf-8') as f:
+                return f.read()
+        except Exception as e:
+            print(f"⚠️ Не удалось прочитать страницу из кэша: {e}")
+            return None
+
+    def put(self, url: str, html: str, version: Optional[str] = None,
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Сохраняем страницу, найденную версию и валидаторы"""
+        file_name = self._file_name(url)
+        tmp_path = None
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            file_path = self.cache_dir / file_name
+            # Уникальный временный файл: одну страницу могут сохранять одновременно
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=file_name + '.', suffix='.tmp',
+                                             delete=False) as tmp:
+                tmp_path = Path(tmp.name)
+                with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+                    f.write(html)
+            os.replace(tmp_path, file_path)
+            size = file_path.stat().st_size
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить страницу в кэш: {e}")
+            if tmp_path:
+                tmp_path.unlink(missing_ok=True)
+            return
+
+        now = time.time()
+        with self._lock:
+            self._index[url] = {
+                'file': file_name,
+                'version': version,
+                'etag': etag,
+                'last_modified': last_modified,
+                'fetched_at': now,
+                'last_access': now,
+                'size': size
+            }
+            self.stats['stored'] += 1
+            self._evict()
+            self._save_index()
+
+    def touch(self, url: str, version: Optional[str] = None):
+        """Страница не изменилась (304): продлеваем свежесть записи"""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None:
+                return
+            entry['fetched_at'] = entry['last_access'] = time.time()
+            if version:
+                entry['version'] = version
+            self.stats['revalidated'] += 1
+            self._save_index()
+
+    def _evict(self):
+        """Вытесняем давно не использованные записи сверх лимита (под блокировкой)"""
+        total = sum(entry.get('size', 0) for entry in self._index.values())
+        if total <= self.max_bytes:
+            return
+
+        for url, entry in sorted(self._index.items(), key=lambda item: item[1].get('last_access', 0)):
+            if total <= self.max_bytes:
+                break
+            try:
+                (self.cache_dir / entry['file']).unlink(missing_ok=True)
+            except Exception as e:
+                print(f"⚠️ Не удалось удалить страницу из кэша: {e}")
+            total -= entry.get('size', 0)
+            del self._index[url]
+            self.stats['evicted'] += 1
+
+
+_shared_cache = None
+
+
+def get_page_cache() -> PageCache:
+    """Получаем общий для процесса кэш страниц"""
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = PageCache()
+    return _shared_cache
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Извлечение версии из уже загруженной страницы приложения
+Общие селекторы и паттерны для VersionExtractor и загрузчиков
+"""
+import asyncio
+import re
+from .structured_data import StructuredDataExtractor, BeautifulSoup, HTML_PARSER
+
+
+class PageVersionParser:
+    """Поиск версии в DOM страницы APKCombo/APKPure без повторной навигации"""
+
+    # Селекторы версии в зависимости от сайта
+    APKCOMBO_SELECTORS = [
+        "div.version",
+        ".version",
+        "[class*='version']",
+        ".app-version",
+        ".ver",
+        "[class*='ver']",
+        "span.version",
+        "div.ver",
+        ".app-info .version",
+        ".download-info .version",
+        "div[class*='app'] span[class*='version']",
+        ".info .version",
+        "div.info span.version"
+    ]
+
+    APKPURE_SELECTORS = [
+        "div.version",
+        ".version",
+        "[class*='version']",
+        ".app-version",
+        ".ver",
+        "[class*='ver']",
+        "span.version",
+        "div.ver",
+        ".details .version",
+        ".app-details .version",
+        ".info .version",
+        "div[class*='detail'] span[class*='version']",
+        ".version-info",
+        "div[class*='version']"
+    ]
+
+    # Универсальные селекторы
+    DEFAULT_SELECTORS = [
+        "div.version", ".version", "[class*='version']", ".app-version",
+        ".ver", "[class*='ver']", "span.version", "div.ver"
+    ]
+
+    # Паттерны версии в тексте найденного элемента
+    ELEMENT_PATTERNS = [
+        r'(\d+\.\d+\.\d+)',           # 1.2.3
+        r'(\d+\.\d+)',                # 1.2
+        r'Version\s*:?\s*(\d+\.\d+\.\d+)',  # Version: 1.2.3
+        r'Версия\s*:?\s*(\d+\.\d+\.\d+)',   # Версия: 1.2.3
+        r'v(\d+\.\d+\.\d+)',          # v1.2.3
+        r'(\d+\.\d+\.\d+\.\d+)'       # 1.2.3.4
+    ]
+
+    # Паттерны версии в тексте всей страницы
+    PAGE_TEXT_PATTERNS = [
+        r'Version\s*:?\s*(\d+\.\d+\.\d+)',
+        r'Версия\s*:?\s*(\d+\.\d+\.\d+)',
+        r'v(\d+\.\d+\.\d+)',
+        r'(\d+\.\d+\.\d+)',
+        r'(\d+\.\d+)'
+    ]
+
+    @staticmethod
+    def get_selectors(url):
+        """Получаем список селекторов версии для сайта"""
+        if 'apkcombo.com' in url:
+            return PageVersionParser.APKCOMBO_SELECTORS
+        if 'apkpure.com' in url:
+            return PageVersionParser.APKPURE_SELECTORS
+        return PageVersionParser.DEFAULT_SELECTORS
+
+    @staticmethod
+    def extract_version_from_element_text(text):
+        """Извлекаем версию из текста элемента"""
+        for pattern in PageVersionParser.ELEMENT_PATTERNS:
+            version_match = re.search(pattern, text, re.IGNORECASE)
+            if version_match:
+                return version_match.group(1)
+        return None
+
+    @staticmethod
+    def extract_version_from_page_text(text):
+        """Извлекаем первую найденную версию из текста страницы"""
+        for pattern in PageVersionParser.PAGE_TEXT_PATTERNS:
+            matches = re.findall(pattern, text, re.IGNORECASE)
+            if matches:
+                return matches[0]
+        return None
+
+    @staticmethod
+    def parse_html(html):
+        """Разбираем HTML в дерево BeautifulSoup (None, если bs4 не установлен)"""
+        if BeautifulSoup is None:
+            return None
+        return BeautifulSoup(html, HTML_PARSER)
+
+    @staticmethod
+    def extract_from_structured_data(soup):
+        """Версия из JSON-LD/meta/встроенного JSON - основной путь перед селекторами"""
+        data = StructuredDataExtractor.extract_from_soup(soup)
+        version = data.get('version')
+        if version:
+            details = ', '.join(f"{key}={data[key]}" for key in ('package_name', 'size') if key in data)
+            print(f"    ✅ Найдена версия в структурированных данных ({data.get('source')}): {version}"
+                  + (f" [{details}]" if details else ""))
+        return version
+
+    @staticmethod
+    def extract_from_soup(soup, url, use_page_text=True):
+        """Ищем версию в разобранном HTML: структурированные данные, затем селекторы"""
+        version = PageVersionParser.extract_from_structured_data(soup)
+        if version:
+            return version
+
+        for selector in PageVersionParser.get_selectors(url):
+            try:
+                element = soup.select_one(selector)
+                if not element:
+                    continue
+
+                version = PageVersionParser.extract_version_from_element_text(element.get_text(" ", strip=True))
+                if version:
+                    print(f"    ✅ Найдена версия в HTML ({selector}): {version}")
+                    return version
+            except Exception as e:
+                print(f"    ⚠️ Ошибка селектора {selector}: {e}")
+                continue
+
+        if not use_page_text or soup.body is None:
+            return None
+
+        # Текст страницы без скриптов и стилей (как inner_text в браузере)
+        for tag in soup.body(['script', 'style', 'noscript', 'template']):
+            tag.decompose()
+        return PageVersionParser.extract_version_from_page_text(soup.body.get_text(" ", strip=True))
+
+    @staticmethod
+    async def extract_from_page(page, url, use_page_text=True):
+        """Ищем версию на уже загруженной странице Playwright"""
+        # Структурированные данные разбираются из HTML за один проход
+        if BeautifulSoup is not None:
+            try:
+                html = await page.content()
+                soup = await asyncio.to_thread(PageVersionParser.parse_html, html)
+                version = PageVersionParser.extract_from_structured_data(soup)
+                if version:
+                    return version
+            except Exception as e:
+                print(f"    ⚠️ Ошибка чтения структурированных данных: {e}")
+
+        version_selectors = PageVersionParser.get_selectors(url)
+        print(f"🔍 Ищем версию с {len(version_selectors)} селекторами...")
+
+        for i, selector in enumerate(version_selectors, 1):
+            try:
+                element = await page.query_selector(selector)
+                if not element:
+                    continue
+
+                version_text = await element.inner_text()
+                version = PageVersionParser.extract_version_from_element_text(version_text)
+                if version:
+                    print(f"    ✅ Найдена версия ({selector}): {version}")
+                    return version
+            except Exception as e:
+                print(f"    ⚠️ Ошибка селектора {selector}: {e}")
+                continue
+
+        if not use_page_text:
+            return None
+
+        # Если версия не найдена через селекторы, ищем в тексте страницы
+        print("🔍 Ищем версию в тексте страницы...")
+        try:
+            page_text = await page.inner_text('body')
+            version = PageVersionParser.extract_version_from_page_text(page_text)
+            if version:
+                print(f"✅ Найдена версия в тексте страницы: {version}")
+                return version
+            print("❌ Версия не найдена в тексте страницы")
+        except Exception as e:
+            print(f"❌ Ошибка поиска в тексте страницы: {e}")
+
+        return None
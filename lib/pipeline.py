@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Модуль конвейерной обработки: этапы, связанные ограниченными очередями
+"""
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+# Маркер остановки воркеров этапа
+_STOP = object()
+
+
+class Pipeline:
+    """Конвейер этапов с ограниченными очередями между ними
+
+    Каждый этап - это async функция handler(item):
+    - вернула None: элемент передается на следующий этап
+    - вернула True/False: обработка элемента завершена (успех/ошибка)
+    Ограниченные очереди дают обратное давление: медленный этап
+    останавливает предыдущие, а не копит элементы в памяти и на диске.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Callable[[dict], Awaitable[Optional[bool]]], int]],
+                 queue_size: int = 2, max_in_flight: int = 0,
+                 on_finished: Callable[[dict, bool], None] = None,
+                 on_error: Callable[[dict, str, Exception], None] = None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight
+        self.on_finished = on_finished
+        self.on_error = on_error
+        self._in_flight = None
+
+    def _finish(self, item: dict, success: bool):
+        """Завершаем обработку элемента"""
+        if self.on_finished:
+            self.on_finished(item, success)
+        if self._in_flight:
+            self._in_flight.release()
+
+    async def _stage_worker(self, index: int, queues: List[asyncio.Queue]):
+        """Воркер одного этапа"""
+        name, handler, _ = self.stages[index]
+        is_last = index == len(self.stages) - 1
+
+        while True:
+            item = await queues[index].get()
+            if item is _STOP:
+                return
+
+            try:
+                result = await handler(item)
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(item, name, e)
+                self._finish(item, False)
+                continue
+
+            if result is None and not is_last:
+                # Блокируется, если следующий этап не успевает
+                await queues[index + 1].put(item)
+            else:
+                self._finish(item, bool(result) if result is not None else True)
+
+    async def _iter_items(self, items):
+        """Единый async-обход обычных и асинхронных источников элементов"""
+        if hasattr(items, '__aiter__'):
+            async for item in items:
+                yield item
+        else:
+            for item in items:
+                yield item
+
+    async def run(self, items):
+        """Прогоняем элементы через все этапы (items - итерируемый или async-итерируемый)"""
+        self._in_flight = asyncio.Semaphore(self.max_in_flight) if self.max_in_flight > 0 else None
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        stage_tasks = [
+            [asyncio.create_task(self._stage_worker(index, queues)) for _ in range(max(1, workers))]
+            for index, (_, _, workers) in enumerate(self.stages)
+        ]
+
+        try:
+            async for item in self._iter_items(items):
+                if self._in_flight:
+                    await self._in_flight.acquire()
+                await queues[0].put(item)
+        finally:
+            # Останавливаем этапы по порядку: этап k завершен - значит
+            # все его элементы уже переданы на этап k + 1
+            for queue, tasks in zip(queues, stage_tasks):
+                for _ in tasks:
+                    await queue.put(_STOP)
+                await asyncio.gather(*tasks)
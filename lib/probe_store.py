@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Хранилище результатов проб версий (SQLite)
+Повторный запуск после сбоя или второй проход за день берет свежие
+версии отсюда, не открывая страницы заново. Таблица version_history
+хранит момент появления каждой версии пакета (пробы и file_tracking),
+package_checks - время последней успешной обработки пакета
+"""
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from ..config import PROBE_STORE_FILE, PROBE_FRESHNESS_WINDOW
+
+
+class ProbeStore:
+    """Последний результат пробы для каждой пары (package_name, источник)"""
+
+    # Статусы пробы
+    STATUS_OK = 'ok'
+    STATUS_NOT_FOUND = 'not_found'
+    STATUS_TIMEOUT = 'timeout'
+    STATUS_ERROR = 'error'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS probe_results (
+            package_name TEXT NOT NULL,
+            source TEXT NOT NULL,
+            version TEXT,
+            probed_at REAL NOT NULL,
+            probe_latency REAL,
+            status TEXT NOT NULL,
+            PRIMARY KEY (package_name, source)
+        )
+    """
+
+    HISTORY_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS version_history (
+            package_name TEXT NOT NULL,
+            source TEXT NOT NULL,
+            version TEXT NOT NULL,
+            first_seen REAL NOT NULL,
+            PRIMARY KEY (package_name, source, version)
+        )
+    """
+
+    CHECKS_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS package_checks (
+            package_name TEXT PRIMARY KEY,
+            checked_at REAL NOT NULL
+        )
+    """
+
+    # Источник истории из таблицы file_tracking
+    TRACKING_SOURCE = 'file_tracking'
+
+    def __init__(self, path: str = PROBE_STORE_FILE, freshness_window: int = PROBE_FRESHNESS_WINDOW):
+        self.path = Path(path)
+        self.freshness_window = freshness_window
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute(self.SCHEMA)
+            self._conn.execute(self.HISTORY_SCHEMA)
+            self._conn.execute(self.CHECKS_SCHEMA)
+        self.stats = {'reused': 0, 'probed': 0}
+
+    @staticmethod
+    def get_source(url: str) -> str:
+        """Источник пробы - хост без www (apkcombo.com, apkpure.com)"""
+        host = (urlparse(url).hostname or '').lower()
+        return host[4:] if host.startswith('www.') else host
+
+    def get(self, package_name: str, source: str) -> Optional[Dict]:
+        """Последний результат пробы пакета на источнике"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM probe_results WHERE package_name = ? AND source = ?",
+                (package_name, source)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_fresh(self, package_name: str, source: str) -> Optional[Dict]:
+        """Успешный результат пробы, полученный в пределах окна свежести"""
+        result = self.get(package_name, source)
+        if not result or result['status'] != self.STATUS_OK or not result['version']:
+            return None
+        if time.time() - result['probed_at'] > self.freshness_window:
+            return None
+        self.stats['reused'] += 1
+        return result
+
+    def record(self, package_name: str, source: str, version: Optional[str],
+               probe_latency: float, status: str):
+        """Сохраняем результат пробы"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT INTO probe_results (package_name, source, version, probed_at, probe_latency, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(package_name, source) DO UPDATE SET
+                    version = excluded.version,
+                    probed_at = excluded.probed_at,
+                    probe_latency = excluded.probe_latency,
+                    status = excluded.status
+                """,
+                (package_name, source, version, time.time(), probe_latency, status)
+            )
+            if status == self.STATUS_OK and version:
+                # Новая версия попадает в историю с моментом первого обнаружения
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO version_history (package_name, source, version, first_seen) VALUES (?, ?, ?, ?)",
+                    (package_name, source, version, time.time())
+                )
+        self.stats['probed'] += 1
+
+    def import_tracking_history(self, rows: List[Dict]) -> int:
+        """Добавляем в историю версии из file_tracking (package_name, version, download_date)"""
+        records = []
+        for row in rows:
+            if not row.get('package_name') or not row.get('version'):
+                continue
+            seen_at = row.get('download_date')
+            if isinstance(seen_at, str):
+                try:
+                    seen_at = time.mktime(time.strptime(seen_at[:19], '%Y-%m-%d %H:%M:%S'))
+                except ValueError:
+                    continue
+            elif hasattr(seen_at, 'timestamp'):
+                seen_at = seen_at.timestamp()
+            if not seen_at:
+                continue
+            records.append((row['package_name'], self.TRACKING_SOURCE, row['version'], float(seen_at)))
+
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO version_history (package_name, source, version, first_seen) VALUES (?, ?, ?, ?)",
+                records
+            )
+            return self._conn.total_changes - before
+
+    @staticmethod
+    def normalize_version(version: str) -> str:
+        """Ключ версии для истории: '5.0', '5.0.0' и 'v5.0' - одна версия"""
+        version = str(version).strip().lower()
+        version = re.sub(r'^v(?=\d)', '', version)
+        return re.sub(r'(?:\.0+)+$', '', version) or version
+
+    def get_version_history(self, package_name: str) -> List[Dict]:
+        """Версии пакета по всем источникам с моментом первого появления (по времени)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, first_seen FROM version_history WHERE package_name = ?",
+                (package_name,)
+            ).fetchall()
+
+        # Источники пишут одну версию по-разному, группируем по нормализованной
+        history = {}
+        for row in rows:
+            key = self.normalize_version(row['version'])
+            if key not in history or row['first_seen'] < history[key]['first_seen']:
+                history[key] = {'version': row['version'], 'first_seen': row['first_seen']}
+        return sorted(history.values(), key=lambda entry: entry['first_seen'])
+
+    def record_checks(self, checks: List[Tuple[str, float]]):
+        """Сохраняем время успешной обработки пакетов [(package_name, время)]"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """
+                INSERT INTO package_checks (package_name, checked_at) VALUES (?, ?)
+                ON CONFLICT(package_name) DO UPDATE SET checked_at = MAX(checked_at, excluded.checked_at)
+                """,
+                checks
+            )
+
+    def get_last_checked_at(self, package_name: str) -> Optional[float]:
+        """Время последней успешной обработки пакета"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT checked_at FROM package_checks WHERE package_name = ?", (package_name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        """Закрываем соединение с базой"""
+        with self._lock:
+            self._conn.close()
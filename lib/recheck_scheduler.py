@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Адаптивное расписание перепроверки приложений
+Интервал обновлений каждого пакета оценивается по истории версий:
+часто обновляемые приложения проверяются каждый запуск, редкие - реже
+"""
+import json
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from ..config import (RECHECK_INTERVAL_FACTOR, RECHECK_MIN_INTERVAL, RECHECK_MAX_INTERVAL,
+                      RECHECK_MIN_HISTORY)
+
+
+class RecheckScheduler:
+    """Решает, нужно ли опрашивать пакет в текущем запуске"""
+
+    def __init__(self, probe_store, force: bool = False, factor: float = RECHECK_INTERVAL_FACTOR,
+                 min_interval: int = RECHECK_MIN_INTERVAL, max_interval: int = RECHECK_MAX_INTERVAL,
+                 min_history: int = RECHECK_MIN_HISTORY):
+        self.probe_store = probe_store
+        self.force = force
+        self.factor = factor
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_history = min_history
+        self.skipped: List[Dict] = []
+        self.stats = {'scheduled': 0, 'skipped': 0, 'no_history': 0, 'forced': 0}
+
+    def estimate_update_interval(self, package_name: str) -> Optional[float]:
+        """Медианный интервал между сменами версий (сек) или None, если истории мало"""
+        history = self.probe_store.get_version_history(package_name)
+        if len(history) < self.min_history:
+            return None
+        seen = [entry['first_seen'] for entry in history]
+        intervals = [later - earlier for earlier, later in zip(seen, seen[1:]) if later > earlier]
+        return statistics.median(intervals) if intervals else None
+
+    def get_recheck_period(self, update_interval: Optional[float]) -> float:
+        """Период перепроверки по интервалу обновлений"""
+        if update_interval is None:
+            return self.min_interval
+        period = update_interval * self.factor
+        return max(self.min_interval, min(self.max_interval, period))
+
+    def should_probe(self, package_names: List[str], link_data: Dict = None) -> bool:
+        """Нужно ли опрашивать строку в этом запуске (пора проверить хотя бы один из ее пакетов)"""
+        if self.force:
+            self.stats['forced'] += 1
+            return True
+        if not package_names:
+            self.stats['scheduled'] += 1
+            return True
+
+        pending = []
+        for package_name in package_names:
+            update_interval = self.estimate_update_interval(package_name)
+            if update_interval is None:
+                self.stats['no_history'] += 1
+                self.stats['scheduled'] += 1
+                return True
+
+            # Проверкой считается только успешно обработанная строка, а не проба
+            last_checked_at = self.probe_store.get_last_checked_at(package_name)
+            period = self.get_recheck_period(update_interval)
+            if last_checked_at is None or time.time() - last_checked_at >= period:
+                self.stats['scheduled'] += 1
+                return True
+            pending.append((last_checked_at + period, package_name, update_interval, last_checked_at))
+
+        next_check, package_name, update_interval, last_checked_at = min(pending)
+        self.skipped.append({
+            'package_name': package_name,
+            'package_names': list(package_names),
+            'news_id': (link_data or {}).get('news_id'),
+            'filename': (link_data or {}).get('filename'),
+            'update_interval_days': round(update_interval / 86400, 2),
+            'last_checked_at': datetime.fromtimestamp(last_checked_at).isoformat(timespec='seconds'),
+            'next_check': datetime.fromtimestamp(next_check).isoformat(timespec='seconds')
+        })
+        self.stats['skipped'] += 1
+        return False
+
+    def save_skipped_report(self, log_dir: str = "logs") -> Optional[Path]:
+        """Сохраняем отчет о пропущенных строках"""
+        if not self.skipped:
+            return None
+        report_path = Path(log_dir) / f"recheck_skipped_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.skipped, f, ensure_ascii=False, indent=2)
+        return report_path
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Модуль блокировки тяжелых ресурсов в контекстах Playwright
+Отсекает картинки, шрифты, стили, аналитику и рекламу
+"""
+from typing import Dict
+from urllib.parse import urlparse
+from ..config import RESOURCE_BLOCKING
+
+
+def _host_matches(host: str, pattern: str) -> bool:
+    """Проверяем совпадение хоста с доменом или его поддоменом"""
+    return host == pattern or host.endswith('.' + pattern)
+
+
+class ResourceBlocker:
+    """Перехват запросов контекста по профилю блокировки"""
+
+    def __init__(self, profile: Dict = None):
+        profile = profile or RESOURCE_BLOCKING
+        self.enabled = profile.get('enabled', False)
+        self.block_types = set(profile.get('block_types', []))
+        self.block_hosts = list(profile.get('block_hosts', []))
+        self.allowlist = dict(profile.get('allowlist', {}))
+        self.stats = {'blocked': 0, 'allowed': 0}
+
+    def is_allowed(self, url: str, host: str) -> bool:
+        """Проверяем разрешающий список доменов (ресурсы проверки Cloudflare)"""
+        for domain, fragments in self.allowlist.items():
+            if not _host_matches(host, domain):
+                continue
+            if '*' in fragments or any(fragment in url for fragment in fragments):
+                return True
+        return False
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        """Решаем, нужно ли отменить запрос"""
+        host = (urlparse(url).hostname or '').lower()
+
+        if self.is_allowed(url, host):
+            return False
+        if resource_type in self.block_types:
+            return True
+        return any(_host_matches(host, blocked) for blocked in self.block_hosts)
+
+    async def handle_route(self, route):
+        """Обработчик route: отменяем тяжелые запросы, остальные пропускаем"""
+        request = route.request
+        try:
+            if self.should_block(request.url, request.resource_type):
+                self.stats['blocked'] += 1
+                await route.abort()
+            else:
+                self.stats['allowed'] += 1
+                await route.continue_()
+        except Exception:
+            # Страница могла закрыться во время обработки запроса
+            pass
+
+    async def install(self, context):
+        """Включаем перехват запросов для контекста"""
+        if self.enabled:
+            await context.route("**/*", self.handle_route)
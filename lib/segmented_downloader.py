@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Скачивание больших файлов несколькими параллельными соединениями
+Файл заранее выделяется на диске, каждый диапазон байт пишется по своему
+смещению своей HTTP-сессией и повторяется отдельно. После сборки считаются
+MD5/SHA-256 всего файла
+"""
+import base64
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from ..config import SEGMENTED_DOWNLOAD_ENABLED, SEGMENTED_MIN_SIZE, SEGMENTED_BYTES_PER_CONNECTION
+from ..config import SEGMENTED_MAX_CONNECTIONS, STREAM_CHUNK_SIZE, STREAM_READ_TIMEOUT
+from ..config import STREAM_PROGRESS_INTERVAL, STREAM_MAX_RETRIES, ENABLE_SHA256_CHECK, SEGMENTED_MD5_ETAG_HOSTS
+from .session_pool import get_session_pool
+
+
+class SegmentedDownloader:
+    """Параллельное скачивание диапазонами для серверов с Accept-Ranges (r2, d.apkpure.com)"""
+
+    def __init__(self, min_size=SEGMENTED_MIN_SIZE, bytes_per_connection=SEGMENTED_BYTES_PER_CONNECTION,
+                 max_connections=SEGMENTED_MAX_CONNECTIONS, chunk_size=STREAM_CHUNK_SIZE,
+                 read_timeout=STREAM_READ_TIMEOUT, progress_interval=STREAM_PROGRESS_INTERVAL,
+                 max_retries=STREAM_MAX_RETRIES, bandwidth=None, session_pool=None):
+        self.min_size = min_size
+        self.bytes_per_connection = max(1, bytes_per_connection)
+        self.max_connections = max(1, max_connections)
+        self.chunk_size = chunk_size
+        self.read_timeout = read_timeout
+        self.progress_interval = progress_interval
+        self.max_retries = max(1, max_retries)
+        self.bandwidth = bandwidth
+        self.session_pool = session_pool or get_session_pool()
+
+    @staticmethod
+    def get_if_range_validator(etag, last_modified):
+        """Валидатор для If-Range: сильный ETag, иначе Last-Modified
+
+        Слабый ETag (W/"...") в If-Range запрещен (RFC 9110), сервер ответит
+        полным телом с 200 вместо диапазона.
+        """
+        etag = (etag or '').strip()
+        if etag and not etag.startswith('W/'):
+            return etag
+        return last_modified or None
+
+    def can_download(self, response) -> bool:
+        """Сервер отдает диапазоны, файл достаточно большой и есть валидатор для If-Range"""
+        if not SEGMENTED_DOWNLOAD_ENABLED or response.status_code != 200:
+            return False
+        if response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+            return False
+        if not self.get_if_range_validator(response.headers.get('ETag'), response.headers.get('Last-Modified')):
+            return False
+        total = int(response.headers.get('Content-Length') or 0)
+        return total >= self.min_size and self.get_connection_count(total) > 1
+
+    def get_connection_count(self, total: int) -> int:
+        """Число соединений растет с размером файла"""
+        return max(1, min(self.max_connections, total // self.bytes_per_connection))
+
+    @staticmethod
+    def plan_segments(total: int, count: int):
+        """Делим файл на count диапазонов [start, end] включительно"""
+        size = -(-total // count)
+        return [
+            {'start': start, 'end': min(start + size, total) - 1, 'done': 0}
+            for start in range(0, total, size)
+        ]
+
+    @staticmethod
+    def preallocate(path, total: int):
+        """Выделяем место под весь файл заранее"""
+        with open(path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, total)
+                    return
+                except OSError:
+                    pass
+            f.truncate(total)
+
+    @staticmethod
+    def get_contiguous_bytes(segments) -> int:
+        """Сколько байт с начала файла скачано без пропусков"""
+        contiguous = 0
+        for segment in segments:
+            contiguous = segment['start'] + segment['done']
+            if segment['start'] + segment['done'] <= segment['end']:
+                break
+        return contiguous
+
+    def clone_session(self, session, url):
+        """Отдельная сессия из пула для потока диапазона с cookies и заголовками исходной
+
+        Сессия requests не потокобезопасна, поэтому потоки диапазонов не делят одну
+        сессию; cookies (в том числе cf_clearance) берутся из исходной.
+        """
+        segment_session = self.session_pool.acquire(url)
+        segment_session.headers.update(session.headers)
+        segment_session.cookies.update(session.cookies)
+        return segment_session
+
+    def _download_segment(self, session, url, path, segment, validator, headers, progress):
+        """Скачиваем один диапазон с повторами, продолжая с места обрыва"""
+        for attempt in range(1, self.max_retries + 1):
+            start = segment['start'] + segment['done']
+            if start > segment['end']:
+                return
+            request_headers = dict(headers or {})
+            request_headers['Range'] = f"bytes={start}-{segment['end']}"
+            request_headers['If-Range'] = validator
+            try:
+                with session.get(url, stream=True, allow_redirects=True,
+                                 timeout=(30, self.read_timeout), headers=request_headers) as response:
+                    content_range = response.headers.get('Content-Range', '')
+                    match = re.match(r'bytes\s+(\d+)-', content_range)
+                    if response.status_code != 206 or not match or int(match.group(1)) != start:
+                        # 200 вместо 206 - файл на сервере изменился, части несовместимы
+                        raise ValueError(f"HTTP {response.status_code}, Content-Range '{content_range}'")
+
+                    with open(path, 'r+b') as f:
+                        f.seek(start)
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            if not chunk:
+                                continue
+                            chunk = chunk[:segment['end'] + 1 - segment['start'] - segment['done']]
+                            f.write(chunk)
+                            segment['done'] += len(chunk)
+                            progress(len(chunk))
+                            if self.bandwidth:
+                                self.bandwidth.consume(len(chunk))
+                            if segment['start'] + segment['done'] > segment['end']:
+                                break
+
+                if segment['start'] + segment['done'] > segment['end']:
+                    return
+                raise IOError("соединение закрыто до конца диапазона")
+            except ValueError:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"🔁 Диапазон {segment['start']}-{segment['end']}: {e}, "
+                      f"повтор {attempt + 1}/{self.max_retries}")
+                time.sleep(2 * attempt)
+
+    def download(self, session, url, path, total: int, validator: str, headers=None, label=""):
+        """Скачиваем файл диапазонами в path, возвращаем (успех, байт без пропусков с начала)
+
+        При неудаче файл обрезается до непрерывной части, чтобы обычное
+        продолжение через Range могло дописать его позже.
+        """
+        segments = self.plan_segments(total, self.get_connection_count(total))
+        print(f"🧩 {label}: {total / 1024 / 1024:.1f} MB в {len(segments)} соединениях")
+        self.preallocate(path, total)
+
+        lock = threading.Lock()
+        state = {'written': 0, 'last_report': time.monotonic()}
+        started = time.monotonic()
+
+        def progress(size):
+            with lock:
+                state['written'] += size
+                now = time.monotonic()
+                if now - state['last_report'] < self.progress_interval:
+                    return
+                state['last_report'] = now
+                written = state['written']
+            speed_mb = written / (now - started) / 1024 / 1024
+            print(f"⏳ {label}: {written / 1024 / 1024:.1f}/{total / 1024 / 1024:.1f} MB "
+                  f"({written * 100 // total}%), {speed_mb:.1f} MB/s")
+
+        sessions = [self.clone_session(session, url) for _ in segments]
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix='segment') as executor:
+            futures = [
+                executor.submit(self._download_segment, segment_session, url, path, segment, validator,
+                                headers, progress)
+                for segment_session, segment in zip(sessions, segments)
+            ]
+            errors = []
+            for segment_session, future in zip(sessions, futures):
+                try:
+                    future.result()
+                    self.session_pool.release(url, segment_session)
+                except Exception as e:
+                    errors.append(e)
+                    self.session_pool.release(url, segment_session, discard=True)
+
+        if not errors:
+            return True, total
+
+        contiguous = self.get_contiguous_bytes(segments)
+        print(f"❌ Ошибка скачивания диапазонами {label}: {errors[0]} "
+              f"(без пропусков {contiguous / 1024 / 1024:.1f} MB)")
+        with open(path, 'r+b') as f:
+            f.truncate(contiguous)
+        return False, contiguous
+
+    def compute_digests(self, path) -> dict:
+        """MD5 и SHA-256 собранного файла (части писались не по порядку)"""
+        hashers = {'checksum': hashlib.md5()}
+        if ENABLE_SHA256_CHECK:
+            hashers['sha256_hash'] = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                for hasher in hashers.values():
+                    hasher.update(chunk)
+        return {key: hasher.hexdigest() for key, hasher in hashers.items()}
+
+    @staticmethod
+    def get_expected_md5(response):
+        """MD5 от сервера: Content-MD5 или ETag r2/S3 для файлов, загруженных одним куском
+
+        ETag других серверов может быть любым хэшем из 32 hex-символов, поэтому
+        за MD5 он принимается только для хостов SEGMENTED_MD5_ETAG_HOSTS.
+        """
+        content_md5 = response.headers.get('Content-MD5')
+        if content_md5:
+            try:
+                return base64.b64decode(content_md5).hex()
+            except Exception:
+                pass
+        host = (urlparse(response.url or '').hostname or '').lower()
+        if not any(host == domain or host.endswith('.' + domain) for domain in SEGMENTED_MD5_ETAG_HOSTS):
+            return None
+        etag = (response.headers.get('ETag') or '').strip()
+        if etag.startswith('W/'):
+            return None
+        etag = etag.strip('"').lower()
+        return etag if re.fullmatch(r'[0-9a-f]{32}', etag) else None
+
+    def verify(self, path, expected_md5=None):
+        """Считаем хэши всего файла и сверяем MD5 с сервером, если он известен"""
+        digests = self.compute_digests(path)
+        if expected_md5 and digests['checksum'] != expected_md5:
+            print(f"❌ MD5 не совпадает с сервером: {digests['checksum']} != {expected_md5}")
+            return None
+        if expected_md5:
+            print(f"🔐 MD5 совпадает с сервером: {expected_md5}")
+        return digests
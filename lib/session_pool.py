@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Пул HTTP-сессий cloudscraper по хостам
+Сессия переиспользуется между запросами к одному хосту: сохраняются TLS-сессии,
+keep-alive соединения и cookies решенных проверок Cloudflare
+"""
+import threading
+import time
+from urllib.parse import urlparse
+import cloudscraper
+from ..config import USER_AGENT, SESSION_POOL_MAX_PER_HOST, SESSION_POOL_MAX_SESSIONS, SESSION_POOL_IDLE_TIMEOUT
+
+
+class HostSessionPool:
+    """Ограниченный пул сессий по хостам с вытеснением простаивающих
+
+    Сессия выдается одному потоку на время запроса/скачивания и возвращается
+    в пул. Свободных сессий не больше max_per_host на хост и max_sessions всего,
+    простаивающие дольше idle_timeout закрываются.
+    """
+
+    def __init__(self, max_per_host=SESSION_POOL_MAX_PER_HOST, max_sessions=SESSION_POOL_MAX_SESSIONS,
+                 idle_timeout=SESSION_POOL_IDLE_TIMEOUT):
+        self.max_per_host = max(1, max_per_host)
+        self.max_sessions = max(1, max_sessions)
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle = {}  # хост -> [(сессия, время возврата)], последние возвращенные в конце
+        self.stats = {'created': 0, 'reused': 0, 'evicted_idle': 0, 'evicted_limit': 0, 'discarded': 0}
+
+    @staticmethod
+    def get_host(url):
+        """Ключ пула - хост URL"""
+        return (urlparse(url).hostname or url).lower()
+
+    @staticmethod
+    def create_session():
+        """Новая сессия cloudscraper с общим User-Agent"""
+        session = cloudscraper.create_scraper()
+        session.headers['User-Agent'] = USER_AGENT
+        return session
+
+    @staticmethod
+    def _close(sessions):
+        """Закрываем сессии вне блокировки"""
+        for session in sessions:
+            try:
+                session.close()
+            except Exception as e:
+                print(f"⚠️ Ошибка закрытия HTTP-сессии: {e}")
+
+    def _evict_locked(self, now):
+        """Убираем простаивающие и лишние сессии, возвращаем их для закрытия"""
+        evicted = []
+        for host in list(self._idle):
+            fresh = []
+            for session, released_at in self._idle[host]:
+                if now - released_at > self.idle_timeout:
+                    evicted.append(session)
+                    self.stats['evicted_idle'] += 1
+                else:
+                    fresh.append((session, released_at))
+            if fresh:
+                self._idle[host] = fresh
+            else:
+                del self._idle[host]
+
+        # Общий лимит: закрываем самые давно возвращенные
+        idle = sorted(
+            ((released_at, host, session)
+             for host, entries in self._idle.items()
+             for session, released_at in entries),
+            key=lambda entry: entry[0]
+        )
+        for released_at, host, session in idle[:max(0, len(idle) - self.max_sessions)]:
+            self._idle[host] = [entry for entry in self._idle[host] if entry[0] is not session]
+            if not self._idle[host]:
+                del self._idle[host]
+            evicted.append(session)
+            self.stats['evicted_limit'] += 1
+        return evicted
+
+    def acquire(self, url):
+        """Получаем сессию для хоста URL (свободную из пула или новую)"""
+        host = self.get_host(url)
+        session = None
+        with self._lock:
+            evicted = self._evict_locked(time.monotonic())
+            entries = self._idle.get(host)
+            if entries:
+                session, _ = entries.pop()
+                if not entries:
+                    del self._idle[host]
+                self.stats['reused'] += 1
+            else:
+                self.stats['created'] += 1
+        self._close(evicted)
+        return session or self.create_session()
+
+    def release(self, url, session, discard=False):
+        """Возвращаем сессию в пул (discard - закрыть, например после блокировки)"""
+        host = self.get_host(url)
+        evicted = []
+        with self._lock:
+            entries = self._idle.setdefault(host, [])
+            if discard or len(entries) >= self.max_per_host:
+                evicted.append(session)
+                self.stats['discarded' if discard else 'evicted_limit'] += 1
+            else:
+                entries.append((session, time.monotonic()))
+            if not entries:
+                del self._idle[host]
+            evicted.extend(self._evict_locked(time.monotonic()))
+        self._close(evicted)
+
+    def close_all(self):
+        """Закрываем все свободные сессии"""
+        with self._lock:
+            sessions = [session for entries in self._idle.values() for session, _ in entries]
+            self._idle.clear()
+        self._close(sessions)
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def get_session_pool() -> HostSessionPool:
+    """Получаем общий для процесса пул HTTP-сессий"""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = HostSessionPool()
+    return _shared_pool
@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+"""
+Потоковое скачивание файлов по HTTP
+Ответ пишется блоками сразу в целевую папку с выводом прогресса,
+без промежуточной буферизации браузером. MD5 и SHA-256 считаются по ходу
+записи, чтобы не перечитывать файл после скачивания. Недокачанные файлы
+хранятся как .part и продолжаются через Range, большие файлы качаются
+несколькими соединениями (SegmentedDownloader). Заголовки и первые байты
+ответа проверяются до записи тела, а заголовки файла (ETag, размер, имя)
+сравниваются с сохраненными, чтобы не качать тот же файл повторно
+"""
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+from pathlib import Path
+from urllib.parse import urlparse, unquote
+from ..config import STREAM_CHUNK_SIZE, STREAM_READ_TIMEOUT, STREAM_PROGRESS_INTERVAL, STREAM_MAX_RETRIES
+from ..config import STREAM_SIZE_TOLERANCE
+from ..config import ENABLE_SHA256_CHECK
+from .segmented_downloader import SegmentedDownloader
+from .bandwidth import get_bandwidth_limiter
+
+
+class StreamDownloader:
+    """Общий потоковый загрузчик для APKCombo (r2) и APKPure (d.apkpure.com)"""
+
+    # Результаты скачивания
+    OK = 'ok'
+    BLOCKED = 'blocked'    # Cloudflare/HTML вместо файла - нужен браузер
+    INVALID = 'invalid'    # Файл скачан, но это не APK/XAPK
+    ERROR = 'error'
+
+    BLOCKED_STATUSES = (401, 403, 429, 503)
+    MIN_FILE_SIZE = 1024  # Меньше - точно не APK (как в is_valid_apk)
+    DEFAULT_FILENAME = "downloaded_file.apk"  # Имя, если сервер его не передал
+
+    def __init__(self, chunk_size=STREAM_CHUNK_SIZE, read_timeout=STREAM_READ_TIMEOUT,
+                 progress_interval=STREAM_PROGRESS_INTERVAL, max_retries=STREAM_MAX_RETRIES):
+        self.chunk_size = chunk_size
+        self.max_retries = max(1, max_retries)
+        self.read_timeout = read_timeout
+        self.progress_interval = progress_interval
+        # Общий лимит полосы на все загрузки процесса
+        self.bandwidth = get_bandwidth_limiter()
+        self.segmented = SegmentedDownloader(chunk_size=chunk_size, read_timeout=read_timeout,
+                                             progress_interval=progress_interval, max_retries=max_retries,
+                                             bandwidth=self.bandwidth)
+
+    @staticmethod
+    def extract_filename(response, original_url="", default_name=DEFAULT_FILENAME):
+        """Извлекает правильное имя файла из HTTP ответа"""
+        filename = default_name
+        
+        # Пробуем получить из Content-Disposition заголовка
+        content_disposition = response.headers.get('Content-Disposition', '')
+        if 'filename=' in content_disposition:
+            # Ищем filename="..." либо filename*=UTF-8''name
+            patterns = [
+                r'filename\*?=["\']?([^"\';\s]+)["\']?',
+                r'filename\*?=([^;]+)'
+            ]
+            for pattern in patterns:
+                matches = re.findall(pattern, content_disposition, re.IGNORECASE)
+                if matches:
+                    filename = matches[0].strip()
+                    break
+        
+        # Пробуем извлечь из URL
+        if default_name == filename:
+            try:
+                parsed = urlparse(original_url or response.url)
+                url_filename = parsed.path.split('/')[-1]
+                decoded_filename = unquote(url_filename)
+                
+                if decoded_filename and ('.apk' in decoded_filename or '.xapk' in decoded_filename):
+                    filename = decoded_filename
+            except:
+                pass
+        
+        # Проверяем что у файла есть расширение
+        if not any(ext in filename.lower() for ext in ['.apk', '.xapk']):
+            if 'content-type' in str(response.headers).lower():
+                if 'xapk' in str(response.headers):
+                    filename = filename.rstrip('.') + '.xapk'
+                else:
+                    filename = filename.rstrip('.') + '.apk'
+        
+        # Очищаем имя файла от недопустимых символов
+        filename = re.sub(r'[<>:"/\\|?*]', '', filename)
+        filename = filename.strip()
+        
+        return filename if filename else default_name
+
+    @staticmethod
+    def is_valid_apk(file_path):
+        """Проверяет корректность APK файла"""
+        if not file_path.exists():
+            return False
+        
+        file_size = file_path.stat().st_size
+        if file_size < 1024:
+            return False
+            
+        with open(file_path, 'rb') as f:
+            header = f.read(4)
+            return header.startswith(b'PK')
+
+    @staticmethod
+    def is_blocked_response(response):
+        """Ответ - страница проверки/ошибки вместо файла"""
+        if response.status_code in StreamDownloader.BLOCKED_STATUSES:
+            return True
+        content_type = response.headers.get('Content-Type', '').lower()
+        return response.status_code == 200 and 'text/html' in content_type
+
+    @staticmethod
+    def parse_size(text):
+        """Размер со страницы ('120.5 MB', '1,2 GB') в байтах"""
+        match = re.search(r'(\d+(?:[.,]\d+)?)\s*(KB|MB|GB)', text or '', re.IGNORECASE)
+        if not match:
+            return None
+        power = {'KB': 1, 'MB': 2, 'GB': 3}[match.group(2).upper()]
+        return int(float(match.group(1).replace(',', '.')) * 1024 ** power)
+
+    @staticmethod
+    def check_headers(response, offset=0, expected_size=None):
+        """Проверяем заголовки до чтения тела, возвращаем (результат, причина) или None"""
+        content_type = response.headers.get('Content-Type', '').lower()
+        if 'html' in content_type:
+            return StreamDownloader.BLOCKED, f"Content-Type {content_type}"
+        if content_type.startswith(('text/', 'application/json', 'application/xml')):
+            return StreamDownloader.INVALID, f"Content-Type {content_type}"
+
+        # При сжатии Content-Length - размер сжатого тела, сравнивать не с чем
+        length = int(response.headers.get('Content-Length') or 0)
+        if not length or response.headers.get('Content-Encoding'):
+            return None
+        full_size = offset + length
+        if full_size < StreamDownloader.MIN_FILE_SIZE:
+            return StreamDownloader.INVALID, f"размер {full_size} байт"
+        if expected_size:
+            tolerance = max(expected_size * STREAM_SIZE_TOLERANCE, 1024 * 1024)
+            if abs(full_size - expected_size) > tolerance:
+                return StreamDownloader.INVALID, (f"размер {full_size / 1024 / 1024:.1f} MB, "
+                                                  f"на странице {expected_size / 1024 / 1024:.1f} MB")
+        return None
+
+    @staticmethod
+    def check_first_bytes(chunk):
+        """Проверяем первые байты файла: APK/XAPK - это ZIP с сигнатурой PK"""
+        if chunk.startswith(b'PK'):
+            return None
+        if chunk.lstrip()[:1] == b'<':
+            return StreamDownloader.BLOCKED, "HTML вместо файла"
+        return StreamDownloader.INVALID, f"нет сигнатуры PK (начало {chunk[:8]!r})"
+
+    @staticmethod
+    def get_remote_filename(response, url):
+        """Имя файла, которое отдает сервер (без нормализации) - для сравнения между запусками
+
+        None, если сервер имени не передал (нет Content-Disposition и имени файла
+        в URL, как у d.apkpure.com/b/APK/<pkg>?version=latest): подставленное
+        имя по умолчанию одинаково для любых файлов и валидатором не является.
+        """
+        has_disposition = 'filename' in response.headers.get('Content-Disposition', '').lower()
+        url_name = unquote(urlparse(url or response.url).path.split('/')[-1]).lower()
+        if not has_disposition and not ('.apk' in url_name or '.xapk' in url_name):
+            return None
+        return StreamDownloader.extract_filename(response, url)
+
+    def fetch_validators(self, session, url, headers=None):
+        """Заголовки файла без скачивания тела: ETag, полный размер и имя
+
+        Сначала HEAD; если сервер его не поддерживает (подписанные ссылки r2
+        часто разрешают только GET) - GET первого байта через Range.
+        """
+        try:
+            response = session.head(url, allow_redirects=True, timeout=(30, self.read_timeout), headers=headers)
+            if response.status_code != 200 or not response.headers.get('Content-Length'):
+                response.close()
+                request_headers = {**(headers or {}), 'Range': 'bytes=0-0'}
+                response = session.get(url, stream=True, allow_redirects=True,
+                                       timeout=(30, self.read_timeout), headers=request_headers)
+                response.close()
+        except Exception as e:
+            print(f"⚠️ Не удалось получить заголовки файла {url}: {e}")
+            return None
+
+        if self.is_blocked_response(response) or response.status_code not in (200, 206):
+            return None
+
+        size = None
+        if response.status_code == 206:
+            match = re.search(r'/(\d+)\s*$', response.headers.get('Content-Range', ''))
+            size = int(match.group(1)) if match else None
+        elif not response.headers.get('Content-Encoding'):
+            size = int(response.headers.get('Content-Length') or 0) or None
+
+        return {
+            'remote_etag': response.headers.get('ETag'),
+            'remote_size': size,
+            'remote_filename': self.get_remote_filename(response, url)
+        }
+
+    @staticmethod
+    def validators_match(stored, remote):
+        """Файл на сервере тот же, что скачан в прошлый раз
+
+        Нужно совпадение ETag или пары размер + имя файла; все известные
+        с обеих сторон значения должны совпадать. Отсутствующее имя (или имя
+        по умолчанию из старых записей) валидатором не считается, одного
+        размера недостаточно.
+        """
+        if not stored or not remote:
+            return False
+        matched = set()
+        if stored.get('remote_filename') == StreamDownloader.DEFAULT_FILENAME:
+            stored = {**stored, 'remote_filename': None}
+        for key in ('remote_etag', 'remote_size', 'remote_filename'):
+            if stored.get(key) and remote.get(key):
+                if str(stored[key]) != str(remote[key]):
+                    return False
+                matched.add(key)
+        return 'remote_etag' in matched or {'remote_size', 'remote_filename'} <= matched
+
+    def is_unchanged(self, session, url, stored):
+        """Проверка перед скачиванием: сравниваем заголовки файла с сохраненными валидаторами"""
+        remote = self.fetch_validators(session, url)
+        if not self.validators_match(stored, remote):
+            return False
+        size = remote.get('remote_size') or 0
+        print(f"♻️ Файл на сервере не изменился (ETag {remote.get('remote_etag') or 'N/A'}, "
+              f"{size / 1024 / 1024:.1f} MB, {remote.get('remote_filename')}), скачивание не нужно")
+        return True
+
+    @staticmethod
+    def new_hashers():
+        """Хэши, которые обновляются по мере записи файла"""
+        hashers = {'checksum': hashlib.md5()}
+        if ENABLE_SHA256_CHECK:
+            hashers['sha256_hash'] = hashlib.sha256()
+        return hashers
+
+    @staticmethod
+    def get_url_key(url):
+        """Ключ файла для продолжения: URL без query (подписи r2 меняются между запусками)"""
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+
+    @staticmethod
+    def get_part_paths(filepath):
+        """Пути .part файла и его описания .part.json"""
+        filepath = Path(filepath)
+        return filepath.with_name(filepath.name + '.part'), filepath.with_name(filepath.name + '.part.json')
+
+    def find_partial(self, directory, url):
+        """Ищем недокачанный файл этого URL с валидаторами для продолжения"""
+        # Описание пишется до создания .part, поэтому .part без описания -
+        # остаток прерванной загрузки, продолжить его нельзя
+        for part_path in Path(directory).glob('*.part'):
+            if not part_path.with_name(part_path.name + '.json').exists():
+                print(f"🧹 Удаляем недокачанный файл без описания: {part_path.name}")
+                part_path.unlink(missing_ok=True)
+
+        url_key = self.get_url_key(url)
+        for sidecar_path in Path(directory).glob('*.part.json'):
+            try:
+                with open(sidecar_path, 'r', encoding='utf-8') as f:
+                    sidecar = json.load(f)
+            except Exception:
+                continue
+            if sidecar.get('url_key') != url_key:
+                continue
+
+            part_path = sidecar_path.with_name(sidecar_path.name[:-len('.json')])
+            # Без сильного ETag или Last-Modified нельзя убедиться, что файл на сервере тот же
+            validator = SegmentedDownloader.get_if_range_validator(sidecar.get('etag'), sidecar.get('last_modified'))
+            if not part_path.exists() or not validator:
+                self.discard_partial(part_path, sidecar_path)
+                continue
+
+            sidecar['part_path'] = part_path
+            sidecar['sidecar_path'] = sidecar_path
+            sidecar['bytes_received'] = part_path.stat().st_size
+            return sidecar
+        return None
+
+    @staticmethod
+    def save_sidecar(sidecar_path, sidecar):
+        """Атомарно сохраняем описание недокачанного файла"""
+        tmp_path = sidecar_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(sidecar, f, ensure_ascii=False)
+        os.replace(tmp_path, sidecar_path)
+
+    @staticmethod
+    def discard_partial(part_path, sidecar_path):
+        """Удаляем недокачанный файл и его описание"""
+        Path(part_path).unlink(missing_ok=True)
+        Path(sidecar_path).unlink(missing_ok=True)
+
+    @staticmethod
+    def get_range_start(response):
+        """Начало диапазона из Content-Range: bytes START-END/TOTAL"""
+        match = re.match(r'bytes\s+(\d+)-', response.headers.get('Content-Range', ''))
+        return int(match.group(1)) if match else None
+
+    def write_response(self, response, filepath, label="", file_info=None, offset=0, on_progress=None,
+                       chunks=None):
+        """Пишем тело ответа в файл блоками с выводом прогресса, возвращаем итоговый размер
+
+        file_info - словарь, в который записываются checksum (MD5), sha256_hash и file_size
+        offset - сколько байт уже есть в файле (продолжение через Range)
+        on_progress - вызывается с числом полученных байт при выводе прогресса
+        chunks - уже начатый итератор тела (первый блок прочитан для проверки)
+        """
+        total = int(response.headers.get('Content-Length') or 0)
+        total = total + offset if total else 0
+        hashers = self.new_hashers() if file_info is not None else {}
+        written = offset
+        started = last_report = time.monotonic()
+
+        if offset and hashers:
+            # Хэши продолжаются с уже скачанной части
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                    for hasher in hashers.values():
+                        hasher.update(chunk)
+
+        with open(filepath, 'ab' if offset else 'wb') as f:
+            try:
+                if chunks is None:
+                    chunks = response.iter_content(chunk_size=self.chunk_size)
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    written += len(chunk)
+                    for hasher in hashers.values():
+                        hasher.update(chunk)
+                    self.bandwidth.consume(len(chunk))
+
+                    now = time.monotonic()
+                    if now - last_report >= self.progress_interval:
+                        last_report = now
+                        speed_mb = (written - offset) / (now - started) / 1024 / 1024
+                        if total:
+                            print(f"⏳ {label}: {written / 1024 / 1024:.1f}/{total / 1024 / 1024:.1f} MB "
+                                  f"({written * 100 // total}%), {speed_mb:.1f} MB/s")
+                        else:
+                            print(f"⏳ {label}: {written / 1024 / 1024:.1f} MB, {speed_mb:.1f} MB/s")
+                        if on_progress:
+                            on_progress(written)
+            finally:
+                if on_progress:
+                    f.flush()
+                    on_progress(written)
+
+        if total and written != total:
+            raise IOError(f"Соединение оборвано: получено {written} из {total} байт")
+
+        if file_info is not None:
+            file_info.update({key: hasher.hexdigest() for key, hasher in hashers.items()})
+            file_info['file_size'] = written
+        return written
+
+    def download(self, session, url, directory, default_name=DEFAULT_FILENAME,
+                 filename_normalizer=None, headers=None, file_info=None, expected_size=None):
+        """Скачиваем файл сессией requests/cloudscraper, возвращаем (путь, результат)
+
+        Файл пишется в <имя>.part, после обрыва следующая попытка (или следующий
+        запуск) продолжает его через Range, если ETag/Last-Modified не изменились.
+        file_info - словарь для чексумм, посчитанных во время записи
+        expected_size - размер со страницы сайта для ранней проверки Content-Length
+        """
+        for attempt in range(1, self.max_retries + 1):
+            filepath, result = self._download_attempt(
+                session, url, directory, default_name, filename_normalizer, headers, file_info, expected_size
+            )
+            if result != self.ERROR or attempt == self.max_retries:
+                return filepath, result
+            print(f"🔁 Повтор скачивания {attempt + 1}/{self.max_retries}")
+            time.sleep(2 * attempt)
+        return None, self.ERROR
+
+    def _download_segmented(self, session, url, response, part_path, sidecar_path, sidecar,
+                            label, headers, file_info, save_progress):
+        """Скачивание диапазонами с проверкой хэша всего файла, возвращаем (размер, результат)"""
+        total = int(response.headers['Content-Length'])
+        validator = self.segmented.get_if_range_validator(sidecar['etag'], sidecar['last_modified'])
+        ok, contiguous = self.segmented.download(session, url, part_path, total, validator,
+                                                 headers=headers, label=label)
+        if not ok:
+            # Непрерывная часть остается .part для обычного продолжения через Range
+            save_progress(contiguous)
+            return None, self.ERROR
+
+        digests = self.segmented.verify(part_path, self.segmented.get_expected_md5(response))
+        if digests is None:
+            # MD5 не сошелся с сервером: повтор скачал бы тот же файл
+            self.discard_partial(part_path, sidecar_path)
+            if file_info is not None:
+                file_info.clear()
+            return None, self.INVALID
+        if file_info is not None:
+            file_info.update(digests)
+            file_info['file_size'] = total
+        return total, self.OK
+
+    def _download_attempt(self, session, url, directory, default_name, filename_normalizer, headers, file_info,
+                          expected_size=None):
+        """Одна попытка скачивания с продолжением недокачанного файла"""
+        directory = Path(directory)
+        partial = self.find_partial(directory, url)
+        request_headers = dict(headers or {})
+        if partial:
+            request_headers['Range'] = f"bytes={partial['bytes_received']}-"
+            request_headers['If-Range'] = self.segmented.get_if_range_validator(
+                partial.get('etag'), partial.get('last_modified')
+            )
+
+        try:
+            response = session.get(url, stream=True, allow_redirects=True,
+                                   timeout=(30, self.read_timeout), headers=request_headers)
+        except Exception as e:
+            print(f"❌ Ошибка запроса {url}: {e}")
+            return None, self.ERROR
+
+        with response:
+            if self.is_blocked_response(response):
+                print(f"🛡️ Прямое скачивание заблокировано (HTTP {response.status_code}, "
+                      f"{response.headers.get('Content-Type', 'N/A')})")
+                return None, self.BLOCKED
+
+            if (partial and response.status_code == 206
+                    and self.get_range_start(response) == partial['bytes_received']):
+                # Сервер подтвердил, что файл не изменился: дописываем
+                filepath = directory / partial['filename']
+                part_path, sidecar_path = partial['part_path'], partial['sidecar_path']
+                offset = partial['bytes_received']
+                sidecar = {key: partial.get(key) for key in
+                           ('url_key', 'filename', 'etag', 'last_modified', 'remote_filename')}
+                print(f"⏯️ Продолжаем {filepath.name} с {offset / 1024 / 1024:.1f} MB")
+            elif response.status_code == 200:
+                if partial:
+                    # Файл на сервере изменился (If-Range не совпал) - начинаем заново
+                    print("♻️ Файл на сервере изменился, недокачанная часть удалена")
+                    self.discard_partial(partial['part_path'], partial['sidecar_path'])
+                filename = self.extract_filename(response, url, default_name)
+                if filename_normalizer:
+                    filename = filename_normalizer(filename)
+                filepath = directory / filename
+                part_path, sidecar_path = self.get_part_paths(filepath)
+                offset = 0
+                sidecar = {
+                    'url_key': self.get_url_key(url),
+                    'filename': filename,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'remote_filename': self.get_remote_filename(response, url)
+                }
+                print(f"📁 Имя файла: {filename}")
+            else:
+                if partial:
+                    self.discard_partial(partial['part_path'], partial['sidecar_path'])
+                print(f"❌ HTTP {response.status_code} при скачивании {url}")
+                return None, self.ERROR
+
+            # Ранняя проверка до записи: заголовки и первый блок тела.
+            # Плохой поток закрывается сразу, запасной путь стартует без ожидания таймаута
+            chunks = response.iter_content(chunk_size=self.chunk_size)
+            rejected = self.check_headers(response, offset, expected_size)
+            if not rejected:
+                try:
+                    first_chunk = next(chunks, b"")
+                except Exception as e:
+                    print(f"❌ Ошибка чтения ответа {url}: {e}")
+                    return None, self.ERROR
+                if not offset:
+                    rejected = self.check_first_bytes(first_chunk)
+            if rejected:
+                result, reason = rejected
+                print(f"🚫 Ответ отклонен до записи файла: {reason}")
+                if offset:
+                    self.discard_partial(part_path, sidecar_path)
+                return None, result
+
+            def save_progress(bytes_received):
+                try:
+                    self.save_sidecar(sidecar_path, {**sidecar, 'url': url, 'bytes_received': bytes_received})
+                except Exception as e:
+                    print(f"⚠️ Не удалось сохранить состояние загрузки: {e}")
+
+            # Описание сохраняется до создания .part: прерванную загрузку можно продолжить
+            save_progress(offset)
+
+            # Большой файл с поддержкой Range качаем несколькими соединениями,
+            # текущий ответ закрывается без чтения тела
+            segmented = not offset and self.segmented.can_download(response)
+            if not segmented:
+                try:
+                    size = self.write_response(response, part_path, label=filepath.name, file_info=file_info,
+                                               offset=offset, on_progress=save_progress,
+                                               chunks=itertools.chain([first_chunk], chunks))
+                except Exception as e:
+                    # .part и описание остаются для продолжения
+                    print(f"❌ Ошибка записи {filepath.name}: {e}")
+                    return None, self.ERROR
+
+        if segmented:
+            size, result = self._download_segmented(session, url, response, part_path, sidecar_path, sidecar,
+                                                    filepath.name, headers, file_info, save_progress)
+            if size is None:
+                return None, result
+
+        if not self.is_valid_apk(part_path):
+            print(f"❌ Скачанный файл не является APK/XAPK: {filepath.name}")
+            self.discard_partial(part_path, sidecar_path)
+            if file_info is not None:
+                file_info.clear()
+            return None, self.INVALID
+
+        # Файл полный - атомарно переименовываем в итоговое имя
+        os.replace(part_path, filepath)
+        sidecar_path.unlink(missing_ok=True)
+
+        if file_info is not None:
+            # Валидаторы сохраняются в file_tracking для проверки перед следующим скачиванием
+            file_info.update({
+                'remote_etag': sidecar.get('etag'),
+                'remote_size': size,
+                'remote_filename': sidecar.get('remote_filename')
+            })
+
+        print(f"✅ Файл скачан напрямую: {filepath.name} ({size / 1024 / 1024:.2f} MB)")
+        return filepath, self.OK
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Извлечение данных приложения из структурированной разметки страницы
+JSON-LD (softwareVersion), meta/OpenGraph теги и встроенный JSON состояния -
+версия, package name и размер за один разбор HTML
+"""
+import json
+import re
+from typing import Dict, Optional
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+
+class StructuredDataExtractor:
+    """Данные приложения из JSON-LD, meta тегов и встроенного JSON"""
+
+    # Типы объектов JSON-LD, описывающие приложение
+    APP_TYPES = ('SoftwareApplication', 'MobileApplication', 'VideoGame', 'WebApplication')
+
+    VERSION_KEYS = ('softwareVersion', 'versionName', 'version_name', 'version')
+    PACKAGE_KEYS = ('packageName', 'package_name', 'identifier')
+    SIZE_KEYS = ('fileSize', 'file_size', 'size')
+
+    # Meta/microdata теги (от более надежных к менее)
+    META_SELECTORS = {
+        'version': [
+            "meta[itemprop='softwareVersion']", "[itemprop='softwareVersion']",
+            "meta[property='og:version']", "meta[name='version']"
+        ],
+        'package_name': [
+            "meta[property='al:android:package']", "meta[itemprop='identifier']",
+            "meta[name='package']"
+        ],
+        'size': [
+            "meta[itemprop='fileSize']", "[itemprop='fileSize']"
+        ]
+    }
+
+    # Ключи во встроенном JSON состояния (window.__INITIAL_STATE__ и т.п.)
+    EMBEDDED_PATTERNS = {
+        'version': r'"(?:softwareVersion|versionName|version_name)"\s*:\s*"([^"]+)"',
+        'package_name': r'"(?:packageName|package_name)"\s*:\s*"([a-zA-Z][\w]*(?:\.[\w]+)+)"',
+        'size': r'"(?:fileSize|file_size)"\s*:\s*"?([^",}]+)"?'
+    }
+
+    VERSION_PATTERN = re.compile(r'\d+(?:\.\d+)+')
+    PACKAGE_PATTERN = re.compile(r'^[a-zA-Z][\w]*(?:\.[a-zA-Z_][\w]*)+$')
+
+    @staticmethod
+    def clean_version(value) -> Optional[str]:
+        """Оставляем только номер версии ('Varies with device' отбрасывается)"""
+        match = StructuredDataExtractor.VERSION_PATTERN.search(str(value or ''))
+        return match.group(0) if match else None
+
+    @staticmethod
+    def clean_package(value) -> Optional[str]:
+        """Проверяем, что значение похоже на package name"""
+        value = str(value or '').strip()
+        # identifier может быть ссылкой на Google Play: ...?id=com.example.app
+        if 'id=' in value:
+            value = value.split('id=', 1)[1].split('&', 1)[0]
+        return value if StructuredDataExtractor.PACKAGE_PATTERN.match(value) else None
+
+    @staticmethod
+    def clean_size(value) -> Optional[str]:
+        """Размер как есть ('120 MB', '125829120'), пустые значения отбрасываются"""
+        value = str(value or '').strip()
+        return value if value and any(ch.isdigit() for ch in value) else None
+
+    @staticmethod
+    def _clean(field, value):
+        cleaners = {
+            'version': StructuredDataExtractor.clean_version,
+            'package_name': StructuredDataExtractor.clean_package,
+            'size': StructuredDataExtractor.clean_size
+        }
+        return cleaners[field](value)
+
+    @staticmethod
+    def _iter_json_ld_nodes(data):
+        """Обходим все объекты JSON-LD (включая @graph и вложенные списки)"""
+        if isinstance(data, list):
+            for item in data:
+                yield from StructuredDataExtractor._iter_json_ld_nodes(item)
+        elif isinstance(data, dict):
+            yield data
+            for value in data.values():
+                if isinstance(value, (dict, list)):
+                    yield from StructuredDataExtractor._iter_json_ld_nodes(value)
+
+    @staticmethod
+    def _is_app_node(node: Dict) -> bool:
+        node_type = node.get('@type', '')
+        types = node_type if isinstance(node_type, list) else [node_type]
+        return any(t in StructuredDataExtractor.APP_TYPES for t in types)
+
+    @staticmethod
+    def extract_from_json_ld(soup) -> Dict:
+        """Данные из блоков <script type="application/ld+json">"""
+        result = {}
+        for script in soup.find_all('script', type='application/ld+json'):
+            try:
+                data = json.loads(script.string or script.get_text() or '', strict=False)
+            except ValueError:
+                continue
+
+            # Сначала объекты приложения, потом все остальные
+            nodes = list(StructuredDataExtractor._iter_json_ld_nodes(data))
+            nodes.sort(key=lambda node: not StructuredDataExtractor._is_app_node(node))
+
+            for node in nodes:
+                for field, keys in (('version', StructuredDataExtractor.VERSION_KEYS),
+                                    ('package_name', StructuredDataExtractor.PACKAGE_KEYS),
+                                    ('size', StructuredDataExtractor.SIZE_KEYS)):
+                    if field in result:
+                        continue
+                    for key in keys:
+                        value = node.get(key)
+                        if isinstance(value, (str, int, float)):
+                            cleaned = StructuredDataExtractor._clean(field, value)
+                            if cleaned:
+                                result[field] = cleaned
+                                break
+        return result
+
+    @staticmethod
+    def extract_from_meta(soup) -> Dict:
+        """Данные из meta/microdata тегов"""
+        result = {}
+        for field, selectors in StructuredDataExtractor.META_SELECTORS.items():
+            for selector in selectors:
+                element = soup.select_one(selector)
+                if not element:
+                    continue
+                value = element.get('content') or element.get_text(" ", strip=True)
+                cleaned = StructuredDataExtractor._clean(field, value)
+                if cleaned:
+                    result[field] = cleaned
+                    break
+        return result
+
+    @staticmethod
+    def extract_from_embedded_json(soup) -> Dict:
+        """Данные из встроенного JSON состояния в inline скриптах"""
+        result = {}
+        for script in soup.find_all('script', src=False):
+            text = script.string or ''
+            if not text or script.get('type') == 'application/ld+json':
+                continue
+            for field, pattern in StructuredDataExtractor.EMBEDDED_PATTERNS.items():
+                if field in result:
+                    continue
+                match = re.search(pattern, text)
+                if match:
+                    cleaned = StructuredDataExtractor._clean(field, match.group(1))
+                    if cleaned:
+                        result[field] = cleaned
+            if len(result) == len(StructuredDataExtractor.EMBEDDED_PATTERNS):
+                break
+        return result
+
+    @staticmethod
+    def extract_from_soup(soup) -> Dict:
+        """Собираем version/package_name/size; приоритет: JSON-LD > meta > встроенный JSON"""
+        result = {}
+        sources = (
+            ('json-ld', StructuredDataExtractor.extract_from_json_ld),
+            ('meta', StructuredDataExtractor.extract_from_meta),
+            ('embedded-json', StructuredDataExtractor.extract_from_embedded_json)
+        )
+        for source, extractor in sources:
+            try:
+                data = extractor(soup)
+            except Exception as e:
+                print(f"⚠️ Ошибка разбора структурированных данных ({source}): {e}")
+                continue
+            for field, value in data.items():
+                if field not in result:
+                    result[field] = value
+                    if field == 'version':
+                        result['source'] = source
+            if 'version' in result and 'package_name' in result and 'size' in result:
+                break
+        return result
+
+    @staticmethod
+    def extract(html: str) -> Dict:
+        """Разбираем сохраненный или загруженный HTML"""
+        if BeautifulSoup is None or not html:
+            return {}
+        return StructuredDataExtractor.extract_from_soup(BeautifulSoup(html, HTML_PARSER))
@@ -4,29 +4,63 @@
 Скачивает файлы через парсеры APKCombo и APKPure и обновляет базу данных
 Поддерживает множественные ссылки разделенные ;
 """
+import argparse
 import asyncio
 import os
 import re
+import time
 import logging
 from pathlib import Path
 from datetime import datetime
 from .config import LINKS_FILE, BASE_DOWNLOAD_DIR, ENABLE_SHA256_CHECK, ENABLE_FUZZY_MATCHING, ENABLE_SIZE_CHECK, ENABLE_DETAILED_LOGGING
+from .config import MAX_CONCURRENT_ITEMS, HOST_CONCURRENCY_LIMITS, PIPELINE_STAGE_WORKERS, PIPELINE_QUEUE_SIZE
+from .config import PROBE_DEADLINE, RECHECK_SCHEDULING_ENABLED, RECHECK_FORCE, DOWNLOAD_PRECHECK_ENABLED
 from .database_api import DatabaseManagerAPI as DatabaseManager
 from .version_extractor import VersionExtractor
 from .lib.file_downloader import FileDownloader
 from .lib.apkpure_downloader import APKPureDownloader
 from .lib.duplicate_analyzer import DuplicateAnalyzer
+from .lib.host_limiter import HostLimiter
+from .lib.pipeline import Pipeline
+from .lib.browser_pool import get_browser_pool
+from .lib.session_pool import get_session_pool
+from .lib.bandwidth import get_bandwidth_limiter
+from .lib.probe_store import ProbeStore
+from .lib.recheck_scheduler import RecheckScheduler
 
 
 class FileProcessor:
-    def __init__(self):
+    def __init__(self, max_concurrency=None, force_recheck=None):
         self.analyzer = DuplicateAnalyzer()
         self.db = DatabaseManager(analyzer=self.analyzer)
-        self.version_extractor = VersionExtractor()
+        
+        # Общий пул браузеров на весь прогон
+        self.browser_pool = get_browser_pool()
+        self.version_extractor = VersionExtractor(browser_pool=self.browser_pool)
+        
+        # Параллельная обработка: общий лимит и лимиты по хостам
+        self.max_concurrency = max_concurrency or MAX_CONCURRENT_ITEMS
+        self.host_limiter = HostLimiter(HOST_CONCURRENCY_LIMITS)
+        
+        # Общий лимит полосы и одновременных записей в хранилища
+        self.bandwidth = get_bandwidth_limiter()
+        
+        # Результаты проб прошлых запусков: свежие версии не запрашиваются повторно
+        self.probe_store = ProbeStore()
+        
+        # Расписание перепроверки по истории обновлений (force - проверять все строки)
+        self.recheck_scheduler = RecheckScheduler(
+            self.probe_store,
+            force=RECHECK_FORCE if force_recheck is None else force_recheck
+        ) if RECHECK_SCHEDULING_ENABLED else None
         
         # Создаем папку для текущего месяца
         self.download_dir = self.get_current_download_dir()
-        self.downloader = FileDownloader(self.download_dir)
+        self.downloader = FileDownloader(self.download_dir, browser_pool=self.browser_pool,
+                                         host_limiter=self.host_limiter)
+        
+        # Фоновые задачи (очистка процессов браузера после ошибок)
+        self._background_tasks = set()
         
         # Настраиваем логирование
         self.setup_logging()
@@ -99,37 +133,80 @@ class FileProcessor:
             'urls': urls
         }
     
+    async def probe_url_version(self, url):
+        """Получаем версию со страницы с учетом лимита хоста и дедлайна пробы"""
+        package_name = self.version_extractor.extract_package_name_from_url(url)
+        source = ProbeStore.get_source(url)
+        
+        # Пакет уже опрашивался недавно - используем прошлый результат
+        if package_name:
+            stored = await asyncio.to_thread(self.probe_store.get_fresh, package_name, source)
+            if stored:
+                self.logger.info(f"💾 Версия {package_name} ({source}) из результатов прошлой пробы: {stored['version']}")
+                return stored['version']
+        
+        start = time.monotonic()
+        status = ProbeStore.STATUS_ERROR
+        version = None
+        async def limited_probe():
+            async with self.host_limiter.limit(url):
+                return await self.version_extractor.extract_version_from_page(url)
+
+        try:
+            # Ожидание слота хоста входит в дедлайн пробы
+            version = await asyncio.wait_for(limited_probe(), timeout=PROBE_DEADLINE)
+            status = ProbeStore.STATUS_OK if version else ProbeStore.STATUS_NOT_FOUND
+            return version
+        except asyncio.TimeoutError:
+            status = ProbeStore.STATUS_TIMEOUT
+            raise
+        finally:
+            if package_name:
+                await asyncio.to_thread(
+                    self.probe_store.record, package_name, source, version,
+                    time.monotonic() - start, status
+                )
+
     async def get_best_url_from_multiple(self, urls, app_name):
         """Получаем лучшую ссылку из множественных ссылок по версии"""
         if len(urls) == 1:
             return urls[0], None
         
-        self.logger.info(f"🔍 Найдено {len(urls)} ссылок для {app_name}")
+        self.logger.info(f"🔍 Найдено {len(urls)} ссылок для {app_name}, опрашиваем параллельно")
         
         best_url = None
         best_version = None
         url_versions = []
         
-        for i, url in enumerate(urls, 1):
-            try:
-                self.logger.info(f"  📱 Ссылка {i}: {url}")
+        # Все ссылки опрашиваются одновременно, каждая со своим дедлайном
+        results = await asyncio.gather(
+            *(self.probe_url_version(url) for url in urls),
+            return_exceptions=True
+        )
+        
+        # Сравниваем в исходном порядке ссылок: при равных версиях выигрывает первая
+        for i, (url, result) in enumerate(zip(urls, results), 1):
+            self.logger.info(f"  📱 Ссылка {i}: {url}")
+            
+            if isinstance(result, asyncio.TimeoutError):
+                self.logger.warning(f"    ⏱️ Превышен дедлайн пробы ({PROBE_DEADLINE} сек) для {url}")
+                continue
+            if isinstance(result, Exception):
+                self.logger.error(f"    ❌ Ошибка при обработке {url}: {result}")
+                continue
+            
+            version = result
+            if version:
+                url_versions.append((url, version))
+                self.logger.info(f"    ✅ Версия: {version}")
                 
-                # Получаем версию с сайта
-                version = await self.version_extractor.extract_version_from_page(url)
-                if version:
-                    url_versions.append((url, version))
-                    self.logger.info(f"    ✅ Версия: {version}")
-                    
-                    # Сравниваем версии
-                    if best_version is None or self.compare_versions(version, best_version) > 0:
-                        best_version = version
-                        best_url = url
-                        self.logger.info(f"    🏆 Новая лучшая версия: {version}")
-                else:
-                    self.logger.warning(f"    ❌ Не удалось получить версию с {url}")
-                    
-            except Exception as e:
-                self.logger.error(f"    ❌ Ошибка при обработке {url}: {e}")
+                # Сравниваем версии
+                if best_version is None or self.compare_versions(version, best_version) > 0:
+                    best_version = version
+                    best_url = url
+                    self.logger.info(f"    🏆 Новая лучшая версия: {version}")
+            else:
+                self.logger.warning(f"    ❌ Не удалось получить версию с {url}")
         
         if best_url:
             self.logger.info(f"🎯 Выбрана лучшая ссылка: {best_url} (версия: {best_version})")
@@ -170,13 +247,38 @@ class FileProcessor:
             else:
                 return 0
 
-    async def process_single_link(self, link_data):
-        """Обрабатываем одну ссылку с поддержкой множественных ссылок"""
+    def get_pipeline_stages(self):
+        """Этапы обработки ссылки: проба → проверка → скачивание → хэши → БД"""
+        return [
+            ('probe', self.stage_probe, PIPELINE_STAGE_WORKERS['probe']),
+            ('check', self.stage_check, PIPELINE_STAGE_WORKERS['check']),
+            ('download', self.stage_download, PIPELINE_STAGE_WORKERS['download']),
+            ('hash', self.stage_hash, PIPELINE_STAGE_WORKERS['hash']),
+            ('store', self.stage_store, PIPELINE_STAGE_WORKERS['store'])
+        ]
+
+    def on_stage_error(self, link_data, stage_name, error):
+        """Обрабатываем исключение на этапе конвейера"""
+        app_name = link_data.get('app_name', link_data['filename'])
+        self.logger.error(f"❌ Ошибка обработки файла (этап {stage_name}): {error}")
+        self.analyzer.log_processing_error(str(error), f"для {app_name}")
+        # После упавшего элемента завершаем осиротевшие процессы Chromium
+        self.schedule_orphan_reap()
+
+    def schedule_orphan_reap(self):
+        """Фоновая очистка осиротевших процессов Chromium после сбоя"""
+        task = asyncio.get_running_loop().create_task(self.browser_pool.reap_orphans())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def stage_probe(self, link_data):
+        """Этап 1: определяем лучшую ссылку и версию"""
         self.logger.info(f"\n🔄 Обрабатываем: {link_data['filename']} (ID: {link_data['news_id']})")
 
         # Извлекаем информацию о приложении
         app_name = self.version_extractor.extract_app_name_from_filename(link_data['filename'])
         file_version = self.version_extractor.extract_version_from_filename(link_data['filename'])
+        link_data['app_name'] = app_name
 
         self.logger.info(f"📱 Приложение: {app_name}")
         self.logger.info(f"🔢 Версия из файла: {file_version}")
@@ -194,181 +296,229 @@ class FileProcessor:
             page_version = None
             if 'apkcombo.com' in best_url:
                 try:
-                    page_version = await self.version_extractor.extract_version_from_page(best_url)
+                    page_version = await self.probe_url_version(best_url)
                 except Exception as e:
                     self.logger.warning(f"⚠️ Ошибка получения версии со страницы APKCombo: {e}")
                     page_version = None
             else:
                 self.logger.info("ℹ️ Версия со страницы будет получена парсером APKPure")
 
+        # Версия со страницы передается загрузчикам, чтобы не открывать страницу повторно
+        link_data['page_version'] = page_version
+
         # Определяем финальную версию (ТОЛЬКО номер версии)
         final_version = self.version_extractor.get_version(link_data['filename'], page_version)
         
         # Убеждаемся что это чистая версия
-        clean_version_for_check = self.version_extractor.extract_clean_version(final_version)
+        link_data['version'] = self.version_extractor.extract_clean_version(final_version)
 
-        self.logger.info(f"🏷️ Финальная версия (только номер): {clean_version_for_check}")
+        self.logger.info(f"🏷️ Финальная версия (только номер): {link_data['version']}")
 
         # Извлекаем дополнительную информацию
-        package_name = self.version_extractor.extract_package_name_from_url(link_data['url'])
-        source_priority = self.version_extractor.get_source_priority(link_data['url'])
+        link_data['package_name'] = self.version_extractor.extract_package_name_from_url(link_data['url'])
+        link_data['source_priority'] = self.version_extractor.get_source_priority(link_data['url'])
         
-        self.logger.info(f"📦 Package name: {package_name or 'N/A'}")
-        self.logger.info(f"⭐ Приоритет источника: {source_priority}")
-
-        # Сначала проверяем версию в поле apk-original
-        self.logger.info("🔍 Проверяем версию в поле apk-original...")
-        need_update_by_apk_original = self.db.check_version_in_apk_original(link_data['news_id'], clean_version_for_check)
+        self.logger.info(f"📦 Package name: {link_data['package_name'] or 'N/A'}")
+        self.logger.info(f"⭐ Приоритет источника: {link_data['source_priority']}")
+        return None
+
+    async def stage_check(self, link_data):
+        """Этап 2: проверяем версию в поле apk-original"""
+        self.logger.info(f"🔍 Проверяем версию в поле apk-original ({link_data['app_name']})...")
+        need_update_by_apk_original = await asyncio.to_thread(
+            self.db.check_version_in_apk_original, link_data['news_id'], link_data['version']
+        )
         
         if not need_update_by_apk_original:
-            self.logger.info("⏭️ Пропускаем, версия в apk-original актуальна")
-            self.analyzer.log_file_processed(app_name, clean_version_for_check, 0, 
+            self.logger.info(f"⏭️ Пропускаем {link_data['app_name']}, версия в apk-original актуальна")
+            self.analyzer.log_file_processed(link_data['app_name'], link_data['version'], 0, 
                                            link_data['url'], is_new=False)
             return True
 
         # Если версия в apk-original устарела, загружаем обновление без проверки дублей
         self.logger.info("🔄 Версия в apk-original устарела, загружаем обновление...")
-        
-        # Пропускаем проверку дублей и сразу переходим к загрузке
-        self.logger.info("📥 Начинаем загрузку файла...")
+        return None
 
-        # Определяем тип парсера и скачиваем файл
-        try:
-            if 'apkcombo.com' in link_data['url']:
-                self.logger.info("🔧 Используем парсер APKCombo")
-                downloaded_file, download_version = await self.downloader.download_from_apkcombo(link_data['url'])
-            elif 'apkpure.com' in link_data['url']:
-                self.logger.info("🔧 Используем парсер APKPure")
-                # Создаем APKPure downloader с той же папкой загрузки
-                apkpure_downloader = APKPureDownloader(self.download_dir)
-                downloaded_file, download_version = await apkpure_downloader.download_from_apkpure(link_data['url'])
-            else:
-                self.logger.error(f"❌ Неподдерживаемый сайт: {link_data['url']}")
-                return False
-
-            if not downloaded_file:
-                self.logger.error("❌ Не удалось скачать файл")
-                return False
-
-            # Если при скачивании получили версию, используем её
-            if download_version and download_version != "Unknown":
-                # Извлекаем только номер версии из download_version
-                clean_download_version = self.version_extractor.extract_clean_version(download_version)
-                clean_version_for_check = clean_download_version
-                self.logger.info(f"🎯 Обновляем версию из процесса скачивания: {clean_version_for_check}")
-
-            # Получаем информацию о файле
-            file_size = downloaded_file.stat().st_size
-            
-            # Вычисляем чексуммы
-            if ENABLE_SHA256_CHECK:
-                self.logger.info("🔐 Вычисляем чексуммы...")
-                checksum, sha256_hash = self.downloader.calculate_checksums_parallel(downloaded_file)
-            else:
-                self.logger.info("🔐 Вычисляем MD5...")
-                checksum = self.downloader.calculate_checksum(downloaded_file)
-                sha256_hash = None
-
-            self.logger.info(f"📊 Размер файла: {file_size} байт")
-            self.logger.info(f"🔐 MD5: {checksum}")
-            if sha256_hash:
-                self.logger.info(f"🔐 SHA-256: {sha256_hash[:16]}...")
-            self.logger.info(f"🏷️ Финальная версия для БД: {clean_version_for_check}")
-            self.logger.info(f"📁 Загруженный файл: {downloaded_file.name}")
-            
-            # Пропускаем проверку дублей, так как версия в apk-original устарела
-            self.logger.info("🔄 Пропускаем проверку дублей, обновляем существующую запись...")
+    async def stage_download(self, link_data):
+        """Этап 3: скачиваем файл выбранным парсером"""
+        self.logger.info(f"📥 Начинаем загрузку файла: {link_data['app_name']}")
 
-            # Получаем расширение файла
-            file_extension = os.path.splitext(downloaded_file.name)[1]
-            
-            # Очищаем имя файла от суффиксов источников
-            from .lib.file_normalizer import FileNormalizer
-            clean_filename = FileNormalizer.clean_source_suffixes(downloaded_file.name)
-            
-            # Переименовываем файл на диске
-            if clean_filename != downloaded_file.name:
-                new_file_path = self.download_dir / clean_filename
-                downloaded_file.rename(new_file_path)
-                downloaded_file = new_file_path
-                self.logger.info(f"📁 Файл переименован: {downloaded_file.name}")
-            
-            self.logger.info(f"🏷️ Чистая версия для БД: {clean_version_for_check}")
-            
-            
-            # Обновляем существующую запись в dle_files вместо создания новой
-            self.logger.info("🔄 Обновляем существующую запись в dle_files...")
-            file_id = self.db.update_existing_file_in_dle_files(
-                link_data['news_id'],
-                app_name,
-                clean_version_for_check,
-                file_extension,
-                clean_filename,  # Передаем очищенное имя файла
-                file_size,
-                checksum,
-                self.download_dir
-            )
+        # Потоковые загрузчики считают чексуммы во время записи файла
+        file_info = {}
 
-            if not file_id:
-                self.logger.error("❌ Не удалось обновить запись в dle_files")
-                return False
-
-            # Обновляем dle_post с читаемым именем (используем тот же file_id)
-            success = self.db.update_dle_post(
-                link_data['news_id'],
-                file_id,
-                app_name,
-                clean_version_for_check,
-                file_extension
+        # Валидаторы прошлого скачивания: тот же файл на сервере повторно не качаем
+        known_validators = None
+        if DOWNLOAD_PRECHECK_ENABLED:
+            known_validators = await asyncio.to_thread(
+                self.db.get_download_validators, link_data['news_id'], link_data.get('package_name')
             )
 
-            if not success:
-                self.logger.error("❌ Не удалось обновить dle_post")
-                return False
-
-            # Добавляем в таблицу отслеживания с улучшенными полями
-            self.db.add_to_tracking(
-                link_data['news_id'],
-                app_name,
-                clean_version_for_check,  # ТОЛЬКО версия, например "1.8.3"
-                file_size,
-                downloaded_file,
-                checksum,
-                link_data['url'],
-                sha256_hash=sha256_hash,
-                package_name=package_name,
-                source_priority=source_priority
-            )
+        # Определяем тип парсера и скачиваем файл
+        if 'apkcombo.com' in link_data['url']:
+            self.logger.info("🔧 Используем парсер APKCombo")
+            # Лимиты хостов загрузчики берут сами: только на навигацию, не на передачу файла
+            async with self.bandwidth.storage_slot(self.download_dir):
+                downloaded_file, download_version = await self.downloader.download_from_apkcombo(
+                    link_data['url'], page_version=link_data.get('page_version'), file_info=file_info,
+                    known_validators=known_validators
+                )
+        elif 'apkpure.com' in link_data['url']:
+            self.logger.info("🔧 Используем парсер APKPure")
+            # Создаем APKPure downloader с той же папкой загрузки
+            apkpure_downloader = APKPureDownloader(self.download_dir, host_limiter=self.host_limiter,
+                                                    browser_pool=self.browser_pool)
+            async with self.bandwidth.storage_slot(self.download_dir):
+                downloaded_file, download_version = await apkpure_downloader.download_from_apkpure(
+                    link_data['url'], page_version=link_data.get('page_version'), file_info=file_info,
+                    known_validators=known_validators
+                )
+        else:
+            self.logger.error(f"❌ Неподдерживаемый сайт: {link_data['url']}")
+            return False
 
-            self.logger.info(f"✅ Файл {clean_filename} успешно обработан с версией {clean_version_for_check}!")
-            self.analyzer.log_file_processed(app_name, clean_version_for_check, file_size, 
-                                           link_data['url'], is_new=True)
+        if not downloaded_file and file_info.get('unchanged'):
+            self.logger.info(f"⏭️ Пропускаем {link_data['app_name']}: файл на сервере тот же, что в file_tracking")
+            self.analyzer.log_file_processed(link_data['app_name'], link_data['version'], 0,
+                                           link_data['url'], is_new=False)
             return True
 
-        except Exception as e:
-            self.logger.error(f"❌ Ошибка обработки файла: {e}")
-            self.analyzer.log_processing_error(str(e), f"для {app_name}")
+        if not downloaded_file:
+            self.logger.error(f"❌ Не удалось скачать файл: {link_data['app_name']}")
+            # Загрузчики перехватывают свои исключения, поэтому сбой браузера
+            # при скачивании виден только по результату
+            self.schedule_orphan_reap()
             return False
 
-    async def process_links_file(self):
-        """Обрабатываем файл со ссылками"""
-        if not os.path.exists(LINKS_FILE):
-            self.logger.error(f"❌ Файл {LINKS_FILE} не найден")
-            return
+        # Если при скачивании получили версию, используем её
+        if download_version and download_version != "Unknown":
+            # Извлекаем только номер версии из download_version
+            link_data['version'] = self.version_extractor.extract_clean_version(download_version)
+            self.logger.info(f"🎯 Обновляем версию из процесса скачивания: {link_data['version']}")
+
+        link_data['downloaded_file'] = downloaded_file
+        link_data['file_info'] = file_info
+        self.logger.info(f"📶 Общая скорость загрузок: {self.bandwidth.get_current_mbps():.1f} MB/s")
+        return None
+
+    async def stage_hash(self, link_data):
+        """Этап 4: вычисляем размер и чексуммы файла"""
+        downloaded_file = link_data['downloaded_file']
+        link_data['file_size'] = downloaded_file.stat().st_size
+        file_info = link_data.get('file_info') or {}
+        
+        # Чексуммы уже посчитаны при записи (HTTP-загрузка), файл не перечитываем;
+        # заново читаются только файлы, сохраненные браузером
+        hashed_on_write = (
+            file_info.get('checksum')
+            and file_info.get('file_size') == link_data['file_size']
+            and (file_info.get('sha256_hash') or not ENABLE_SHA256_CHECK)
+        )
+        if hashed_on_write:
+            self.logger.info(f"🔐 Чексуммы получены при скачивании: {downloaded_file.name}")
+            checksum = file_info['checksum']
+            sha256_hash = file_info.get('sha256_hash')
+        elif ENABLE_SHA256_CHECK:
+            self.logger.info(f"🔐 Вычисляем чексуммы: {downloaded_file.name}")
+            checksum, sha256_hash = await asyncio.to_thread(self.downloader.calculate_checksums_parallel, downloaded_file)
+        else:
+            self.logger.info(f"🔐 Вычисляем MD5: {downloaded_file.name}")
+            checksum = await asyncio.to_thread(self.downloader.calculate_checksum, downloaded_file)
+            sha256_hash = None
+
+        link_data['checksum'] = checksum
+        link_data['sha256_hash'] = sha256_hash
+
+        self.logger.info(f"📊 Размер файла: {link_data['file_size']} байт")
+        self.logger.info(f"🔐 MD5: {checksum}")
+        if sha256_hash:
+            self.logger.info(f"🔐 SHA-256: {sha256_hash[:16]}...")
+        self.logger.info(f"🏷️ Финальная версия для БД: {link_data['version']}")
+        self.logger.info(f"📁 Загруженный файл: {downloaded_file.name}")
+        return None
+
+    async def stage_store(self, link_data):
+        """Этап 5: переименовываем файл и обновляем dle_files, dle_post и file_tracking"""
+        downloaded_file = link_data['downloaded_file']
+        app_name = link_data['app_name']
+        version = link_data['version']
+
+        # Пропускаем проверку дублей, так как версия в apk-original устарела
+        self.logger.info("🔄 Пропускаем проверку дублей, обновляем существующую запись...")
+
+        # Получаем расширение файла
+        file_extension = os.path.splitext(downloaded_file.name)[1]
+        
+        # Очищаем имя файла от суффиксов источников
+        from .lib.file_normalizer import FileNormalizer
+        clean_filename = FileNormalizer.clean_source_suffixes(downloaded_file.name)
+        
+        # Переименовываем файл на диске
+        if clean_filename != downloaded_file.name:
+            new_file_path = self.download_dir / clean_filename
+            downloaded_file.rename(new_file_path)
+            downloaded_file = new_file_path
+            self.logger.info(f"📁 Файл переименован: {downloaded_file.name}")
+        
+        self.logger.info(f"🏷️ Чистая версия для БД: {version}")
+        
+        
+        # Обновляем существующую запись в dle_files вместо создания новой
+        self.logger.info("🔄 Обновляем существующую запись в dle_files...")
+        file_id = await asyncio.to_thread(
+            self.db.update_existing_file_in_dle_files,
+            link_data['news_id'],
+            app_name,
+            version,
+            file_extension,
+            clean_filename,  # Передаем очищенное имя файла
+            link_data['file_size'],
+            link_data['checksum'],
+            self.download_dir
+        )
 
-        self.logger.info(f"📄 Читаем файл: {LINKS_FILE}")
+        if not file_id:
+            self.logger.error("❌ Не удалось обновить запись в dle_files")
+            return False
 
-        with open(LINKS_FILE, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        # Обновляем dle_post с читаемым именем (используем тот же file_id)
+        success = await asyncio.to_thread(
+            self.db.update_dle_post,
+            link_data['news_id'],
+            file_id,
+            app_name,
+            version,
+            file_extension
+        )
 
-        self.logger.info(f"📊 Найдено {len(lines)} строк")
+        if not success:
+            self.logger.error("❌ Не удалось обновить dle_post")
+            return False
 
-        # Начинаем анализ дублей
-        self.analyzer.start_processing()
+        # Добавляем в таблицу отслеживания с улучшенными полями
+        await asyncio.to_thread(
+            self.db.add_to_tracking,
+            link_data['news_id'],
+            app_name,
+            version,  # ТОЛЬКО версия, например "1.8.3"
+            link_data['file_size'],
+            downloaded_file,
+            link_data['checksum'],
+            link_data['url'],
+            sha256_hash=link_data['sha256_hash'],
+            package_name=link_data['package_name'],
+            source_priority=link_data['source_priority'],
+            remote_etag=link_data['file_info'].get('remote_etag'),
+            remote_size=link_data['file_info'].get('remote_size'),
+            remote_filename=link_data['file_info'].get('remote_filename')
+        )
 
-        processed = 0
-        errors = 0
+        self.logger.info(f"✅ Файл {clean_filename} успешно обработан с версией {version}!")
+        self.analyzer.log_file_processed(app_name, version, link_data['file_size'], 
+                                       link_data['url'], is_new=True)
+        return True
 
+    async def iter_link_items(self, lines):
+        """Парсим строки файла и отдаем только поддерживаемые ссылки"""
         for i, line in enumerate(lines, 1):
             self.logger.info(f"\n{'='*50}")
             self.logger.info(f"📝 Строка {i}/{len(lines)}")
@@ -389,17 +539,103 @@ class FileProcessor:
                 self.logger.info(f"⏭️ Пропускаем неподдерживаемые ссылки: {link_data['urls']}")
                 continue
 
-            try:
-                success = await self.process_single_link(link_data)
-                if success:
-                    processed += 1
-                else:
-                    errors += 1
+            # Редко обновляемые приложения проверяются не каждый запуск
+            if self.recheck_scheduler:
+                # Пакеты всех ссылок строки (источники могут давать разные package name)
+                package_names = list(dict.fromkeys(
+                    package for package in map(self.version_extractor.extract_package_name_from_url, link_data['urls'])
+                    if package
+                ))
+                link_data['recheck_packages'] = package_names
+                should_probe = await asyncio.to_thread(self.recheck_scheduler.should_probe, package_names, link_data)
+                if not should_probe:
+                    skipped = self.recheck_scheduler.skipped[-1]
+                    self.logger.info(f"⏭️ {skipped['package_name']}: по расписанию следующая проверка {skipped['next_check']}")
+                    continue
+
+            link_data['line_number'] = i
+            yield link_data
 
-            except Exception as e:
-                self.logger.error(f"❌ Критическая ошибка обработки строки {i}: {e}")
-                errors += 1
-                continue
+    async def process_links_file(self):
+        """Обрабатываем файл со ссылками"""
+        if not os.path.exists(LINKS_FILE):
+            self.logger.error(f"❌ Файл {LINKS_FILE} не найден")
+            return
+
+        self.logger.info(f"📄 Читаем файл: {LINKS_FILE}")
+
+        with open(LINKS_FILE, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+
+        self.logger.info(f"📊 Найдено {len(lines)} строк")
+
+        # Начинаем анализ дублей
+        self.analyzer.start_processing()
+
+        # История версий из file_tracking для оценки интервалов обновлений
+        if self.recheck_scheduler and not self.recheck_scheduler.force:
+            history = await asyncio.to_thread(self.db.get_tracking_history)
+            imported = await asyncio.to_thread(self.probe_store.import_tracking_history, history)
+            self.logger.info(f"📚 История версий: {len(history)} записей file_tracking, новых {imported}")
+
+        totals = {'processed': 0, 'errors': 0}
+        # Успешно обработанные пакеты: проверка засчитывается расписанию только для них
+        checked_packages = []
+
+        def on_finished(link_data, success):
+            if success:
+                totals['processed'] += 1
+                checked_at = time.time()
+                checked_packages.extend((package, checked_at) for package in link_data.get('recheck_packages', []))
+            else:
+                totals['errors'] += 1
+            # Текущая скорость загрузок обновляется в метриках по ходу прогона
+            self.analyzer.record_run_stats('bandwidth', self.bandwidth.get_stats())
+
+        # Этапы связаны ограниченными очередями, число элементов в работе
+        # ограничено max_concurrency
+        pipeline = Pipeline(
+            self.get_pipeline_stages(),
+            queue_size=PIPELINE_QUEUE_SIZE,
+            max_in_flight=self.max_concurrency,
+            on_finished=on_finished,
+            on_error=self.on_stage_error
+        )
+
+        self.logger.info(f"⚙️ Конвейер: до {self.max_concurrency} элементов в работе, воркеры по этапам: {PIPELINE_STAGE_WORKERS}")
+        await self.browser_pool.start()
+        try:
+            await pipeline.run(self.iter_link_items(lines))
+        finally:
+            # Очистка процессов после ошибок должна завершиться до остановки пула
+            if self._background_tasks:
+                await asyncio.gather(*list(self._background_tasks), return_exceptions=True)
+            # Закрываем все браузеры пула и HTTP-сессии
+            await self.browser_pool.stop()
+            get_session_pool().close_all()
+            if checked_packages:
+                await asyncio.to_thread(self.probe_store.record_checks, checked_packages)
+            # Время обращений к кэшу страниц для LRU следующих запусков
+            if self.version_extractor.page_cache:
+                await asyncio.to_thread(self.version_extractor.page_cache.flush)
+
+        processed = totals['processed']
+        errors = totals['errors']
+
+        # Статистика ожидания Cloudflare
+        self.analyzer.record_run_stats('version_probe', self.version_extractor.get_probe_stats())
+        self.analyzer.record_run_stats('probe_store', self.probe_store.stats)
+        if self.recheck_scheduler:
+            self.analyzer.record_run_stats('recheck_schedule', self.recheck_scheduler.stats)
+            report_path = self.recheck_scheduler.save_skipped_report()
+            if report_path:
+                self.logger.info(f"📋 Пропущено по расписанию: {len(self.recheck_scheduler.skipped)}, отчет: {report_path}")
+        self.analyzer.record_run_stats('cloudflare_probe', self.version_extractor.cloudflare.stats)
+        self.analyzer.record_run_stats('cloudflare_download', self.downloader.cloudflare.stats)
+        self.analyzer.record_run_stats('resource_blocking', self.browser_pool.resource_blocker.stats)
+        self.analyzer.record_run_stats('browser_pool', self.browser_pool.stats)
+        self.analyzer.record_run_stats('session_pool', get_session_pool().stats)
+        self.analyzer.record_run_stats('bandwidth', self.bandwidth.get_stats())
 
         # Завершаем анализ дублей
         self.analyzer.end_processing()
@@ -411,3 +647,16 @@ class FileProcessor:
         self.logger.info(f"📄 Всего строк: {len(lines)}")
 
 
+def main():
+    """Запуск обработки step4_links.txt из командной строки"""
+    parser = argparse.ArgumentParser(description="Parser1 - обработка ссылок из step4_links.txt")
+    parser.add_argument('--force-recheck', action='store_true',
+                        help="проверять все строки, игнорируя расписание перепроверки")
+    args = parser.parse_args()
+
+    processor = FileProcessor(force_recheck=True if args.force_recheck else None)
+    asyncio.run(processor.process_links_file())
+
+
+if __name__ == "__main__":
+    main()
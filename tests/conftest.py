@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Общие фикстуры тестов
+Модули пакета используют относительные импорты (from ..config), поэтому
+пакет импортируется по имени каталога репозитория из родительского каталога
+"""
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+if str(REPO_DIR.parent) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR.parent))
+
+
+def import_lib_module(name):
+    """Импортируем модуль lib/ как часть пакета репозитория"""
+    return importlib.import_module(f"{REPO_DIR.name}.lib.{name}")
+
+
+@pytest.fixture
+def load_fixture():
+    """Читаем сохраненную HTML-страницу из tests/fixtures"""
+    def load(name):
+        return (FIXTURES_DIR / name).read_text(encoding='utf-8')
+    return load
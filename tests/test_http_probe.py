@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Тесты HTTP-пробы версии на сохраненных страницах
+"""
+import pytest
+
+from conftest import import_lib_module
+
+pytest.importorskip('bs4')
+pytest.importorskip('cloudscraper')
+pytest.importorskip('playwright')
+HttpVersionProbe = import_lib_module('http_probe').HttpVersionProbe
+
+
+class FakeResponse:
+    def __init__(self, html, url, status_code=200):
+        self.text = html
+        self.url = url
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, **kwargs):
+        return self.response
+
+
+class FakeSessionPool:
+    def __init__(self, session):
+        self.session = session
+
+    def acquire(self, url):
+        return self.session
+
+    def release(self, url, session, discard=False):
+        pass
+
+
+class FakeClearanceStore:
+    def apply_to_session(self, session, url):
+        return False
+
+    def save_from_session(self, session, url):
+        pass
+
+
+def make_probe(html, url):
+    session = FakeSession(FakeResponse(html, url))
+    return HttpVersionProbe(clearance_store=FakeClearanceStore(), session_pool=FakeSessionPool(session))
+
+
+def test_version_from_structured_data(load_fixture):
+    url = 'https://apkcombo.com/brawl-stars/com.supercell.brawlstars/'
+    probe = make_probe(load_fixture('apkcombo_json_ld.html'), url)
+
+    assert probe.fetch_version(url) == (HttpVersionProbe.HIT, '58.279')
+
+
+def test_number_in_page_text_is_not_a_version(load_fixture):
+    """'Rating 4.3' без элемента версии - NO_MATCH, версию ищет браузер"""
+    url = 'https://apkpure.com/subway-surfers/com.kiloo.subwaysurf'
+    probe = make_probe(load_fixture('apkpure_rating_only.html'), url)
+
+    assert probe.fetch_version(url) == (HttpVersionProbe.NO_MATCH, None)
+    assert probe.stats['no_match'] == 1
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Тесты извлечения данных приложения из сохраненных страниц apkcombo/apkpure
+"""
+import pytest
+
+from conftest import import_lib_module
+
+pytest.importorskip('bs4')
+StructuredDataExtractor = import_lib_module('structured_data').StructuredDataExtractor
+PageVersionParser = import_lib_module('page_version').PageVersionParser
+
+
+def test_json_ld_apkcombo(load_fixture):
+    """Версия, размер и package name из JSON-LD MobileApplication (ссылка Google Play в identifier)"""
+    data = StructuredDataExtractor.extract(load_fixture('apkcombo_json_ld.html'))
+
+    assert data == {
+        'version': '58.279',
+        'source': 'json-ld',
+        'package_name': 'com.supercell.brawlstars',
+        'size': '1.1 GB'
+    }
+
+
+def test_embedded_json_apkpure(load_fixture):
+    """Без JSON-LD и meta данные берутся из window.__INITIAL_STATE__"""
+    data = StructuredDataExtractor.extract(load_fixture('apkpure_embedded_json.html'))
+
+    assert data == {
+        'version': '11.5.3',
+        'source': 'embedded-json',
+        'package_name': 'org.telegram.messenger',
+        'size': '68.4 MB'
+    }
+
+
+def test_varies_with_device(load_fixture):
+    """'Varies with device' не считается версией и размером, package name остается"""
+    data = StructuredDataExtractor.extract(load_fixture('apkcombo_varies_with_device.html'))
+
+    assert 'version' not in data
+    assert 'source' not in data
+    assert 'size' not in data
+    assert data['package_name'] == 'com.google.android.apps.maps'
+
+
+@pytest.mark.parametrize('html', ['', None])
+def test_empty_html(html):
+    assert StructuredDataExtractor.extract(html) == {}
+
+
+def test_no_structured_data(load_fixture):
+    """Страница без разметки (проверка Cloudflare) - пустой результат для запасного разбора"""
+    assert StructuredDataExtractor.extract(load_fixture('no_structured_data.html')) == {}
+
+
+def test_fallback_to_selectors(load_fixture):
+    """Без структурированных данных версия берется селекторами страницы"""
+    html = load_fixture('apkpure_selectors_only.html')
+    url = 'https://apkpure.com/whatsapp-messenger/com.whatsapp'
+
+    assert StructuredDataExtractor.extract(html) == {}
+    soup = PageVersionParser.parse_html(html)
+    assert PageVersionParser.extract_from_soup(soup, url, use_page_text=False) == '2.24.21'
+
+
+def test_fallback_without_version(load_fixture):
+    soup = PageVersionParser.parse_html(load_fixture('no_structured_data.html'))
+
+    assert PageVersionParser.extract_from_soup(soup, 'https://apkcombo.com/app/com.example', use_page_text=False) is None
+
+
+def test_page_text_fallback_is_optional(load_fixture):
+    """Поиск по тексту страницы берет любое число ('Rating 4.3'), без него версии нет"""
+    html = load_fixture('apkpure_rating_only.html')
+    url = 'https://apkpure.com/subway-surfers/com.kiloo.subwaysurf'
+
+    assert PageVersionParser.extract_from_soup(PageVersionParser.parse_html(html), url, use_page_text=False) is None
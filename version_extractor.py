@@ -2,13 +2,29 @@
 """
 Модуль для извлечения версий из файлов и веб-страниц
 """
-import re
-from playwright.async_api import async_playwright
-from .config import BROWSER_ARGS, USER_AGENT, CLOUDFLARE_TIMEOUT, PAGE_LOAD_TIMEOUT
+import asyncio
+from .config import CLOUDFLARE_TIMEOUT, PAGE_LOAD_TIMEOUT, HTTP_PROBE_ENABLED, PAGE_CACHE_ENABLED
 from .lib.version_utils import VersionUtils
+from .lib.browser_pool import get_browser_pool
+from .lib.page_version import PageVersionParser
+from .lib.cloudflare import CloudflareGuard
+from .lib.http_probe import HttpVersionProbe
+from .lib.page_cache import get_page_cache
 
 
 class VersionExtractor:
+    def __init__(self, browser_pool=None):
+        # Общий пул браузеров вместо запуска Chromium на каждую страницу
+        self.browser_pool = browser_pool or get_browser_pool()
+        self.cloudflare = CloudflareGuard()
+        # Кэш страниц на диске общий для HTTP-пробы и браузера
+        self.page_cache = get_page_cache() if PAGE_CACHE_ENABLED else None
+        # Сначала пробуем получить версию по HTTP, браузер - запасной путь
+        self.http_probe = HttpVersionProbe(
+            self.cloudflare.clearance_store, page_cache=self.page_cache
+        ) if HTTP_PROBE_ENABLED else None
+        self.probe_sources = {'cache': 0, 'http': 0, 'browser': 0}
+
     def extract_version_from_filename(self, filename):
         """Извлекаем версию из имени файла с улучшенной обработкой"""
         version = VersionUtils.extract_version_from_text(filename)
@@ -19,187 +35,77 @@ class VersionExtractor:
         return VersionUtils.extract_app_name_from_filename(filename)
 
     async def extract_version_from_page(self, url):
-        """Извлекаем версию со страницы приложения"""
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=BROWSER_ARGS
-            )
-            context = await browser.new_context(
-                user_agent=USER_AGENT
-            )
-            page = await context.new_page()
+        """Извлекаем версию со страницы приложения: кэш, HTTP-проба, затем браузер"""
+        if self.page_cache:
+            version = self.page_cache.get_fresh_version(url)
+            if version:
+                self.probe_sources['cache'] += 1
+                print(f"💾 Версия из кэша страниц: {version} ({url})")
+                return version
 
+        if self.http_probe:
+            result, version = await self.http_probe.probe(url)
+            if result == HttpVersionProbe.HIT:
+                self.probe_sources['http'] += 1
+                print(f"⚡ Версия получена по HTTP без браузера: {version}")
+                return version
+            print(f"🌐 HTTP-проба без результата ({result}), открываем браузер")
+
+        self.probe_sources['browser'] += 1
+        return await self.extract_version_with_browser(url)
+
+    async def extract_version_with_browser(self, url):
+        """Извлекаем версию со страницы приложения через Playwright"""
+        async with self.browser_pool.page(profile_url=url) as page:
             try:
                 print(f"🌐 Получаем версию со страницы: {url}")
-                await page.goto(url, wait_until="domcontentloaded", timeout=PAGE_LOAD_TIMEOUT)
+                response = await page.goto(url, wait_until="domcontentloaded", timeout=PAGE_LOAD_TIMEOUT)
                 
                 # Ждем прохождения Cloudflare если есть
                 await self._wait_for_cloudflare(page)
                 
-                # Ищем версию с улучшенными селекторами
-                version_selectors = []
-                
-                # Определяем селекторы в зависимости от сайта
-                if 'apkcombo.com' in url:
-                    version_selectors = [
-                        "div.version",
-                        ".version",
-                        "[class*='version']",
-                        ".app-version",
-                        ".ver",
-                        "[class*='ver']",
-                        "span.version",
-                        "div.ver",
-                        ".app-info .version",
-                        ".download-info .version",
-                        "div[class*='app'] span[class*='version']",
-                        ".info .version",
-                        "div.info span.version"
-                    ]
-                elif 'apkpure.com' in url:
-                    version_selectors = [
-                        "div.version",
-                        ".version",
-                        "[class*='version']",
-                        ".app-version",
-                        ".ver",
-                        "[class*='ver']",
-                        "span.version",
-                        "div.ver",
-                        ".details .version",
-                        ".app-details .version",
-                        ".info .version",
-                        "div[class*='detail'] span[class*='version']",
-                        ".version-info",
-                        "div[class*='version']"
-                    ]
-                else:
-                    # Универсальные селекторы
-                    version_selectors = [
-                        "div.version", ".version", "[class*='version']", ".app-version",
-                        ".ver", "[class*='ver']", "span.version", "div.ver"
-                    ]
-                
-                print(f"🔍 Ищем версию с {len(version_selectors)} селекторами...")
-                
-                for i, selector in enumerate(version_selectors, 1):
-                    try:
-                        print(f"  {i}. Проверяем селектор: {selector}")
-                        element = await page.query_selector(selector)
-                        if element:
-                            version_text = await element.inner_text()
-                            print(f"    📄 Найден текст: '{version_text.strip()}'")
-                            
-                            # Расширенный поиск версии
-                            version_patterns = [
-                                r'(\d+\.\d+\.\d+)',           # 1.2.3
-                                r'(\d+\.\d+)',                # 1.2
-                                r'Version\s*:?\s*(\d+\.\d+\.\d+)',  # Version: 1.2.3
-                                r'Версия\s*:?\s*(\d+\.\d+\.\d+)',   # Версия: 1.2.3
-                                r'v(\d+\.\d+\.\d+)',          # v1.2.3
-                                r'(\d+\.\d+\.\d+\.\d+)'       # 1.2.3.4
-                            ]
-                            
-                            for pattern in version_patterns:
-                                version_match = re.search(pattern, version_text, re.IGNORECASE)
-                                if version_match:
-                                    version = version_match.group(1)
-                                    print(f"    ✅ Найдена версия: {version}")
-                                    return version
-                        else:
-                            print(f"    ❌ Элемент не найден")
-                    except Exception as e:
-                        print(f"    ⚠️ Ошибка: {e}")
-                        continue
-                
-                # Если версия не найдена через селекторы, ищем в тексте страницы
-                print("🔍 Ищем версию в тексте страницы...")
-                try:
-                    page_text = await page.inner_text('body')
-                    print(f"📄 Получен текст страницы ({len(page_text)} символов)")
-                    
-                    # Ищем версии в тексте страницы
-                    version_patterns = [
-                        r'Version\s*:?\s*(\d+\.\d+\.\d+)',
-                        r'Версия\s*:?\s*(\d+\.\d+\.\d+)',
-                        r'v(\d+\.\d+\.\d+)',
-                        r'(\d+\.\d+\.\d+)',
-                        r'(\d+\.\d+)'
-                    ]
-                    
-                    for pattern in version_patterns:
-                        matches = re.findall(pattern, page_text, re.IGNORECASE)
-                        if matches:
-                            # Берем первую найденную версию
-                            version = matches[0]
-                            print(f"✅ Найдена версия в тексте страницы: {version}")
-                            return version
-                    
-                    print("❌ Версия не найдена в тексте страницы")
-                    
-                except Exception as e:
-                    print(f"❌ Ошибка поиска в тексте страницы: {e}")
-                
-                print("⚠️ Версия не найдена на странице")
-                return None
+                version = await self.extract_version_from_loaded_page(page, url)
+                if version and self.page_cache:
+                    await self._store_page_in_cache(page, url, version, response)
+                return version
                 
             except Exception as e:
                 print(f"❌ Ошибка получения версии со страницы: {e}")
                 return None
-            finally:
-                await context.close()
-                await browser.close()
+
+    async def extract_version_from_loaded_page(self, page, url):
+        """Извлекаем версию из уже загруженной страницы без повторной навигации"""
+        version = await PageVersionParser.extract_from_page(page, url)
+        if not version:
+            print("⚠️ Версия не найдена на странице")
+        return version
+
+    async def _store_page_in_cache(self, page, url, version, response=None):
+        """Сохраняем отрисованную страницу и версию в кэш"""
+        try:
+            html = await page.content()
+            headers = response.headers if response else {}
+            await asyncio.to_thread(
+                self.page_cache.put, url, html, version,
+                headers.get('etag'), headers.get('last-modified')
+            )
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить страницу в кэш: {e}")
+
+    def get_probe_stats(self):
+        """Статистика источников проб версии (доля HTTP без браузера)"""
+        stats = dict(self.probe_sources)
+        total = stats['cache'] + stats['http'] + stats['browser']
+        stats['http_hit_rate'] = stats['http'] / total if total else 0.0
+        if self.http_probe:
+            stats.update({f"http_{key}": value for key, value in self.http_probe.stats.items()})
+        if self.page_cache:
+            stats.update({f"cache_{key}": value for key, value in self.page_cache.stats.items()})
+        return stats
 
     async def _wait_for_cloudflare(self, page, max_wait=CLOUDFLARE_TIMEOUT):
         """Ждем прохождения проверки Cloudflare"""
-        import asyncio
-        
-        print("🔄 Проверяем наличие Cloudflare...")
-        for i in range(max_wait):
-            await asyncio.sleep(1)
-            try:
-                current_url = page.url
-                page_title = await page.title()
-                
-                # Проверяем индикаторы Cloudflare
-                cf_indicators = [
-                    "div.cf-browser-verification",
-                    "div.cf-checking-browser",
-                    "[data-ray]",
-                    "h1:has-text('Checking your browser')",
-                    "h1:has-text('Just a moment')"
-                ]
-                
-                is_cf_active = False
-                for indicator in cf_indicators:
-                    try:
-                        element = await page.query_selector(indicator)
-                        if element:
-                            is_cf_active = True
-                            break
-                    except:
-                        continue
-                
-                # Проверяем по заголовку и URL
-                if ("just a moment" in page_title.lower() or
-                    "checking" in page_title.lower() or
-                    "cloudflare" in current_url.lower()):
-                    is_cf_active = True
-                
-                if not is_cf_active:
-                    print("✅ Cloudflare проверка пройдена или отсутствует")
-                    return True
-                    
-                if i % 10 == 0:
-                    print(f"⏳ Ждем Cloudflare... ({i+1}/{max_wait})")
-                    
-            except Exception as e:
-                print(f"   Ошибка при проверке Cloudflare: {e}")
-                continue
-                
-        print("⚠️ Превышено время ожидания Cloudflare")
-        return False
+        return await self.cloudflare.wait(page, max_wait)
 
     def extract_clean_version(self, version_text):
         """Извлекаем только номер версии из любого текста с улучшенной обработкой"""